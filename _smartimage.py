@@ -5,8 +5,8 @@ Modern zipped+xml image editor format
 """
 from typing import *
 import os
-import io
 import zipfile
+import tempfile
 try:
     # first try to use bohrium, since it could help us accelerate
     # https://bohrium.readthedocs.io/users/python/
@@ -18,6 +18,12 @@ import lxml
 from backedObject import XmlBackedDocument
 from smartimage.layer import *
 from smartimage.form import Form
+from smartimage.renderCache import SHARED_RENDER_CACHE,RenderCache,DiskRenderCache,hashStream
+from smartimage.dependencies import DependencyGraph
+from smartimage.layerIndex import LayerIndex
+from smartimage.componentStream import ComponentContainer,componentStream,copyStream
+from smartimage.fontIndex import componentFonts,fontKey,defaultFontIndex,prefetchFonts
+from smartimage.compositing import aspectSize
 
 
 class SmartImage(XmlBackedDocument,Layer):
@@ -52,9 +58,9 @@ class SmartImage(XmlBackedDocument,Layer):
         self._moreComponents={}
         self._loaded=False
         self._hasRunUi=False
-        self._variables=None
+        self._variables={}
         self._varAuto=[]
-        self._zipfile=None
+        self._container=None
         self.textAlignment=None
         if topSmartimage is None:
             # we are the top, so we'll take care of the peer list
@@ -65,8 +71,17 @@ class SmartImage(XmlBackedDocument,Layer):
         else:
             self._topSmartimage=topSmartimage
         self.autoUi=True
+        # decoded image components (see imageByRef)
+        self.decodedImages:RenderCache=RenderCache(maxBytes=256*1024*1024)
         self.load(filename,xmlName)
         self.cacheRenderedLayers=True # trade memory for speed
+        # NOTE: the shared cache is bounded, but to give a document its own
+        # memory budget, assign it a RenderCache(maxBytes=...)
+        self.renderCache:RenderCache=SHARED_RENDER_CACHE
+        self.renderWorkers=1 # how many threads to render with
+        # remember what was composited so that re-renders only redo what changed
+        # (trades memory for speed when the same image is edited and re-rendered)
+        self.trackDamage=False
 
     # TODO: remove?
     @property
@@ -100,11 +115,74 @@ class SmartImage(XmlBackedDocument,Layer):
         """
         get all of the forms in this document
         """
-        ret=[]
-        forms=self.xml.xpath('//*/form')
-        for form in forms:
-            ret.append(Form(self,form))
-        return ret
+        if self._forms is None:
+            self._forms=[]
+            for form in self.xml.xpath('//*/form'):
+                self._forms.append(Form(self,form))
+        return self._forms
+
+    def getVariable(self,name:str)->Union['FormElement',None]:
+        """
+        get a variable by name or id
+
+        returns None if there is no such variable
+        """
+        for variable in self.variables:
+            if variable.name==name or str(variable.elementId)==name:
+                return variable
+        return None
+
+    @property
+    def layerIndex(self)->LayerIndex:
+        """
+        an index to quickly find layers by id or name
+        """
+        if self._layerIndex is None:
+            self._layerIndex=LayerIndex(self)
+        return self._layerIndex
+
+    def layerCreated(self,layer:Layer)->NoReturn:
+        """
+        called whenever a new layer object is created within this document
+        """
+        if self._layerIndex is not None:
+            self._layerIndex.add(layer)
+        if self._dependencies is not None:
+            self._dependencies.layerAdded(layer)
+
+    def layerRemoved(self,layer:Layer)->NoReturn:
+        """
+        called whenever a layer object (and so all of its children)
+        is dropped from this document
+        """
+        if layer._children is not None:
+            for child in layer._children:
+                self.layerRemoved(child)
+        if self._layerIndex is not None:
+            self._layerIndex.remove(layer)
+        if self._dependencies is not None:
+            self._dependencies.layerRemoved(layer)
+
+    @property
+    def dependencies(self)->DependencyGraph:
+        """
+        what depends upon what within this document
+        (used to decide what needs to be re-rendered when something changes)
+        """
+        if self._dependencies is None:
+            self._dependencies=DependencyGraph(self)
+        return self._dependencies
+
+    def variableChanged(self,variable:Union[str,'FormElement'])->NoReturn:
+        """
+        call whenever the value of a variable changes so that
+        everything depending upon it will be re-rendered
+        """
+        if isinstance(variable,str):
+            self.dependencies.variableChanged(variable)
+        else:
+            self.dependencies.variableChanged(variable.name)
+            self.dependencies.variableChanged(str(variable.elementId))
 
     @property
     def numPages(self)->int:
@@ -182,13 +260,34 @@ class SmartImage(XmlBackedDocument,Layer):
                 ret=self.page[idxOrSlice]
         return ret
 
+    @property
+    def container(self)->ComponentContainer:
+        """
+        the zip file this image was loaded from
+        """
+        if self._container is None:
+            self._container=ComponentContainer(self._filename)
+        return self._container
+
+    def _closeContainer(self)->NoReturn:
+        """
+        let go of the zip file this image was loaded from (if it is open)
+        """
+        if self._container is not None:
+            self._container.close()
+            self._container=None
+
     def getComponent(self,name:str):
         """
         returns a file-like object for the given name
+
+        The object is a lazy, seekable stream, so nothing is actually read
+        until it is used.  (Uncompressed components of a zipped file are
+        memory mapped straight out of the file.)
         """
         f=None
         if name in self._moreComponents:
-            return io.TextIO(self._moreComponents[name])
+            return componentStream(self._moreComponents[name],name)
         if self._filename is not None:
             if os.path.isdir(self._filename):
                 filename=os.path.join(self._filename,name)
@@ -197,15 +296,44 @@ class SmartImage(XmlBackedDocument,Layer):
                 filename=os.path.join(self._filename.rsplit(os.sep,1)[0],name)
                 f=open(filename,'rb')
             else:
-                if self._zipfile is None:
-                    self._zipfile=zipfile.ZipFile(self._filename)
-                f=self._zipfile.open(name)
+                f=self.container.open(name)
         if f is None:
             if name=='smartimage.xml':
                 xml=r"""<?xml version='1.0'?><smartimage/>"""
-                f=io.BinaryIO(xml.encode('utf-8'))
+                f=componentStream(xml,name)
         return f
 
+    def componentDigest(self,name:str)->Union[str,None]:
+        """
+        get a stable hash of the contents of a component
+        (used for render cache keys)
+
+        returns None if there is no such component
+        """
+        if name in self._componentDigests:
+            return self._componentDigests[name]
+        try:
+            component=self.getComponent(name)
+        except (IOError,KeyError):
+            component=None
+        digest=None
+        if component is not None:
+            digest=hashStream(component)
+            component.close()
+        self._componentDigests[name]=digest
+        return digest
+
+    @property
+    def fontComponents(self)->Dict[str,str]:
+        """
+        the fonts embedded in this file, found once per load
+
+        :return: {fontKey:componentName} (see fontIndex.componentFonts)
+        """
+        if self._fontComponents is None:
+            self._fontComponents=componentFonts(self.componentNames)
+        return self._fontComponents
+
     def getPeerSmartimage(self,xmlName:str)->'Smartimage':
         """
         get another smartimage .xml embedded in this file
@@ -285,13 +413,20 @@ class SmartImage(XmlBackedDocument,Layer):
         #print 'GENERATED ID:',idTag
         return idTag
 
-    def imageByRef(self,ref:str,visitedLayers=None)->'PilPlusImage':
+    def imageByRef(self,ref:str,visitedLayers=None,
+        size:Union[Tuple[int,int],None]=None)->'PilPlusImage':
         """
         grab an image by reference
         ref - one of:
             filename
             #id
 
+        :param size: if the image is going to be resized anyway, the (w,h) to resize it to
+            (if given, the result is that size, and jpegs are decoded at reduced resolution)
+            either side can be None to keep the aspect ratio of the image
+
+        Decoded images are kept in self.decodedImages, so asking again is cheap.
+
         WARNING: Do not modify the image without doing a .copy() first!
         """
         ret=None
@@ -304,12 +439,45 @@ class SmartImage(XmlBackedDocument,Layer):
             if l is None:
                 raise Exception('ERR: Missing reference to "'+ref+'"')
             return l.renderImage()
-        component=self.root.getComponent(ref)
-        if component is not None:
-            ret=PilPlusImage(component)
-            #component.close() NOTE: PIL will handle this when it's ready
+        key='%s|%s'%(ref,size)
+        found,ret=self.decodedImages.lookup(key)
+        if found:
+            return ret
+        ret=self._decodeComponent(ref,size)
+        if ret is not None:
+            ret.immutable=True # mark this image so that compositor will not alter it
+        self.decodedImages.put(key,ret)
         return ret
 
+    def _decodeComponent(self,name:str,size:Union[Tuple[int,int],None]=None)->'PilPlusImage':
+        """
+        decode an image component
+
+        :param size: resize to this (w,h), where either side can be None
+            to keep the aspect ratio
+        """
+        from PIL import Image
+        component=self.root.getComponent(name)
+        if component is None:
+            return None
+        if size is None:
+            return PilPlusImage(component)
+            #component.close() NOTE: PIL will handle this when it's ready
+        img=Image.open(component)
+        # (opening only reads the header, so this is cheap)
+        size=aspectSize(img.size,size)
+        if img.format=='JPEG':
+            # jpegs can be decoded at 1/2, 1/4, or 1/8 scale for almost nothing,
+            # so only decode as much as we need to fill the size
+            img.draft(img.mode,size)
+            img=PilPlusImage(img)
+        else:
+            component.close()
+            img=self.imageByRef(name)
+        if img.size!=size:
+            img=img.resize(size,Image.LANCZOS)
+        return img
+
     @property
     def componentNames(self)->List[str]:
         """
@@ -322,11 +490,10 @@ class SmartImage(XmlBackedDocument,Layer):
             pass
         elif os.path.isdir(self._filename):
             for name in os.listdir(self._filename):
-                ret[name]=None
+                if os.path.isfile(os.path.join(self._filename,name)):
+                    ret[name]=None
         else:
-            if self._zipfile is None:
-                self._zipfile=zipfile.ZipFile(self._filename)
-            for name in os.listdir(self._zipfile.namelist()):
+            for name in self.container.namelist():
                 ret[name]=None
         return ret.keys()
 
@@ -365,7 +532,18 @@ class SmartImage(XmlBackedDocument,Layer):
         """
         self._loaded=False
         self._xml=None
-        self._zipfile=None
+        self._closeContainer()
+        self._componentDigests={}
+        self._fontComponents=None
+        self.decodedImages.clear()
+        self._children=None
+        self._forms=None
+        self._layerIndex=None
+        self._dependencies=None
+        self._renderKeyValid=False
+        self._attributes=None
+        self._damage=None
+        self._compositeState=None
         self.currentFont=None
         self.lineSpacing=0
         self.textAlignment='left'
@@ -390,6 +568,11 @@ class SmartImage(XmlBackedDocument,Layer):
             while fn in self.componentNames:
                 fn=internalFileName[0]+str(i)+internalFileName[1]
         self._moreComponents[fn]=data
+        self._componentDigests.pop(fn,None)
+        self._fontComponents=None
+        self.decodedImages.clear()
+        if self._dependencies is not None:
+            self._dependencies.componentChanged(fn)
         return fn
 
     def save(self,filename:Union[str,None]=None):
@@ -406,17 +589,43 @@ class SmartImage(XmlBackedDocument,Layer):
         if filename is None:
             filename=self._filename
         extn=filename.rsplit(os.sep,1)[-1].rsplit('.',1)
-        if len(extn)<2 or extn in ['zip','simg','simt']:
-            zf=zipfile.ZipFile(filename,'w')
-            for name in self.componentNames:
-                component=self.getComponent(name)
-                if name.rsplit('.') in ['xml']:
-                    compress_type=zipfile.ZIP_DEFLATED
-                else:
-                    compress_type=zipfile.ZIP_STORED
-                zf.writestr(name,component.read().decode('utf-8'),compress_type)
-                component.close()
-            zf.close()
+        if len(extn)<2 or extn[1].lower() in ['zip','simg','simt']:
+            # write to a temp file first, since we may be replacing the very
+            # file our components are being read from
+            dirname=os.path.dirname(os.path.abspath(filename))
+            fd,tmpName=tempfile.mkstemp(dir=dirname,suffix='.tmp')
+            os.close(fd)
+            try:
+                with zipfile.ZipFile(tmpName,'w',allowZip64=True) as zf:
+                    for name in self.componentNames:
+                        component=self.getComponent(name)
+                        if component is None:
+                            print('WARN: component "%s" has gone missing, so it is not saved'%name)
+                            continue
+                        info=zipfile.ZipInfo(name)
+                        if name.rsplit('.',1)[-1] in ['xml']:
+                            info.compress_type=zipfile.ZIP_DEFLATED
+                        else:
+                            # images are already compressed, and stored
+                            # components can be memory mapped when loading
+                            info.compress_type=zipfile.ZIP_STORED
+                        # stream it across, rather than reading it all into memory
+                        with component:
+                            with zf.open(info,'w',force_zip64=True) as dest:
+                                copyStream(component,dest)
+                if self._filename is not None and os.path.abspath(filename)==os.path.abspath(self._filename):
+                    # the file can't be replaced while it is still open (on Windows),
+                    # so let go of it, including any images mapped out of it
+                    # (it is opened again when something else is needed from it)
+                    self.decodedImages.clear()
+                    self._closeContainer()
+                os.replace(tmpName,filename)
+            except:
+                try:
+                    os.remove(tmpName)
+                except OSError:
+                    pass
+                raise
         else:
             result=self.renderImage()
             if result is None:
@@ -430,7 +639,10 @@ class SmartImage(XmlBackedDocument,Layer):
         """
         simply set a variable
         """
-        self.variables[name].value=value
+        variable=self.getVariable(name)
+        if variable is None:
+            raise Exception('ERR: No variable named "%s"'%name)
+        variable.value=value
 
     def varFile(self,valuefile:str,name:Union[str,None]=None):
         """
@@ -479,7 +691,8 @@ class SmartImage(XmlBackedDocument,Layer):
             from .ui.tkVarsWindow import runVarsWindow
             runVarsWindow(self.variables,self._filename)
 
-    def renderImage(self,renderContext:Union[None,'RenderingContext']=None)->PilPlusImage:
+    def renderImage(self,renderContext:Union[None,'RenderingContext']=None,
+        workers:Union[int,None]=None)->PilPlusImage:
         """
         NOTE: you probably don't want to call directly, but rather do a
             smartimage[0].renderImage() just to make sure you work with
@@ -488,7 +701,40 @@ class SmartImage(XmlBackedDocument,Layer):
         WARNING: Do not modify the image without doing a .copy() first!
         """
         self.varUi(force=False)
-        return Layer.renderImage(self,renderContext)
+        if renderContext is None:
+            self.prepareFonts()
+        return Layer.renderImage(self,renderContext,workers)
+
+    def renderTiled(self,filename:str,tileSize:int=1024,workers:Union[int,None]=None,
+        size:Union[Tuple[int,int],None]=None)->NoReturn:
+        """
+        render straight to an image file, one tile at a time
+        (see Layer.renderTiled)
+        """
+        self.varUi(force=False)
+        self.prepareFonts()
+        Layer.renderTiled(self,filename,tileSize,workers,size)
+
+    def prepareFonts(self)->NoReturn:
+        """
+        get the fonts this document's text needs ready before rendering
+        starts, rather than one text layer at a time partway through
+
+        The installed fonts are indexed if they never have been
+        (see fontIndex.defaultFontIndex), and any font asked for by name that
+        is not installed is downloaded, just like --prefetchFonts would.
+        """
+        if not self.xml.xpath('//text'):
+            return
+        index=defaultFontIndex()
+        missing=[]
+        for name in self.xml.xpath('//text/@font'):
+            if name in missing or fontKey(name) in self.fontComponents:
+                continue
+            if index.resolve(name) is None and not os.path.isfile(name):
+                missing.append(name)
+        if missing:
+            prefetchFonts(missing,index,refresh=False)
 
     def smartsize(self,size:Tuple[int,int],useGolden:bool=False):
         """
@@ -588,6 +834,7 @@ def cmdline(args):
     else:
         didOutput=False
         simg=None
+        processes=None
         for arg in args:
             if arg.startswith('-'):
                 arg=[a.strip() for a in arg.split('=',1)]
@@ -624,6 +871,14 @@ def cmdline(args):
                         import time
                         #while True:
                         time.sleep(1)
+                elif arg[0]=='--tiled':
+                    didSomething=True
+                    didOutput=True
+                    tiledArgs=arg[1].split(',',1)
+                    tileSize=1024
+                    if len(tiledArgs)>1:
+                        tileSize=int(tiledArgs[1])
+                    simg.renderTiled(tiledArgs[0],tileSize)
                 elif arg[0]=='--roi':
                     didSomething=True
                     didOutput=True
@@ -662,6 +917,51 @@ def cmdline(args):
                     simg.varUi()
                 elif arg[0]=='--noui':
                     simg.autoUi=False
+                elif arg[0]=='--workers':
+                    simg.renderWorkers=int(arg[1])
+                elif arg[0]=='--processes':
+                    processes=int(arg[1])
+                elif arg[0]=='--batch':
+                    didSomething=True
+                    didOutput=True
+                    from smartimage.batch import renderBatch
+                    batchArgs=arg[1].split(',',1)
+                    variableSets=None
+                    if len(batchArgs)>1:
+                        variableSets=batchArgs[1]
+                    # the workers load the template fresh, so pass along
+                    # anything set so far (eg, with --set)
+                    variables={}
+                    for variable in simg.variables:
+                        variables[variable.name]=variable.value
+                    for job in renderBatch(simg._filename,batchArgs[0],variableSets,
+                        processes,simg.renderWorkers,simg.xmlName,variables):
+                        print(job.filename)
+                elif arg[0]=='--cachesize':
+                    SHARED_RENDER_CACHE.maxBytes=int(float(arg[1])*1024*1024)
+                elif arg[0]=='--cachedir':
+                    cacheArgs=arg[1].split(',',1)
+                    maxBytes=1024*1024*1024
+                    if len(cacheArgs)>1:
+                        maxBytes=int(float(cacheArgs[1])*1024*1024)
+                    SHARED_RENDER_CACHE.diskCache=DiskRenderCache(cacheArgs[0],maxBytes)
+                elif arg[0]=='--prefetchFonts':
+                    didSomething=True
+                    didOutput=True
+                    from smartimage.fontIndex import prefetchFonts
+                    names=[]
+                    if len(arg)>1:
+                        names=[name.strip() for name in arg[1].split(',') if name.strip()]
+                    if simg is not None:
+                        # every font the document asks for
+                        for name in simg.xml.xpath('//text/@font'):
+                            if name not in names and fontKey(name) not in simg.fontComponents:
+                                names.append(name)
+                    for name,found in prefetchFonts(names).items():
+                        if found is None:
+                            print('ERR: unable to find font "%s"'%name)
+                        else:
+                            print('%s: %s'%(name,found[0]))
                 elif arg[0]=='--registerPlugins':
                     registerPlugins()
                 else:
@@ -687,6 +987,11 @@ def cmdline(args):
         print('   --image[=filename] ............ get the base image. if no filename,')
         print('         show in a window')
         print('         if multi-image or multi-frame, modify filename to be a numbered sequence')
+        print('   --tiled=filename[,tileSize] ... render straight to a file a tile at a time')
+        print('         (for very large images, default tileSize=1024, png is written as it goes)')
+        print('         NOTE: layers that cannot render part of themselves are still rendered whole:')
+        print('         rotated or cropped layers, numberspace, particles, and modifiers that need')
+        print('         the whole image (contrast, flip, mirror, shadow, convolve with edge=repeat)')
         print('   --roi[=filename] .............. get the region of interest image.')
         print('         if no filename, show in a window')
         print('   --save=filename ............... save out the .simg as another file name')
@@ -696,8 +1001,22 @@ def cmdline(args):
         print('   --varui ....................... manually start user interface now')
         print('   --noui ........................ do not bring up a user interface')
         print('         (useful when setting vars manually)')
+        print('   --workers=n ................... render sibling layers on n threads')
+        print('   --batch=pattern[,vars.csv] .... render every page/frame, once for every row')
+        print('         of a .csv or .jsonl of variable values, saving to a filename pattern')
+        print('         such as "out/card_{index:04d}.png" (see batch.py)')
+        print('         (starting from any --set values, so those must come before --batch)')
+        print('   --processes=n ................. how many processes --batch renders on')
+        print('         (default=one per cpu, must come before --batch)')
+        print('   --cachesize=MB ................ memory budget for rendered layers (default 512MB)')
+        print('   --cachedir=dir[,maxMB] ........ keep rendered layers in a directory')
+        print('         that can be shared between processes (default 1024MB)')
+        print('         (can also be set with the SMARTIMAGE_CACHE_DIR environment variable)')
         print('   --varfile[=name]=value ........ populate a variable based on a filename')
         print('         if name is omitted, attempt to fill in variables smartly')
+        print('   --prefetchFonts[=name,...] .... update the font index and download the named fonts,')
+        print('         and any the document uses, that are not installed')
+        print('         (fonts are never downloaded while rendering)')
         print('   --registerPlugins ............. Register SmartImage as a plugin')
         print('         to all known image programs')
 
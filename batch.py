@@ -0,0 +1,304 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Render a smartimage template many times over, for instance
+once per row of a spreadsheet of variable values, and/or
+once per page or frame.
+
+The renders are spread across a pool of processes, each of which loads
+the template only once and then re-renders it with each new set of values.
+Since only the layers depending upon a changed variable are invalidated
+(see DependencyGraph) everything else comes straight out of the render cache.
+"""
+from typing import *
+import os
+import csv
+import json
+import string
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor,wait,FIRST_COMPLETED
+from smartimage.renderCache import SHARED_RENDER_CACHE,DiskRenderCache
+
+
+class BatchJob:
+    """
+    A single render in a batch
+    """
+
+    def __init__(self,index:int,variables:Dict[str,str],page:int,filename:str):
+        self.index=index
+        self.variables=variables
+        self.page=page
+        self.filename=filename
+
+    def __repr__(self)->str:
+        return 'BatchJob(%d,page=%d,%s)'%(self.index,self.page,self.filename)
+
+
+def readVariableSets(filename:str)->Generator[Dict[str,str],None,None]:
+    """
+    read variable assignments from a file, one set per render
+
+    Can be
+        .csv - the first row is the variable names
+        .jsonl - each line is a json object of name:value
+    """
+    if filename.rsplit('.',1)[-1].lower() in ['jsonl','ndjson']:
+        with open(filename,'r',encoding='utf-8') as f:
+            for line in f:
+                line=line.strip()
+                if line:
+                    yield {k:str(v) for k,v in json.loads(line).items()}
+    else:
+        with open(filename,'r',encoding='utf-8',newline='') as f:
+            for row in csv.DictReader(f):
+                yield {k.strip():v for k,v in row.items() if k is not None}
+
+
+def outputFilename(pattern:str,index:int,page:int,numPages:int,
+    variables:Dict[str,str])->str:
+    """
+    decide what filename a render gets saved as
+
+    :param pattern: a filename that can contain python format fields
+        such as "card_{index:04d}.png", "page{page}.jpg" or "{firstName}.png"
+        (any variable can be used)
+        If it contains no fields, a number is added before the extension.
+    """
+    if pattern.find('{')<0:
+        filename=pattern.rsplit('.',1)
+        if len(filename)<2:
+            filename.append('png')
+        if numPages>1:
+            pattern=filename[0]+'_{index:04d}_{page}.'+filename[1]
+        else:
+            pattern=filename[0]+'_{index:04d}.'+filename[1]
+    fields=dict(variables)
+    fields['index']=index
+    fields['page']=page
+    return pattern.format(**fields)
+
+
+def batchJobs(variableSets:Union[Iterable[Dict[str,str]],None],outputPattern:str,
+    numPages:int=1)->Generator[BatchJob,None,None]:
+    """
+    create a job for every page of every set of variables
+
+    :param variableSets: if None, simply render every page once
+    """
+    if variableSets is None:
+        variableSets=[{}]
+        if outputPattern.find('{')<0 and numPages>1:
+            # only numbering pages
+            filename=outputPattern.rsplit('.',1)
+            if len(filename)<2:
+                filename.append('png')
+            outputPattern=filename[0]+'_{page}.'+filename[1]
+    for index,variables in enumerate(variableSets):
+        for page in range(numPages):
+            filename=outputFilename(outputPattern,index,page,numPages,variables)
+            yield BatchJob(index,variables,page,filename)
+
+
+def checkVariableNames(variableSets:Iterable[Dict[str,str]],known:Iterable[str],
+    outputPattern:str='')->Generator[Dict[str,str],None,None]:
+    """
+    pass variable sets through, warning (once) about any name that is not
+    a variable in the template, since it would otherwise be silently ignored
+    (names used only in the output filename pattern are fine)
+    """
+    known=set(known)
+    known.update([field[1] for field in string.Formatter().parse(outputPattern)
+        if field[1] is not None])
+    warned=set()
+    for variables in variableSets:
+        for name in variables:
+            if name not in known and name not in warned:
+                warned.add(name)
+                print('WARN: "%s" is not a variable in the template, so it is ignored'%name)
+        yield variables
+
+
+# the template, loaded once by each worker process
+_template=None
+_templateDefaults={}
+
+
+def _initWorker(templateFilename:str,xmlName:str,workers:int,
+    diskCache:Union[DiskRenderCache,None],
+    variables:Union[Dict[str,str],None]=None)->NoReturn:
+    """
+    load the template once, when a worker process starts up
+
+    :param variables: values to start out with, instead of
+        what is saved in the template
+    """
+    global _template
+    global _templateDefaults
+    from smartimage._smartimage import SmartImage
+    if diskCache is not None:
+        SHARED_RENDER_CACHE.diskCache=diskCache
+    _template=SmartImage(templateFilename,xmlName)
+    _template.autoUi=False
+    _template.renderWorkers=workers
+    # consecutive jobs often differ only in a few small layers
+    _template.trackDamage=True
+    if variables:
+        for name,value in variables.items():
+            variable=_template.getVariable(name)
+            if variable is not None:
+                variable.value=value
+    _templateDefaults={}
+    for variable in _template.variables:
+        _templateDefaults[variable.name]=variable.value
+
+
+def _renderJob(job:BatchJob)->BatchJob:
+    """
+    render a single job in the worker process and save it out
+    """
+    simg=_template
+    # go back to the template values for anything this job does not set
+    # (only setting what actually changed, so the rest stays cached)
+    values=dict(_templateDefaults)
+    values.update(job.variables)
+    for name,value in values.items():
+        variable=simg.getVariable(name)
+        if variable is None:
+            continue
+        if variable.value!=value:
+            variable.value=value
+    img=simg[job.page].renderImage()
+    dirname=os.path.dirname(job.filename)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname,exist_ok=True)
+    img.save(job.filename)
+    return job
+
+
+def renderBatch(templateFilename:str,outputPattern:str,
+    variableSets:Union[Iterable[Dict[str,str]],str,None]=None,
+    processes:Union[int,None]=None,workers:int=1,
+    xmlName:str='smartimage.xml',
+    variables:Union[Dict[str,str],None]=None)->Generator[BatchJob,None,None]:
+    """
+    render a template many times over, on a pool of processes
+
+    Results are saved as they finish, and the finished jobs are yielded
+    (not necessarily in order), so this can be used as:
+        for job in renderBatch('card.simg','out/card_{index:04d}.png','people.csv'):
+            print(job.filename)
+
+    :param templateFilename: the smartimage to render
+    :param outputPattern: filename pattern (see outputFilename)
+    :param variableSets: a filename to read (see readVariableSets), or
+        a list of {name:value} dicts, or None to simply render each page once
+    :param processes: how many processes to render on (default is one per cpu)
+    :param workers: how many threads each process renders sibling layers on
+    :param xmlName: the name of the starting smartimage within the file
+    :param variables: values every render starts out with (before the
+        variableSets are applied) instead of what is saved in the template
+    """
+    from smartimage._smartimage import SmartImage
+    if isinstance(variableSets,str):
+        variableSets=readVariableSets(variableSets)
+    if processes is None:
+        processes=os.cpu_count() or 1
+    template=SmartImage(templateFilename,xmlName)
+    template.autoUi=False
+    numPages=len(template)
+    known=[variable.name for variable in template.variables]
+    known.extend([str(variable.elementId) for variable in template.variables])
+    if variables:
+        list(checkVariableNames([variables],known))
+    if variableSets is not None:
+        variableSets=checkVariableNames(variableSets,known,outputPattern)
+    jobs=batchJobs(variableSets,outputPattern,numPages)
+    initArgs=(templateFilename,xmlName,workers,SHARED_RENDER_CACHE.diskCache,variables)
+    if processes<2:
+        # no sense in starting up another process
+        executor=ThreadPoolExecutor(1,initializer=_initWorker,initargs=initArgs)
+    else:
+        executor=ProcessPoolExecutor(processes,initializer=_initWorker,initargs=initArgs)
+    with executor:
+        # only keep a few jobs queued up at a time so that
+        # huge variable files are streamed rather than read all at once
+        pending=set()
+        for job in jobs:
+            pending.add(executor.submit(_renderJob,job))
+            if len(pending)>=processes*2:
+                done,pending=wait(pending,return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+
+def cmdline(args):
+    """
+    Run the command line
+
+    :param args: command line arguments (WITHOUT the filename)
+    """
+    printhelp=False
+    if len(args)<1:
+        printhelp=True
+    else:
+        templateFilename=None
+        outputPattern=None
+        variableSets=None
+        processes=None
+        workers=1
+        variables={}
+        for arg in args:
+            if arg.startswith('-'):
+                arg=[a.strip() for a in arg.split('=',1)]
+                if arg[0] in ['-h','--help']:
+                    printhelp=True
+                elif arg[0]=='--vars':
+                    variableSets=arg[1]
+                elif arg[0]=='--set':
+                    name,value=arg[1].split('=',1)
+                    variables[name.strip()]=value
+                elif arg[0]=='--out':
+                    outputPattern=arg[1]
+                elif arg[0]=='--processes':
+                    processes=int(arg[1])
+                elif arg[0]=='--workers':
+                    workers=int(arg[1])
+                elif arg[0]=='--cachedir':
+                    cacheArgs=arg[1].split(',',1)
+                    maxBytes=1024*1024*1024
+                    if len(cacheArgs)>1:
+                        maxBytes=int(float(cacheArgs[1])*1024*1024)
+                    SHARED_RENDER_CACHE.diskCache=DiskRenderCache(cacheArgs[0],maxBytes)
+                else:
+                    print('ERR: unknown argument "'+arg[0]+'"')
+            else:
+                templateFilename=arg
+        if not printhelp:
+            if templateFilename is None or outputPattern is None:
+                print('ERR: need both a template and an --out filename pattern\n')
+                printhelp=True
+            else:
+                for job in renderBatch(templateFilename,outputPattern,variableSets,
+                    processes,workers,variables=variables):
+                    print(job.filename)
+    if printhelp:
+        print('Usage:')
+        print('  batch.py template.simg --out=pattern [options]')
+        print('Options:')
+        print('   --out=pattern ................. where to save each render, eg "out/card_{index:04d}.png"')
+        print('         can contain {index}, {page}, or the name of any variable')
+        print('   --vars=filename ............... a .csv or .jsonl of variable values, one render per row')
+        print('         (if omitted, simply render every page/frame)')
+        print('   --set=name=value .............. set a variable for every render')
+        print('         (the --vars file can still change it)')
+        print('   --processes=n ................. how many processes to render on (default=one per cpu)')
+        print('   --workers=n ................... render sibling layers on n threads in each process')
+        print('   --cachedir=dir[,maxMB] ........ share rendered layers between processes')
+        print('         through a directory (default 1024MB)')
+
+
+if __name__=='__main__':
+    import sys
+    cmdline(sys.argv[1:])
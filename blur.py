@@ -0,0 +1,286 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Blurs whose cost does not grow with the radius
+
+A gaussian blur is done as three passes of a box blur with a
+fractional radius (see Gwosdek et al, "Theoretical Foundations of
+Gaussian Convolution by Extended Box Filtering"), and each box blur
+pass is a running sum, so every pixel costs the same no matter how
+big the radius is.
+
+8-bit images go through Pillow, which does exactly this in C.
+Anything else (float arrays, 16-bit data, etc) goes through the
+numpy version here, which gives the same results.
+
+Very large gaussian blurs lose nothing by being done at a lower
+resolution, so above DOWNSAMPLE_RADIUS the image is shrunk, blurred,
+and stretched back.
+"""
+from typing import *
+import math
+import time
+import numpy as np
+from PIL import Image,ImageFilter
+
+
+# gaussian blurs with a radius (standard deviation) above this are
+# done on a shrunk-down image
+DOWNSAMPLE_RADIUS=24
+
+# the radius to shrink a large blur down to
+DOWNSAMPLED_RADIUS=8
+
+PIL_BLUR_MODES=('L','LA','RGB','RGBA','RGBa','La','CMYK')
+
+
+def gaussianBoxRadius(radius:float,passes:int=3)->float:
+    """
+    the (fractional) box blur radius that, applied the given number of times,
+    has the same variance as a gaussian blur
+
+    :param radius: standard deviation of the gaussian
+    """
+    sigma2=radius*radius/passes
+    boxLength=math.sqrt(12.0*sigma2+1.0)
+    l=math.floor((boxLength-1.0)/2.0)
+    a=(2*l+1)*(l*(l+1)-3*sigma2)
+    a/=6*(sigma2-(l+1)*(l+1))
+    return l+a
+
+
+def gaussianSupport(radius:float)->int:
+    """
+    how far, in pixels, a gaussian blur of the given radius reaches
+    """
+    if radius<=0:
+        return 0
+    if radius>DOWNSAMPLE_RADIUS:
+        factor=downsampleFactor(radius)
+        return (int(math.ceil(gaussianBoxRadius(radius/factor)))+1)*3*factor+factor
+    return (int(math.ceil(gaussianBoxRadius(radius)))+1)*3
+
+
+def downsampleFactor(radius:float)->int:
+    """
+    how much to shrink an image by before applying a large gaussian blur
+    """
+    if radius<=DOWNSAMPLE_RADIUS:
+        return 1
+    return max(1,int(radius//DOWNSAMPLED_RADIUS))
+
+
+def boxBlurAxis(pixels:np.ndarray,radius:float,axis:int)->np.ndarray:
+    """
+    box blur a numpy array along one axis, with a running sum
+
+    :param radius: can be fractional, in which case the
+        pixels at either end of the box are partially counted
+    :return: a float array the same shape as pixels
+    """
+    if radius<=0:
+        return np.asarray(pixels,dtype=np.float64)
+    whole=int(math.floor(radius))
+    fraction=radius-whole
+    pixels=np.moveaxis(np.asarray(pixels,dtype=np.float64),axis,0)
+    n=pixels.shape[0]
+    pad=whole+1
+    # the edge pixels carry on outwards
+    padded=np.concatenate((np.repeat(pixels[0:1],pad,axis=0),pixels,
+        np.repeat(pixels[-1:],pad,axis=0)),axis=0)
+    sums=np.zeros((padded.shape[0]+1,)+padded.shape[1:],dtype=np.float64)
+    np.cumsum(padded,axis=0,out=sums[1:])
+    ret=sums[2*whole+2:2*whole+2+n]-sums[1:1+n]
+    if fraction>0:
+        ret+=fraction*(padded[0:n]+padded[2*whole+2:2*whole+2+n])
+    ret/=2*radius+1
+    return np.moveaxis(ret,0,axis)
+
+
+def boxBlurArray(pixels:np.ndarray,radius:float,passes:int=1)->np.ndarray:
+    """
+    box blur the first two axes of a numpy array (h,w[,channels])
+
+    :return: a float array the same shape as pixels
+    """
+    ret=np.asarray(pixels,dtype=np.float64)
+    for _ in range(passes):
+        ret=boxBlurAxis(ret,radius,0)
+        ret=boxBlurAxis(ret,radius,1)
+    return ret
+
+
+def gaussianBlurArray(pixels:np.ndarray,radius:float)->np.ndarray:
+    """
+    gaussian blur the first two axes of a numpy array (h,w[,channels])
+
+    :param radius: standard deviation of the gaussian
+    :return: a float array the same shape as pixels
+    """
+    if radius<=0:
+        return np.asarray(pixels,dtype=np.float64)
+    factor=downsampleFactor(radius)
+    if factor>1:
+        h,w=pixels.shape[0],pixels.shape[1]
+        channels=pixels.reshape(h,w,-1)
+        blurred=[]
+        for i in range(channels.shape[2]):
+            channel=Image.fromarray(np.ascontiguousarray(channels[...,i],dtype=np.float32))
+            channel=_blurDownsampled(channel,radius,factor,
+                lambda img,r:Image.fromarray(gaussianBlurArray(np.asarray(img),r).astype(np.float32)))
+            blurred.append(np.asarray(channel,dtype=np.float64))
+        return np.stack(blurred,axis=-1).reshape(pixels.shape)
+    return boxBlurArray(pixels,gaussianBoxRadius(radius),3)
+
+
+def _blurDownsampled(image:Image.Image,radius:float,factor:int,
+    blur:Callable[[Image.Image,float],Image.Image])->Image.Image:
+    """
+    shrink, blur, and stretch back
+
+    Shrinking and stretching blur a little bit on their own
+    (about as much as a gaussian of factor/2), so that is taken
+    off of the blur done in between.
+    """
+    size=image.size
+    small=image.reduce(factor)
+    smallRadius=math.sqrt(max(radius*radius-factor*factor/4.0,0.0))/factor
+    small=blur(small,smallRadius)
+    return small.resize(size,Image.BILINEAR)
+
+
+def _fromArray(pixels:np.ndarray,like:Image.Image)->Image.Image:
+    """
+    turn a blurred float array back into an image like the original
+    """
+    dtype=np.asarray(like).dtype
+    if np.issubdtype(dtype,np.integer):
+        info=np.iinfo(dtype)
+        pixels=np.clip(np.rint(pixels),info.min,info.max)
+    return Image.frombytes(like.mode,like.size,np.ascontiguousarray(pixels.astype(dtype)).tobytes())
+
+
+def _asBlurrable(image:Image.Image)->Image.Image:
+    """
+    palette and bilevel images cannot be blurred directly
+    """
+    if image.mode in ('P','PA'):
+        return image.convert('RGBA')
+    if image.mode=='1':
+        return image.convert('L')
+    return image
+
+
+def gaussianBlur(image:Union[Image.Image,np.ndarray],radius:float)->Union[Image.Image,np.ndarray]:
+    """
+    gaussian blur an image or numpy array
+
+    :param radius: standard deviation of the gaussian
+    """
+    if radius<=0:
+        return image
+    if isinstance(image,np.ndarray):
+        return gaussianBlurArray(image,radius)
+    image=_asBlurrable(image)
+    if image.mode not in PIL_BLUR_MODES:
+        return _fromArray(gaussianBlurArray(np.asarray(image),radius),image)
+    factor=downsampleFactor(radius)
+    if factor>1:
+        return _blurDownsampled(image,radius,factor,
+            lambda img,r:img.filter(ImageFilter.GaussianBlur(radius=r)))
+    return image.filter(ImageFilter.GaussianBlur(radius=radius))
+
+
+def boxBlur(image:Union[Image.Image,np.ndarray],radius:float)->Union[Image.Image,np.ndarray]:
+    """
+    box blur an image or numpy array
+
+    :param radius: how far in each direction to average (can be fractional)
+    """
+    if radius<=0:
+        return image
+    if isinstance(image,np.ndarray):
+        return boxBlurArray(image,radius)
+    image=_asBlurrable(image)
+    if image.mode not in PIL_BLUR_MODES:
+        return _fromArray(boxBlurArray(np.asarray(image),radius),image)
+    return image.filter(ImageFilter.BoxBlur(radius=radius))
+
+
+def unsharpMask(image:Image.Image,radius:float,amount:float=1.0,threshold:int=0)->Image.Image:
+    """
+    sharpen an image by adding back the difference between it and a blurred copy
+
+    :param radius: of the gaussian blur
+    :param amount: how much of the difference to add (1.0=100%)
+    :param threshold: only sharpen where the difference is more than this
+    """
+    if radius<=0 or amount==0:
+        return image
+    image=_asBlurrable(image)
+    if image.mode not in PIL_BLUR_MODES or downsampleFactor(radius)>1:
+        pixels=np.asarray(image,dtype=np.float64)
+        difference=pixels-np.asarray(gaussianBlur(image,radius),dtype=np.float64)
+        if threshold>0:
+            difference[np.abs(difference)<threshold]=0
+        return _fromArray(pixels+difference*amount,image)
+    return image.filter(ImageFilter.UnsharpMask(radius=radius,
+        percent=int(round(amount*100)),threshold=int(threshold)))
+
+
+def benchmark(size:Tuple[int,int]=(2000,2000),radii:Iterable[float]=(2,8,32,128))->NoReturn:
+    """
+    compare the speed of these blurs with the plain Pillow filters
+    """
+    rng=np.random.default_rng(0)
+    image=Image.fromarray(rng.integers(0,256,(size[1],size[0],4),dtype=np.uint8))
+    pixels=np.asarray(image,dtype=np.float32)
+    def timed(fn:Callable)->float:
+        start=time.perf_counter()
+        fn()
+        return time.perf_counter()-start
+    print('%dx%d RGBA, times in seconds'%size)
+    print('radius  pillow gaussian  gaussianBlur  gaussianBlurArray  pillow box  boxBlurArray')
+    for radius in radii:
+        print('%6g  %15.3f  %12.3f  %17.3f  %10.3f  %12.3f'%(radius,
+            timed(lambda:image.filter(ImageFilter.GaussianBlur(radius=radius))),
+            timed(lambda:gaussianBlur(image,radius)),
+            timed(lambda:gaussianBlurArray(pixels,radius)),
+            timed(lambda:image.filter(ImageFilter.BoxBlur(radius=radius))),
+            timed(lambda:boxBlurArray(pixels,radius))))
+
+
+def cmdline(args):
+    """
+    Run the command line
+
+    :param args: command line arguments (WITHOUT the filename)
+    """
+    printhelp=False
+    if len(args)<1:
+        printhelp=True
+    else:
+        for arg in args:
+            if arg.startswith('-'):
+                arg=[a.strip() for a in arg.split('=',1)]
+                if arg[0] in ['-h','--help']:
+                    printhelp=True
+                elif arg[0]=='--benchmark':
+                    size=(2000,2000)
+                    if len(arg)>1:
+                        size=tuple(int(v) for v in arg[1].lower().split('x',1))
+                    benchmark(size)
+                else:
+                    print('ERR: unknown argument "'+arg[0]+'"')
+            else:
+                print('ERR: unknown argument "'+arg+'"')
+    if printhelp:
+        print('Usage:')
+        print('  blur.py [options]')
+        print('Options:')
+        print('   --benchmark[=WxH] ............. time blurs of various radii (default 2000x2000)')
+
+
+if __name__=='__main__':
+    import sys
+    cmdline(sys.argv[1:])
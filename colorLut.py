@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Color lookup tables (LUTs) in the .cube format, for color grading
+
+See:
+    https://resolve.cafe/developers/luts/
+"""
+from typing import *
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image,ImageFilter
+
+
+# how many pixels to interpolate at a time (keeps the temporary arrays small)
+CHUNK_PIXELS=1<<18
+
+# images with at least this many pixels are done by looking up every
+# possible 8-bit color in a table, which is built the first time it is needed
+TABLE_PIXELS=1<<24
+
+
+class CubeLut:
+    """
+    A color lookup table
+
+    :param table: a (size,size,size,3) float array of output colors,
+        indexed [blue][green][red] (the order they are in the .cube file)
+        or for a 1d lut, a (size,3) array
+    :param domainMin: the input color at the start of the table
+    :param domainMax: the input color at the end of the table
+    """
+
+    def __init__(self,table:np.ndarray,domainMin=(0.0,0.0,0.0),domainMax=(1.0,1.0,1.0),
+        title:str=''):
+        self.table:np.ndarray=np.asarray(table,dtype=np.float32)
+        self.domainMin:np.ndarray=np.asarray(domainMin,dtype=np.float32)
+        self.domainMax:np.ndarray=np.asarray(domainMax,dtype=np.float32)
+        self.title:str=title
+        self._table8:Union[np.ndarray,None]=None
+        self._lock=threading.Lock()
+
+    @property
+    def size(self)->int:
+        """
+        how many entries along each side of the table
+        """
+        return self.table.shape[0]
+
+    @property
+    def is3d(self)->bool:
+        return self.table.ndim==4
+
+    def _scaled(self,pixels:np.ndarray)->np.ndarray:
+        """
+        turn 8-bit rgb values into (fractional) table positions
+        """
+        x=pixels.astype(np.float32)*(1.0/255.0)
+        x=(x-self.domainMin)/(self.domainMax-self.domainMin)
+        return np.clip(x,0.0,1.0)*(self.size-1)
+
+    def tetrahedral(self,pixels:np.ndarray)->np.ndarray:
+        """
+        look up 8-bit colors with tetrahedral interpolation
+
+        Each cube of the table is split into six tetrahedra along its
+        gray diagonal, and the color is a blend of the four corners of
+        the one it falls in.  (Smoother than trilinear, especially for
+        grays, and only four lookups rather than eight.)
+
+        :param pixels: (n,3) array of rgb values
+        :return: (n,3) float array of 0..1 rgb values
+        """
+        n=self.size
+        x=self._scaled(pixels)
+        if not self.is3d:
+            return self._interpolate1d(x)
+        base=np.minimum(x.astype(np.int32),n-2)
+        fraction=x-base
+        # walk from the base corner to the opposite one,
+        # along whichever axis has the biggest fraction first
+        order=np.argsort(-fraction,axis=1)
+        fraction=np.take_along_axis(fraction,order,axis=1)
+        strides=np.array([1,n,n*n],dtype=np.int32) # red changes fastest
+        steps=strides[order]
+        table=self.table.reshape(-1,3)
+        i=base@strides
+        ret=(1.0-fraction[:,0:1])*table[i]
+        i+=steps[:,0]
+        ret+=(fraction[:,0:1]-fraction[:,1:2])*table[i]
+        i+=steps[:,1]
+        ret+=(fraction[:,1:2]-fraction[:,2:3])*table[i]
+        i+=steps[:,2]
+        ret+=fraction[:,2:3]*table[i]
+        return ret
+
+    def _interpolate1d(self,x:np.ndarray)->np.ndarray:
+        """
+        look up each channel of the (fractional) table positions in a 1d table
+        """
+        positions=np.arange(self.size,dtype=np.float32)
+        ret=np.empty(x.shape,dtype=np.float32)
+        for channel in range(3):
+            ret[:,channel]=np.interp(x[:,channel],positions,self.table[:,channel])
+        return ret
+
+    @property
+    def table8(self)->np.ndarray:
+        """
+        the result for every possible 8-bit color, as a (2**24,3) uint8 array
+        indexed by (r<<16)|(g<<8)|b
+
+        (48MB, so it is only built the first time it is asked for)
+        """
+        with self._lock:
+            if self._table8 is None:
+                table8=np.empty((1<<24,3),dtype=np.uint8)
+                values=np.arange(256,dtype=np.uint8)
+                for r in range(256):
+                    g,b=np.meshgrid(values,values,indexing='ij')
+                    pixels=np.stack((np.full(g.size,r,dtype=np.uint8),g.ravel(),b.ravel()),axis=1)
+                    table8[r<<16:(r+1)<<16]=_toBytes(self.tetrahedral(pixels))
+                self._table8=table8
+            return self._table8
+
+    def apply(self,image:Image.Image,interpolation:str='tetrahedral')->Image.Image:
+        """
+        color grade an image (alpha, if any, is left alone)
+
+        :param interpolation: one of
+            tetrahedral - most accurate
+            trilinear - faster, done by PIL
+            table - look every pixel up in table8 (fastest, once it is built)
+        :return: a new image
+        """
+        if image.mode not in ('RGB','RGBA'):
+            image=image.convert('RGBA' if image.mode in ('LA','PA','P','La') else 'RGB')
+        if interpolation=='trilinear' and self.is3d and np.all(self.domainMin==0.0) \
+            and np.all(self.domainMax==1.0):
+            lut=ImageFilter.Color3DLUT(self.size,self.table.reshape(-1,3).tolist())
+            return image.filter(lut)
+        pixels=np.asarray(image)
+        color=pixels[...,0:3].reshape(-1,3)
+        if interpolation=='table' or self._table8 is not None or color.shape[0]>=TABLE_PIXELS:
+            index=(color[:,0].astype(np.int32)<<16)|(color[:,1].astype(np.int32)<<8)|color[:,2]
+            graded=self.table8[index]
+        else:
+            graded=np.empty(color.shape,dtype=np.uint8)
+            for start in range(0,color.shape[0],CHUNK_PIXELS):
+                end=start+CHUNK_PIXELS
+                graded[start:end]=_toBytes(self.tetrahedral(color[start:end]))
+        ret=pixels.copy()
+        ret[...,0:3]=graded.reshape(pixels.shape[0],pixels.shape[1],3)
+        return Image.fromarray(ret)
+
+
+def _toBytes(colors:np.ndarray)->np.ndarray:
+    """
+    0..1 float colors to 0..255
+    """
+    return np.clip(colors*255.0+0.5,0,255).astype(np.uint8)
+
+
+def parseCube(f:Union[BinaryIO,TextIO,str,bytes])->CubeLut:
+    """
+    read a .cube file
+
+    :param f: a file-like object, or the text of the file
+    """
+    if hasattr(f,'read'):
+        f=f.read()
+    if isinstance(f,bytes):
+        f=f.decode('utf-8',errors='replace')
+    title=''
+    size=None
+    is3d=True
+    domainMin=(0.0,0.0,0.0)
+    domainMax=(1.0,1.0,1.0)
+    values=[]
+    for line in f.splitlines():
+        line=line.strip()
+        if not line or line[0]=='#':
+            continue
+        if line[0].isalpha():
+            keyword,_,rest=line.partition(' ')
+            keyword=keyword.upper()
+            rest=rest.strip()
+            if keyword=='TITLE':
+                title=rest.strip('"')
+            elif keyword=='LUT_3D_SIZE':
+                size=int(rest)
+            elif keyword=='LUT_1D_SIZE':
+                size=int(rest)
+                is3d=False
+            elif keyword=='DOMAIN_MIN':
+                domainMin=tuple(float(v) for v in rest.split())
+            elif keyword=='DOMAIN_MAX':
+                domainMax=tuple(float(v) for v in rest.split())
+            # (anything else, such as LUT_3D_INPUT_RANGE, is ignored)
+            continue
+        values.append(line)
+    if size is None:
+        raise ValueError('Not a .cube file (no LUT_3D_SIZE or LUT_1D_SIZE)')
+    table=np.array(' '.join(values).split(),dtype=np.float32)
+    expected=size**3*3 if is3d else size*3
+    if table.size!=expected:
+        raise ValueError('.cube file has %d values, expected %d'%(table.size,expected))
+    if is3d:
+        table=table.reshape(size,size,size,3)
+    else:
+        table=table.reshape(size,3)
+    return CubeLut(table,domainMin,domainMax,title)
+
+
+# parsed luts, by content digest, shared by all documents
+_cubeCache:'OrderedDict[str,CubeLut]'=OrderedDict()
+_cubeCacheLock=threading.Lock()
+CUBE_CACHE_SIZE=16
+
+
+def cachedCube(digest:str,load:Callable[[],Union[BinaryIO,str,bytes]])->CubeLut:
+    """
+    get a parsed lut, only parsing it the first time
+
+    :param digest: something that uniquely identifies the file's contents
+    :param load: called to get the file if it needs to be parsed
+    """
+    with _cubeCacheLock:
+        lut=_cubeCache.get(digest)
+        if lut is not None:
+            _cubeCache.move_to_end(digest)
+            return lut
+    lut=parseCube(load())
+    with _cubeCacheLock:
+        _cubeCache[digest]=lut
+        while len(_cubeCache)>CUBE_CACHE_SIZE:
+            _cubeCache.popitem(last=False)
+    return lut
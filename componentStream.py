@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy, seekable access to the components inside a smartimage file
+"""
+from typing import *
+import io
+import os
+import mmap
+import struct
+import threading
+import zipfile
+
+
+class MappedStream(io.RawIOBase):
+    """
+    A read-only, seekable stream over a piece of memory, such as
+    part of a memory-mapped file.
+
+    Nothing is read from disk until it is actually used, and then
+    only the pages that are touched.
+    """
+
+    def __init__(self,buffer:Union[bytes,memoryview,mmap.mmap],name:Union[str,None]=None):
+        io.RawIOBase.__init__(self)
+        self._buffer=memoryview(buffer)
+        self._pos=0
+        self.name=name
+
+    def readable(self)->bool:
+        return True
+
+    def seekable(self)->bool:
+        return True
+
+    def tell(self)->int:
+        return self._pos
+
+    def seek(self,offset:int,whence:int=io.SEEK_SET)->int:
+        if whence==io.SEEK_CUR:
+            offset+=self._pos
+        elif whence==io.SEEK_END:
+            offset+=len(self._buffer)
+        if offset<0:
+            raise ValueError('negative seek position %d'%offset)
+        self._pos=offset
+        return self._pos
+
+    def read(self,size:int=-1)->bytes:
+        start=min(self._pos,len(self._buffer))
+        if size is None or size<0:
+            end=len(self._buffer)
+        else:
+            end=min(start+size,len(self._buffer))
+        self._pos=end
+        return self._buffer[start:end].tobytes()
+
+    def readinto(self,b)->int:
+        data=self.read(len(b))
+        b[0:len(data)]=data
+        return len(data)
+
+    def close(self)->NoReturn:
+        """
+        done with the stream (which lets go of the memory, so that
+        a memory mapped file can be unmapped)
+        """
+        if not self.closed:
+            io.RawIOBase.close(self)
+            self._buffer.release()
+
+    def getbuffer(self)->memoryview:
+        """
+        get the underlying memory without copying it
+        """
+        return self._buffer
+
+
+# see zipfile.structFileHeader
+_localHeader=struct.Struct('<4s2B4HL2L2H')
+
+
+def storedMemberOffset(zf:zipfile.ZipFile,name:str)->Union[Tuple[int,int],None]:
+    """
+    if a zip member is stored as-is (no compression or encryption),
+    find where its bytes start within the zip file
+
+    :return: (offset,size) or None if it is compressed
+    """
+    info=zf.getinfo(name)
+    if info.compress_type!=zipfile.ZIP_STORED or info.flag_bits&0x1:
+        return None
+    # the offset in the directory is to a local header,
+    # whose name/extra lengths can differ from the directory's copy
+    fp=zf.fp
+    fp.seek(info.header_offset)
+    header=fp.read(_localHeader.size)
+    if len(header)<_localHeader.size:
+        return None
+    fields=_localHeader.unpack(header)
+    if fields[0]!=zipfile.stringFileHeader:
+        return None
+    offset=info.header_offset+_localHeader.size+fields[10]+fields[11]
+    return offset,info.file_size
+
+
+class ComponentContainer:
+    """
+    Opens the components of a zipped smartimage file lazily.
+
+    Stored (uncompressed) members, such as most embedded photos, are
+    memory-mapped directly out of the zip file, so opening a huge
+    document costs nothing until a render actually reads from them.
+    Compressed members are streamed by zipfile as usual.
+    """
+
+    def __init__(self,filename:str):
+        self.filename=filename
+        self.zipfile=zipfile.ZipFile(filename)
+        self._map:Union[mmap.mmap,None]=None
+        self._offsets:Dict[str,Union[Tuple[int,int],None]]={}
+        self._lock=threading.Lock() # rendering threads share the zip file pointer
+
+    def namelist(self)->List[str]:
+        return self.zipfile.namelist()
+
+    def getinfo(self,name:str)->zipfile.ZipInfo:
+        return self.zipfile.getinfo(name)
+
+    @property
+    def map(self)->mmap.mmap:
+        """
+        the whole zip file, memory mapped
+        """
+        if self._map is None:
+            with open(self.filename,'rb') as f:
+                self._map=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        return self._map
+
+    def open(self,name:str)->BinaryIO:
+        """
+        open a component as a seekable stream
+        """
+        with self._lock:
+            if name not in self._offsets:
+                self._offsets[name]=storedMemberOffset(self.zipfile,name)
+            location=self._offsets[name]
+        if location is None:
+            return self.zipfile.open(name)
+        offset,size=location
+        return MappedStream(memoryview(self.map)[offset:offset+size],name)
+
+    def close(self)->NoReturn:
+        """
+        let go of the file
+
+        NOTE: if anything (such as a lazily decoded image) still uses the
+            mapped memory, it can't be unmapped yet, so it will be released
+            when that is done with it
+        """
+        self.zipfile.close()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map=None
+
+
+def copyStream(src:BinaryIO,dst:BinaryIO,chunkSize:int=1024*1024)->NoReturn:
+    """
+    copy from one stream to another a piece at a time
+    """
+    if isinstance(src,MappedStream):
+        buffer=src.getbuffer()
+        for i in range(src.tell(),len(buffer),chunkSize):
+            dst.write(buffer[i:i+chunkSize])
+        return
+    while True:
+        data=src.read(chunkSize)
+        if not data:
+            break
+        dst.write(data)
+
+
+def componentStream(data:Union[str,bytes,bytearray],name:Union[str,None]=None)->MappedStream:
+    """
+    a stream over an in-memory component
+    """
+    if isinstance(data,str):
+        data=data.encode('utf-8')
+    return MappedStream(data,name)
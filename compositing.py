@@ -0,0 +1,618 @@
+# -*- coding: utf-8 -*-
+"""
+Compositing layers on top of one another
+
+The canvas is kept as a premultiplied float32 numpy buffer for the whole
+time a layer's children are being stacked up on it, rather than going
+back and forth to PIL images for every child.  Each child is blended in
+with a single vectorized pass, only over the area it actually covers.
+
+Blend modes follow the W3C "Compositing and Blending" spec:
+    https://www.w3.org/TR/compositing-1/
+"""
+from typing import *
+import numpy as np
+import PIL
+from PIL import Image
+
+
+# the most pixels to gather up at once when putting down many copies of a stamp
+MAX_WAVE_PIXELS=1<<20
+
+
+# ---- separable blend modes
+# Each takes the straight (not premultiplied) background color cb and
+# source color cs as float32 arrays of 0..1 and returns the blended color.
+
+def _normal(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return cs
+
+def _multiply(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return cb*cs
+
+def _screen(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return cb+cs-cb*cs
+
+def _hardLight(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return np.where(cs<=0.5,_multiply(cb,2*cs),_screen(cb,2*cs-1))
+
+def _overlay(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return _hardLight(cs,cb)
+
+def _darken(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return np.minimum(cb,cs)
+
+def _lighten(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return np.maximum(cb,cs)
+
+def _dodge(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    with np.errstate(divide='ignore',invalid='ignore'):
+        ret=np.minimum(1.0,cb/(1.0-cs))
+    ret=np.where(cs>=1.0,1.0,ret)
+    return np.where(cb<=0.0,0.0,ret)
+
+def _burn(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    with np.errstate(divide='ignore',invalid='ignore'):
+        ret=1.0-np.minimum(1.0,(1.0-cb)/cs)
+    ret=np.where(cs<=0.0,0.0,ret)
+    return np.where(cb>=1.0,1.0,ret)
+
+def _softLight(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    d=np.where(cb<=0.25,((16*cb-12)*cb+4)*cb,np.sqrt(cb))
+    return np.where(cs<=0.5,cb-(1-2*cs)*cb*(1-cb),cb+(2*cs-1)*(d-cb))
+
+def _difference(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return np.abs(cb-cs)
+
+def _exclusion(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return cb+cs-2*cb*cs
+
+def _add(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return np.minimum(cb+cs,1.0)
+
+def _addMod(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return _to8bit(cb+cs)%256/255.0
+
+def _subtract(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return np.maximum(cb-cs,0.0)
+
+def _subtractMod(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return _to8bit(cb-cs)%256/255.0
+
+def _and(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return (_to8bit(cb)&_to8bit(cs))/255.0
+
+def _or(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return (_to8bit(cb)|_to8bit(cs))/255.0
+
+def _to8bit(c:np.ndarray)->np.ndarray:
+    return np.floor(c*255.0+0.5).astype(np.int32)
+
+
+# ---- non-separable blend modes
+
+def _lum(c:np.ndarray)->np.ndarray:
+    return c[...,0:1]*0.3+c[...,1:2]*0.59+c[...,2:3]*0.11
+
+def _clipColor(c:np.ndarray)->np.ndarray:
+    l=_lum(c)
+    n=c.min(axis=-1,keepdims=True)
+    x=c.max(axis=-1,keepdims=True)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        c=np.where(n<0.0,l+(c-l)*l/(l-n),c)
+        c=np.where(x>1.0,l+(c-l)*(1.0-l)/(x-l),c)
+    return c
+
+def _setLum(c:np.ndarray,l:np.ndarray)->np.ndarray:
+    return _clipColor(c+(l-_lum(c)))
+
+def _sat(c:np.ndarray)->np.ndarray:
+    return c.max(axis=-1,keepdims=True)-c.min(axis=-1,keepdims=True)
+
+def _setSat(c:np.ndarray,s:np.ndarray)->np.ndarray:
+    cmin=c.min(axis=-1,keepdims=True)
+    cRange=c.max(axis=-1,keepdims=True)-cmin
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return np.where(cRange>0.0,(c-cmin)*s/cRange,0.0)
+
+def _hue(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return _setLum(_setSat(cs,_sat(cb)),_lum(cb))
+
+def _saturation(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return _setLum(_setSat(cb,_sat(cs)),_lum(cb))
+
+def _color(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return _setLum(cs,_lum(cb))
+
+def _luminosity(cb:np.ndarray,cs:np.ndarray)->np.ndarray:
+    return _setLum(cb,_lum(cs))
+
+
+BLEND_MODES:Dict[str,Callable[[np.ndarray,np.ndarray],np.ndarray]]={
+    'normal':_normal,
+    'multiply':_multiply,
+    'screen':_screen,
+    'overlay':_overlay,
+    'darker':_darken,
+    'lighter':_lighten,
+    'dodge':_dodge,
+    'burn':_burn,
+    'hardlight':_hardLight,
+    'softlight':_softLight,
+    'difference':_difference,
+    'exclusion':_exclusion,
+    'add':_add,
+    'add_mod':_addMod,
+    'subtract':_subtract,
+    'subtract_mod':_subtractMod,
+    'and':_and,
+    'or':_or,
+    'hue':_hue,
+    'saturation':_saturation,
+    'color':_color,
+    'luminosity':_luminosity,
+    }
+
+# other common names for the same things
+BLEND_MODE_ALIASES:Dict[str,str]={
+    'darken':'darker',
+    'lighten':'lighter',
+    'colordodge':'dodge',
+    'color_dodge':'dodge',
+    'colorburn':'burn',
+    'color_burn':'burn',
+    'hard_light':'hardlight',
+    'soft_light':'softlight',
+    'addmod':'add_mod',
+    'subtractmod':'subtract_mod',
+    }
+
+
+def blendFunction(blendMode:str)->Union[Callable[[np.ndarray,np.ndarray],np.ndarray],None]:
+    """
+    get the function for a blend mode name
+
+    returns None if there is no such blend mode
+    """
+    blendMode=blendMode.strip().lower().replace(' ','').replace('-','_')
+    blendMode=BLEND_MODE_ALIASES.get(blendMode,blendMode)
+    return BLEND_MODES.get(blendMode)
+
+
+def canvasSize(background:Union[PIL.Image.Image,None],
+    images:Iterable[Tuple[PIL.Image.Image,Tuple[float,float]]])->Tuple[int,int]:
+    """
+    how big a canvas needs to be to hold a background and some images
+    placed at (x,y) positions on it
+
+    NOTE: anything hanging off the top or left is cut off, rather
+        than growing the canvas in that direction
+    """
+    if background is None:
+        w,h=0,0
+    else:
+        w,h=background.size
+    for image,position in images:
+        if image is None:
+            continue
+        w=max(w,int(position[0])+image.width)
+        h=max(h,int(position[1])+image.height)
+    return w,h
+
+
+def aspectSize(imageSize:Tuple[int,int],
+    size:Tuple[Union[int,None],Union[int,None]])->Tuple[int,int]:
+    """
+    fill in the missing side of a (w,h) size (given as None) so that
+    it keeps the same aspect ratio as an image of imageSize
+    """
+    w,h=size
+    if w is None and h is None:
+        return tuple(imageSize)
+    if w is None:
+        w=max(int(round(imageSize[0]*h/max(imageSize[1],1))),1)
+    elif h is None:
+        h=max(int(round(imageSize[1]*w/max(imageSize[0],1))),1)
+    return int(w),int(h)
+
+
+def _toFloat(image:PIL.Image.Image)->Tuple[np.ndarray,Union[np.ndarray,None]]:
+    """
+    convert an image to straight (not premultiplied) float32 color and alpha
+
+    :return: (color,alpha) where alpha is None if the image is opaque
+    """
+    if image.mode not in ('RGB','RGBA','L','LA'):
+        image=image.convert('RGBA')
+    pixels=np.asarray(image,dtype=np.float32)*np.float32(1.0/255.0)
+    if image.mode=='L':
+        return np.repeat(pixels[...,None],3,axis=2),None
+    if image.mode=='LA':
+        return np.repeat(pixels[...,0:1],3,axis=2),pixels[...,1:2]
+    if image.mode=='RGB':
+        return pixels,None
+    return pixels[...,0:3],pixels[...,3:4]
+
+
+class Stamp:
+    """
+    An image converted, once, into the form the canvas blends with,
+    so that it can be put down any number of times (see Canvas.stamp)
+
+    :param image: the image to put down
+    :param opacity: 0.0 to 1.0
+    :param blendMode: any of BLEND_MODES (or their aliases)
+    :param mask: grayscale image of where to apply the image
+        (stretched to the size of the image if necessary)
+    """
+
+    def __init__(self,image:PIL.Image.Image,opacity:float=1.0,
+        blendMode:str='normal',mask:Union[PIL.Image.Image,None]=None):
+        self.image=image
+        self.blend=blendFunction(blendMode)
+        if self.blend is None:
+            raise ValueError('Unknown blend mode "%s"'%blendMode)
+        self.needsAlpha=mask is not None or opacity<1.0
+        if mask is not None:
+            if mask.mode!='L':
+                mask=mask.convert('L')
+            if mask.size!=image.size:
+                mask=mask.resize(image.size,Image.BILINEAR)
+        color,alpha=_toFloat(image)
+        self.color:np.ndarray=color
+        # the total coverage of the source
+        self.coverage:Union[np.ndarray,None]
+        if mask is not None:
+            self.coverage=np.asarray(mask,dtype=np.float32)[...,None]*np.float32(opacity/255.0)
+            if alpha is not None:
+                self.coverage*=alpha
+        elif alpha is not None:
+            self.coverage=alpha*np.float32(opacity) if opacity<1.0 else alpha
+        elif opacity<1.0:
+            self.coverage=np.float32(opacity)
+        else:
+            self.coverage=None
+
+
+class Canvas:
+    """
+    A canvas to composite images onto
+
+    The pixels are stored premultiplied, as float32 rgba, so that
+    blending is a single vectorized pass per image.
+
+    :param background: what to start the canvas out with
+    :param size: how big to make the canvas (if it is known beforehand,
+        see canvasSize() - otherwise it will grow as needed)
+    :param mode: the mode to start out with
+        (otherwise, the mode of the background)
+
+    The final image is in the widest mode of everything put onto it,
+    so color on top of a grayscale background comes out in color.
+    It has alpha if anything composited onto it did, or if any of
+    the canvas was left uncovered (eg, when it grew to fit an image).
+    """
+
+    def __init__(self,background:Union[PIL.Image.Image,None]=None,
+        size:Union[Tuple[int,int],None]=None,mode:Union[str,None]=None):
+        if size is None:
+            size=canvasSize(background,[])
+        self.size:Tuple[int,int]=(int(size[0]),int(size[1]))
+        self.mode:Union[str,None]=None
+        self._pixels:Union[np.ndarray,None]=None
+        # while nothing has been blended in, simply remember the image
+        self._passThrough:Union[PIL.Image.Image,None]=None
+        if background is not None:
+            self.mode=self._outputMode(background.mode)
+            if background.size==self.size and mode is None:
+                self._passThrough=background
+            else:
+                self._paste(background,(0,0))
+        if mode is not None:
+            self.mode=mode
+
+    @staticmethod
+    def _outputMode(mode:str)->str:
+        if mode in ('RGB','RGBA','L','LA'):
+            return mode
+        return 'RGBA'
+
+    def _widenMode(self,mode:str,needsAlpha:bool)->NoReturn:
+        """
+        make sure the final mode can hold an image of the given mode
+        """
+        mode=self._outputMode(mode)
+        if needsAlpha and mode in ('RGB','L'):
+            mode=mode+'A'
+        if self.mode is None:
+            self.mode=mode
+            return
+        if self.mode in ('L','LA') and mode in ('RGB','RGBA'):
+            self.mode='RGB'+self.mode[1:]
+        # an image with alpha on a canvas without it can only show through
+        # to what was there, so whether that needs alpha is up to the canvas
+        # (see self.image)
+    @property
+    def pixels(self)->np.ndarray:
+        """
+        the premultiplied float32 rgba pixels of the canvas
+        """
+        if self._pixels is None:
+            w,h=self.size
+            self._pixels=np.zeros((h,w,4),dtype=np.float32)
+            if self._passThrough is not None:
+                passThrough=self._passThrough
+                self._passThrough=None
+                self._paste(passThrough,(0,0))
+        return self._pixels
+
+    def _grow(self,size:Tuple[int,int])->NoReturn:
+        """
+        make the canvas bigger (if necessary)
+        """
+        w=max(self.size[0],size[0])
+        h=max(self.size[1],size[1])
+        if (w,h)==self.size:
+            return
+        old=self.pixels
+        self.size=(w,h)
+        self._pixels=np.zeros((h,w,4),dtype=np.float32)
+        self._pixels[0:old.shape[0],0:old.shape[1]]=old
+
+    def _clip(self,image:PIL.Image.Image,position:Tuple[float,float]
+        )->Union[Tuple[Tuple[int,int,int,int],Tuple[int,int]],None]:
+        """
+        figure out what part of an image lands on the canvas
+
+        :return: ((left,top,right,bottom) of the image,(x,y) on the canvas)
+            or None if it misses the canvas entirely
+        """
+        x,y=int(position[0]),int(position[1])
+        left=max(0,-x)
+        top=max(0,-y)
+        right=min(image.width,self.size[0]-x)
+        bottom=min(image.height,self.size[1]-y)
+        if right<=left or bottom<=top:
+            return None
+        return (left,top,right,bottom),(x+left,y+top)
+
+    def _paste(self,image:PIL.Image.Image,position:Tuple[float,float])->NoReturn:
+        """
+        copy an image straight onto the canvas (no blending)
+        """
+        clip=self._clip(image,position)
+        if clip is None:
+            return
+        box,(x,y)=clip
+        if box!=(0,0,image.width,image.height):
+            image=image.crop(box)
+        color,alpha=_toFloat(image)
+        region=self.pixels[y:y+image.height,x:x+image.width]
+        if alpha is None:
+            region[...,0:3]=color
+            region[...,3:4]=1.0
+        else:
+            np.multiply(color,alpha,out=region[...,0:3])
+            region[...,3:4]=alpha
+
+    def composite(self,image:Union[PIL.Image.Image,None],opacity:float=1.0,
+        blendMode:str='normal',mask:Union[PIL.Image.Image,None]=None,
+        position:Tuple[float,float]=(0,0))->NoReturn:
+        """
+        composite an image onto the canvas
+
+        :param image: the image to put on top
+        :param opacity: 0.0 to 1.0
+        :param blendMode: any of BLEND_MODES (or their aliases)
+        :param mask: grayscale image of where to apply the image
+            (stretched to the size of the image if necessary)
+        :param position: (x,y) where to put the top left of the image
+        """
+        if image is None or opacity<=0.0:
+            return
+        needsAlpha=mask is not None or opacity<1.0
+        if blendFunction(blendMode) is None:
+            raise ValueError('Unknown blend mode "%s"'%blendMode)
+        if self.mode is None:
+            self._widenMode(image.mode,needsAlpha)
+            if self._pixels is None and not needsAlpha and int(position[0])==0 and \
+                int(position[1])==0 and image.size==self.size:
+                # nothing to blend with, so it's simply the image itself
+                self._passThrough=image
+                return
+        self.stamp(Stamp(image,opacity,blendMode,mask),[position])
+
+    def stamp(self,stamp:'Stamp',positions:Iterable[Tuple[float,float]])->NoReturn:
+        """
+        composite the same (already prepared) image at many positions
+
+        The copies are put down in order, so they overlap exactly
+        as if each one had been composited by itself.  Each run of copies
+        that do not overlap one another is blended in a single pass
+        (see _stampWave).
+
+        :param stamp: the image to put down (see Stamp)
+        :param positions: (x,y) where to put the top left of each copy
+        """
+        positions=[(int(x),int(y)) for x,y in positions]
+        if not positions:
+            return
+        self._widenMode(stamp.image.mode,stamp.needsAlpha)
+        w,h=stamp.image.size
+        if w<1 or h<1:
+            return
+        self._grow((max(x for x,_ in positions)+w,max(y for _,y in positions)+h))
+        maxWave=max(MAX_WAVE_PIXELS//(w*h),1)
+        wave=[]
+        # {(column,row):[(x,y)]} of the copies in the wave, on a grid the size
+        # of the stamp, so only the neighboring squares need to be checked
+        occupied:Dict[Tuple[int,int],List[Tuple[int,int]]]={}
+        for x,y in positions:
+            if x<0 or y<0:
+                # hangs off the canvas, so it is put down by itself
+                self._stampWave(stamp,wave)
+                wave,occupied=[],{}
+                self._stampAt(stamp,(x,y))
+                continue
+            column,row=x//w,y//h
+            overlaps=len(wave)>=maxWave or any(abs(x-otherX)<w and abs(y-otherY)<h
+                for c in (column-1,column,column+1) for r in (row-1,row,row+1)
+                for otherX,otherY in occupied.get((c,r),()))
+            if overlaps:
+                self._stampWave(stamp,wave)
+                wave,occupied=[],{}
+            wave.append((x,y))
+            occupied.setdefault((column,row),[]).append((x,y))
+        self._stampWave(stamp,wave)
+
+    def _stampWave(self,stamp:'Stamp',positions:List[Tuple[int,int]])->NoReturn:
+        """
+        blend copies of a stamp that do not overlap one another, and are
+        entirely on the canvas, all at once
+
+        Every copy's pixels are gathered into one array, blended together,
+        and scattered back.
+        """
+        if len(positions)<2:
+            for position in positions:
+                self._stampAt(stamp,position)
+            return
+        w,h=stamp.image.size
+        pixels=self.pixels
+        # the index of every pixel of every copy, in the flattened canvas
+        starts=np.array([y*self.size[0]+x for x,y in positions],dtype=np.intp)
+        offsets=(np.arange(h,dtype=np.intp)*self.size[0])[:,None]+np.arange(w,dtype=np.intp)
+        indices=starts[:,None,None]+offsets
+        region=np.take(pixels.reshape(-1,4),indices,axis=0)
+        self._blend(region,stamp.blend,stamp.color,stamp.coverage)
+        # (scattering whole pixels at a time is much faster than rgba values)
+        pixelType=np.dtype((np.void,pixels.itemsize*4))
+        pixels.view(pixelType).reshape(-1)[indices]=region.view(pixelType).reshape(indices.shape)
+
+    def _stampAt(self,stamp:'Stamp',position:Tuple[int,int])->NoReturn:
+        """
+        blend a single copy of a stamp onto the canvas
+        """
+        clip=self._clip(stamp.image,position)
+        if clip is None:
+            return
+        (left,top,right,bottom),(x,y)=clip
+        color=stamp.color[top:bottom,left:right]
+        coverage=stamp.coverage
+        if coverage is not None and coverage.ndim>0:
+            coverage=coverage[top:bottom,left:right]
+        region=self.pixels[y:y+bottom-top,x:x+right-left]
+        self._blend(region,stamp.blend,color,coverage)
+
+    @staticmethod
+    def _blend(region:np.ndarray,blend:Callable[[np.ndarray,np.ndarray],np.ndarray],
+        color:np.ndarray,coverage:Union[np.ndarray,None])->NoReturn:
+        """
+        blend a source into premultiplied canvas pixels, in place
+
+        (the region can also be a stack of several same-sized areas)
+        """
+        premultiplied=region[...,0:3]
+        backdropAlpha=region[...,3:4]
+        if blend is not _normal:
+            # mix in the blended color where there is something to blend with
+            with np.errstate(divide='ignore',invalid='ignore'):
+                backdrop=np.where(backdropAlpha>0.0,premultiplied/backdropAlpha,0.0)
+            blended=np.clip(blend(backdrop,color),0.0,1.0)
+            color=color+backdropAlpha*(blended-color)
+        if coverage is None:
+            # fully covers what was there before
+            premultiplied[...]=color
+            backdropAlpha[...]=1.0
+        else:
+            # source-over: result=source*coverage+backdrop*(1-coverage)
+            remaining=1.0-coverage
+            premultiplied*=remaining
+            premultiplied+=color*coverage
+            backdropAlpha*=remaining
+            backdropAlpha+=coverage
+
+    @property
+    def image(self)->Union[PIL.Image.Image,None]:
+        """
+        the canvas as an image (or None if nothing was ever put on it)
+        """
+        if self._passThrough is not None:
+            return self._passThrough
+        if self._pixels is None:
+            if self.mode is None:
+                return None
+            w,h=self.size
+            return Image.new(self.mode,(w,h))
+        pixels=self._pixels
+        alpha=pixels[...,3:4]
+        color=pixels[...,0:3]
+        if self.mode in ('RGB','L') and (alpha<np.float32(254.5/255.0)).any():
+            # part of the canvas was never covered, so it needs to stay see-through
+            # (anything that would round to opaque anyway doesn't count)
+            self.mode=self.mode+'A'
+        hasAlpha=self.mode in ('RGBA','LA')
+        if hasAlpha:
+            # un-premultiply
+            with np.errstate(divide='ignore',invalid='ignore'):
+                color=np.where(alpha>0.0,color/alpha,0.0)
+        # (otherwise, there is no alpha, so what's left is on top of black)
+        if self.mode in ('L','LA'):
+            color=(color*np.float32([0.299,0.587,0.114])).sum(axis=-1,keepdims=True)
+        if hasAlpha:
+            color=np.concatenate((color,alpha),axis=-1)
+        color=np.clip(color*255.0+0.5,0,255).astype(np.uint8)
+        if color.shape[-1]==1:
+            color=color[...,0]
+        return Image.fromarray(color)
+
+
+def composite(image:Union[PIL.Image.Image,None],background:Union[PIL.Image.Image,None],
+    opacity:float=1.0,blendMode:str='normal',mask:Union[PIL.Image.Image,None]=None,
+    position:Tuple[float,float]=(0,0),resize:bool=True)->Union[PIL.Image.Image,None]:
+    """
+    composite an image on top of a background
+
+    Just a convenience for a Canvas with one image on it. (When compositing
+    several images, use a Canvas directly, so it stays in float the whole time.)
+
+    :param resize: grow the result to fit the image if necessary
+        (otherwise the result is the size of the background)
+
+    WARNING: Do not modify the image without doing a .copy() first!
+        (it can be one of the ones passed in)
+    """
+    if image is None:
+        return background
+    if resize or background is None:
+        size=canvasSize(background,[(image,position)])
+    else:
+        size=background.size
+    canvas=Canvas(background,size)
+    canvas.composite(image,opacity,blendMode,mask,position)
+    return canvas.image
+
+
+def clipToBox(image:Union[PIL.Image.Image,None],position:Tuple[int,int],
+    box:Tuple[int,int,int,int])->Tuple[Union[PIL.Image.Image,None],Union[Tuple[int,int],None]]:
+    """
+    cut out the part of an image that falls within a box
+
+    :param image: the image
+    :param position: where the image's top left is
+    :param box: (left,top,right,bottom) in the same coordinates as position
+    :return: (image,(x,y)) where (x,y) is the new position of the image,
+        or (None,None) if it does not fall within the box
+    """
+    if image is None:
+        return None,None
+    x,y=int(position[0]),int(position[1])
+    left=max(int(box[0]),x)
+    top=max(int(box[1]),y)
+    right=min(int(box[2]),x+image.width)
+    bottom=min(int(box[3]),y+image.height)
+    if right<=left or bottom<=top:
+        return None,None
+    if (left,top,right,bottom)!=(x,y,x+image.width,y+image.height):
+        image=image.crop((left-x,top-y,right-x,bottom-y))
+    return image,(left,top)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Convolution of images with arbitrary kernels
+
+The kernel is laid over the image as it is written
+(the way a convolution matrix works in most paint programs),
+with its center over the pixel being calculated.
+
+Depending upon the kernel, it is done the fastest way available:
+    separable kernels (such as most blurs) are done as a row pass
+        and a column pass, which is 2n work per pixel rather than n*n
+    low-rank kernels are done as a few such pairs of passes
+    large kernels are done by multiplying in the fourier domain
+    everything else is done directly, as a sum of shifted images
+"""
+from typing import *
+import numpy as np
+from PIL import Image
+
+
+# how much work per pixel (multiply-adds) before the fourier domain is faster
+# (each one is a pass over the whole image, whereas the fourier transforms
+# cost about as much as 30-40 of them no matter how big the kernel is)
+FFT_THRESHOLD=40
+
+# singular values below this (relative to the largest) are considered to be zero
+SEPARABLE_TOLERANCE=1e-6
+
+
+def kernelArray(matrix:Union[List[List[float]],np.ndarray])->np.ndarray:
+    """
+    turn a convolution matrix into a 2d float array
+    """
+    kernel=np.asarray(matrix,dtype=np.float64)
+    if kernel.ndim==1:
+        kernel=kernel[np.newaxis,:]
+    if kernel.ndim!=2 or kernel.size==0:
+        raise ValueError('Convolution kernel must be a non-empty 2d matrix')
+    return kernel
+
+
+def separableKernel(kernel:np.ndarray,tolerance:float=SEPARABLE_TOLERANCE
+    )->Union[List[Tuple[np.ndarray,np.ndarray]],None]:
+    """
+    split a kernel into the fewest (column,row) pairs of 1d kernels
+    that add up to it
+
+    A rank-1 kernel, such as a gaussian or a box, is one pair.
+
+    :return: [(column,row)] or None if doing it that way would be
+        no faster than convolving with the kernel directly
+    """
+    kernel=kernelArray(kernel)
+    h,w=kernel.shape
+    if h==1 or w==1:
+        return None # already 1d
+    u,s,vt=np.linalg.svd(kernel)
+    if s[0]==0.0:
+        return [(np.zeros(h),np.zeros(w))]
+    rank=int(np.count_nonzero(s>s[0]*tolerance))
+    if rank*(w+h)>=w*h:
+        return None
+    ret=[]
+    for i in range(rank):
+        scale=np.sqrt(s[i])
+        ret.append((u[:,i]*scale,vt[i]*scale))
+    return ret
+
+
+EDGE_MODES=('mirror','repeat','clamp')
+
+
+def padArray(pixels:np.ndarray,before:Tuple[int,int],after:Tuple[int,int],
+    edge:Union[str,np.ndarray]='mirror')->np.ndarray:
+    """
+    extend an image array (h,w,channels) on all sides so that
+    the kernel has something to look at past the edges
+
+    :param before: how much to add to the (top,left)
+    :param after: how much to add to the (bottom,right)
+    :param edge: one of
+        mirror - reflect the image back on itself
+        repeat - wrap around to the other side (for tileable images)
+        clamp - continue the edge pixels outwards
+        a color - surround the image with a solid color, eg "#000000" or "transparent"
+            (or the value for each channel, see edgeColor)
+    """
+    padding=((before[0],after[0]),(before[1],after[1]),(0,0))
+    if isinstance(edge,str):
+        if edge=='mirror':
+            return np.pad(pixels,padding,mode='symmetric')
+        if edge=='repeat':
+            return np.pad(pixels,padding,mode='wrap')
+        if edge=='clamp':
+            return np.pad(pixels,padding,mode='edge')
+        edge=edgeColor(edge,{1:'l',2:'la',3:'rgb'}.get(pixels.shape[2],'rgba'))
+    ret=np.empty((pixels.shape[0]+before[0]+after[0],pixels.shape[1]+before[1]+after[1],
+        pixels.shape[2]),dtype=pixels.dtype)
+    ret[...]=edge
+    ret[before[0]:before[0]+pixels.shape[0],before[1]:before[1]+pixels.shape[1]]=pixels
+    return ret
+
+
+def edgeColor(edge:str,bands:str='rgba')->np.ndarray:
+    """
+    the value of each channel of a solid edge color
+
+    :param bands: the channels of the image, eg "rgba" or "la"
+    """
+    from PIL import ImageColor
+    if edge in ('transparent','none'):
+        color=(0,0,0,0)
+    else:
+        try:
+            color=ImageColor.getrgb(edge)
+        except ValueError:
+            raise ValueError('Unknown convolution edge "%s"'%edge)
+    if len(color)<4:
+        color=tuple(color)+(255,)
+    values={'r':color[0],'g':color[1],'b':color[2],'a':color[3],
+        'l':color[0]*0.299+color[1]*0.587+color[2]*0.114}
+    return np.asarray([values[b] for b in bands.lower()],dtype=np.float64)
+
+
+def _correlateDirect(padded:np.ndarray,kernel:np.ndarray,size:Tuple[int,int])->np.ndarray:
+    """
+    sum up shifted copies of the padded image, one per kernel entry
+
+    :param size: (h,w) of the result
+    """
+    h,w=size
+    ret=np.zeros((h,w,padded.shape[2]),dtype=np.float64)
+    for y,x in zip(*np.nonzero(kernel)):
+        ret+=kernel[y,x]*padded[y:y+h,x:x+w]
+    return ret
+
+
+def _correlateSeparable(padded:np.ndarray,pairs:List[Tuple[np.ndarray,np.ndarray]],
+    size:Tuple[int,int])->np.ndarray:
+    """
+    a column pass then a row pass, for each pair of 1d kernels
+    """
+    h,w=size
+    ret=np.zeros((h,w,padded.shape[2]),dtype=np.float64)
+    for column,row in pairs:
+        rows=_correlateDirect(padded,column[:,np.newaxis],(h,padded.shape[1]))
+        ret+=_correlateDirect(rows,row[np.newaxis,:],(h,w))
+    return ret
+
+
+def _correlateFFT(padded:np.ndarray,kernel:np.ndarray,size:Tuple[int,int])->np.ndarray:
+    """
+    multiply in the fourier domain
+    """
+    h,w=size
+    ph,pw=padded.shape[0],padded.shape[1]
+    # flip the kernel, since the fourier transform does a true convolution
+    flipped=np.zeros((ph,pw),dtype=np.float64)
+    flipped[0:kernel.shape[0],0:kernel.shape[1]]=kernel[::-1,::-1]
+    kernelFFT=np.fft.rfft2(flipped)
+    ret=np.empty((h,w,padded.shape[2]),dtype=np.float64)
+    for channel in range(padded.shape[2]):
+        result=np.fft.irfft2(np.fft.rfft2(padded[...,channel])*kernelFFT,s=(ph,pw))
+        # the wrap-around ends up at the top left, the valid part is the rest
+        ret[...,channel]=result[kernel.shape[0]-1:kernel.shape[0]-1+h,
+            kernel.shape[1]-1:kernel.shape[1]-1+w]
+    return ret
+
+
+def correlate(pixels:np.ndarray,kernel:Union[List[List[float]],np.ndarray],
+    edge:Union[str,np.ndarray]='mirror',
+    fftThreshold:int=FFT_THRESHOLD)->np.ndarray:
+    """
+    apply a kernel to every channel of an image array
+
+    :param pixels: a (h,w,channels) array
+    :param kernel: the kernel, centered on each pixel (for an even size,
+        the center is the one right of/below the middle)
+    :param edge: how to treat the edges (see padArray)
+    :param fftThreshold: how many multiply-adds per pixel before
+        switching to the fourier domain
+    :return: a float array the same size as pixels
+    """
+    kernel=kernelArray(kernel)
+    pixels=np.asarray(pixels,dtype=np.float64)
+    kh,kw=kernel.shape
+    h,w=pixels.shape[0],pixels.shape[1]
+    padded=padArray(pixels,(kh//2,kw//2),(kh-1-kh//2,kw-1-kw//2),edge)
+    pairs=separableKernel(kernel)
+    if pairs is not None:
+        cost=len(pairs)*(kw+kh)
+    else:
+        cost=int(np.count_nonzero(kernel))
+    if cost>fftThreshold:
+        return _correlateFFT(padded,kernel,(h,w))
+    if pairs is not None:
+        return _correlateSeparable(padded,pairs,(h,w))
+    return _correlateDirect(padded,kernel,(h,w))
+
+
+def convolveImage(image:Image.Image,kernel:Union[List[List[float]],np.ndarray],
+    edge:str='mirror',add:float=0.0,divide:Union[float,None]=None,
+    channels:str='rgba',fftThreshold:int=FFT_THRESHOLD)->Image.Image:
+    """
+    apply a convolution kernel to an image
+
+    :param image: the image to convolve
+    :param kernel: the convolution matrix (any size)
+    :param edge: how to treat the edges (see padArray)
+    :param add: add this to every result (in 0..255 units), for instance
+        to shift the negative values of an emboss into view
+    :param divide: divide every result by this
+        (default is the sum of the kernel, or 1 if that is zero)
+    :param channels: only change these channels (any of "rgbal")
+    :param fftThreshold: how many multiply-adds per pixel before
+        switching to the fourier domain
+    :return: a new image of the same size
+    """
+    kernel=kernelArray(kernel)
+    if divide is None or divide==0:
+        divide=kernel.sum()
+        if divide==0:
+            divide=1.0
+    if image.mode not in ('L','LA','RGB','RGBA'):
+        image=image.convert('RGBA')
+    bands=[b.lower() for b in image.getbands()]
+    channels=channels.lower()
+    if channels.find('r')>=0 or channels.find('g')>=0 or channels.find('b')>=0:
+        channels+='l' # gray images are affected by any color channel
+    selected=[i for i,b in enumerate(bands) if b in channels]
+    if not selected:
+        return image.copy()
+    pixels=np.asarray(image)
+    if pixels.ndim==2:
+        pixels=pixels[:,:,np.newaxis]
+    if edge not in EDGE_MODES:
+        edge=edgeColor(edge,''.join(bands))[selected]
+    result=correlate(pixels[...,selected],kernel/divide,edge,fftThreshold)
+    if add!=0:
+        result+=add
+    ret=pixels.copy()
+    ret[...,selected]=np.clip(np.rint(result),0,255).astype(np.uint8)
+    if ret.shape[2]==1:
+        ret=ret[...,0]
+    return Image.fromarray(ret)
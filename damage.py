@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Keeps track of what part of a layer changed since it was last rendered
+(dirty rectangles), so that only that part has to be re-composited
+"""
+from typing import *
+import math
+
+
+# a rectangle is (left,top,right,bottom)
+Rect=Tuple[int,int,int,int]
+
+
+def unionRect(a:Union[Rect,None],b:Union[Rect,None])->Union[Rect,None]:
+    """
+    the smallest rectangle containing both (either can be None for "nothing")
+    """
+    if a is None or a[2]<=a[0] or a[3]<=a[1]:
+        return b
+    if b is None or b[2]<=b[0] or b[3]<=b[1]:
+        return a
+    return (min(a[0],b[0]),min(a[1],b[1]),max(a[2],b[2]),max(a[3],b[3]))
+
+
+def clipRect(rect:Rect,size:Tuple[int,int])->Union[Rect,None]:
+    """
+    clip a rectangle to an image of the given size
+
+    returns None if nothing is left
+    """
+    left=max(rect[0],0)
+    top=max(rect[1],0)
+    right=min(rect[2],size[0])
+    bottom=min(rect[3],size[1])
+    if right<=left or bottom<=top:
+        return None
+    return (left,top,right,bottom)
+
+
+def offsetRect(rect:Rect,x:int,y:int)->Rect:
+    """
+    move a rectangle
+    """
+    return (rect[0]+x,rect[1]+y,rect[2]+x,rect[3]+y)
+
+
+def expandRect(rect:Rect,amount:int)->Rect:
+    """
+    grow a rectangle in all directions
+    """
+    return (rect[0]-amount,rect[1]-amount,rect[2]+amount,rect[3]+amount)
+
+
+def rotateRect(rect:Rect,size:Tuple[int,int],newSize:Tuple[int,int],angle:float)->Rect:
+    """
+    where a rectangle ends up when an image is rotated about its
+    center, onto a (possibly bigger) canvas centered on the same point
+
+    :param size: the size of the image before rotating
+    :param newSize: the size of the image after rotating
+    :param angle: in degrees
+    """
+    cx,cy=size[0]/2.0,size[1]/2.0
+    ncx,ncy=newSize[0]/2.0,newSize[1]/2.0
+    angle=math.radians(angle)
+    cos,sin=math.cos(angle),math.sin(angle)
+    xs=[]
+    ys=[]
+    for x,y in ((rect[0],rect[1]),(rect[2],rect[1]),(rect[0],rect[3]),(rect[2],rect[3])):
+        x-=cx
+        y-=cy
+        # either direction, to be safe
+        for s in (sin,-sin):
+            xs.append(x*cos+y*s+ncx)
+            ys.append(-x*s+y*cos+ncy)
+    # plus a pixel for the resampling to bleed into
+    return (int(math.floor(min(xs)))-1,int(math.floor(min(ys)))-1,
+        int(math.ceil(max(xs)))+1,int(math.ceil(max(ys)))+1)
+
+
+def imageRect(image:Union['PIL.Image.Image',None],x:int=0,y:int=0)->Union[Rect,None]:
+    """
+    the rectangle an image covers when placed at (x,y)
+    """
+    if image is None:
+        return None
+    return (x,y,x+image.width,y+image.height)
+
+
+class Damage:
+    """
+    Says that a layer's current image differs from the image it rendered
+    before only within a rectangle.
+
+    :param previous: the image that was rendered before
+    :param current: the newly rendered image
+    :param rect: where they differ, (), for "nowhere", or None for "everywhere"
+    """
+
+    __slots__=('previous','current','rect')
+
+    def __init__(self,previous:Union['PIL.Image.Image',None],
+        current:Union['PIL.Image.Image',None],rect:Union[Rect,Tuple,None]):
+        self.previous=previous
+        self.current=current
+        self.rect=rect
+
+    def between(self,previous:Union['PIL.Image.Image',None],
+        current:Union['PIL.Image.Image',None])->Union[Rect,Tuple,None]:
+        """
+        the damaged rectangle, if this damage is about going from
+        one particular image to another one
+
+        returns None (everywhere) if it is not
+        """
+        if previous is not self.previous or current is not self.current:
+            return None
+        if previous is None or current is None or previous.size!=current.size:
+            return None
+        return self.rect
+
+    def __repr__(self)->str:
+        return 'Damage(%s)'%(self.rect,)
+
+
+class ChildComposite:
+    """
+    How a child was composited into its parent the last time around
+    """
+
+    __slots__=('layer','image','mask','x','y','opacity','blendMode')
+
+    def __init__(self,layer:'Layer',image:Union['PIL.Image.Image',None],
+        mask:Union['PIL.Image.Image',None],x:int,y:int,opacity:float,blendMode:str):
+        self.layer=layer
+        self.image=image
+        self.mask=mask
+        self.x=x
+        self.y=y
+        self.opacity=opacity
+        self.blendMode=blendMode
+
+    @property
+    def rect(self)->Union[Rect,None]:
+        """
+        the rectangle the child covered
+        """
+        return imageRect(self.image,self.x,self.y)
+
+
+class CompositeState:
+    """
+    Everything that went into compositing a layer the last time,
+    so the next time only what changed has to be re-done
+    """
+
+    __slots__=('base','children','size','mode','image')
+
+    def __init__(self,base:Union['PIL.Image.Image',None],children:List[ChildComposite],
+        size:Tuple[int,int],mode:Union[str,None],image:Union['PIL.Image.Image',None]):
+        self.base=base
+        self.children=children
+        self.size=size
+        self.mode=mode
+        self.image=image
+
+    def damage(self,base:Union['PIL.Image.Image',None],children:List[ChildComposite],
+        size:Tuple[int,int])->Union[Rect,Tuple,None]:
+        """
+        what part of the composite would change if it were done
+        with a new base and children
+
+        :return: the damaged rectangle, () if nothing changed,
+            or None if everything needs to be re-done
+        """
+        if size!=self.size or base is not self.base or len(children)!=len(self.children):
+            return None
+        rect=None
+        for old,new in zip(self.children,children):
+            if old.layer is not new.layer:
+                return None
+            if new.image is old.image and new.mask is None and old.mask is None and \
+                (new.x,new.y,new.opacity,new.blendMode)==(old.x,old.y,old.opacity,old.blendMode):
+                continue # unchanged
+            if new.mask is None and old.mask is None and (new.x,new.y,new.opacity,new.blendMode)==\
+                (old.x,old.y,old.opacity,old.blendMode) and new.layer._damage is not None:
+                # the child knows what part of itself changed
+                childRect=new.layer._damage.between(old.image,new.image)
+                if childRect is not None:
+                    if childRect:
+                        rect=unionRect(rect,offsetRect(childRect,new.x,new.y))
+                    continue
+            # the whole area covered by both the old and new is affected
+            rect=unionRect(rect,old.rect)
+            rect=unionRect(rect,new.rect)
+        if rect is None:
+            return ()
+        rect=clipRect(rect,size)
+        if rect is None:
+            return ()
+        return rect
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Keeps track of which layers depend upon which other layers,
+variables, and components, so that when something changes,
+only the layers affected by it have to be re-rendered.
+"""
+from typing import *
+
+
+class DependencyGraph:
+    """
+    Keeps track of which layers depend upon which other layers,
+    variables, and components, so that when something changes,
+    only the layers affected by it have to be re-rendered.
+
+    Dependencies are things like:
+        <text>@layerId</text> - depends on layer "layerId"
+        <solid color="@bgcolor"/> - depends on variable "bgcolor"
+        <image src="photo.jpg"/> - depends on component "photo.jpg"
+        <link ref="3"/> - depends on layer "3"
+    """
+
+    def __init__(self,root:'SmartImage'):
+        self.root=root
+        # layer -> what it depends upon
+        self.layerDeps:Dict['Layer',Set['Layer']]={}
+        self.variableDeps:Dict['Layer',Set[str]]={}
+        self.componentDeps:Dict['Layer',Set[str]]={}
+        # what is depended upon -> layers that depend on it
+        self.layerDependents:Dict['Layer',Set['Layer']]={}
+        self.variableDependents:Dict[str,Set['Layer']]={}
+        self.componentDependents:Dict[str,Set['Layer']]={}
+        self._add(root)
+
+    def _add(self,layer:'Layer')->NoReturn:
+        """
+        add a layer and all of its children to the graph
+        """
+        self.update(layer)
+        for child in layer.children:
+            self._add(child)
+
+    def _references(self,layer:'Layer')->Generator[Tuple[str,str],None,None]:
+        """
+        all of the things referenced by a layer's xml
+        as (attributeName,reference) pairs
+        """
+        xml=layer.xml
+        if isinstance(xml.text,str) and xml.text.startswith('@'):
+            yield '_',xml.text
+        for name,value in xml.attrib.items():
+            if name=='ref' and xml.tag=='link':
+                yield name,'@'+value
+            elif value.startswith('@') or name in layer._componentAttributes:
+                yield name,value
+
+    def update(self,layer:'Layer')->NoReturn:
+        """
+        re-scan the dependencies of a single layer
+        (call whenever its xml changes)
+        """
+        self.remove(layer)
+        layers=set()
+        variables=set()
+        components=set()
+        for _,ref in self._references(layer):
+            if not ref.startswith('@'):
+                components.add(ref)
+                continue
+            name=ref[1:].split('.',1)[0]
+            if not name:
+                continue
+            target=self.root.getLayer(name)
+            if target is not None:
+                layers.add(target)
+            else:
+                variables.add(name)
+        self.layerDeps[layer]=layers
+        self.variableDeps[layer]=variables
+        self.componentDeps[layer]=components
+        for target in layers:
+            self.layerDependents.setdefault(target,set()).add(layer)
+        for name in variables:
+            self.variableDependents.setdefault(name,set()).add(layer)
+        for name in components:
+            self.componentDependents.setdefault(name,set()).add(layer)
+
+    def remove(self,layer:'Layer')->NoReturn:
+        """
+        forget the dependencies of a layer
+        """
+        for target in self.layerDeps.pop(layer,()):
+            self.layerDependents.get(target,set()).discard(layer)
+        for name in self.variableDeps.pop(layer,()):
+            self.variableDependents.get(name,set()).discard(layer)
+        for name in self.componentDeps.pop(layer,()):
+            self.componentDependents.get(name,set()).discard(layer)
+
+    def layerAdded(self,layer:'Layer')->NoReturn:
+        """
+        call whenever a new layer is added to the document
+        """
+        self.update(layer)
+        # anything that referred to it before it existed took it for a variable
+        layerId,name=str(layer.elementId),layer.xml.attrib.get('name')
+        for key in (layerId,name):
+            if key is not None:
+                for dependent in list(self.variableDependents.get(key,())):
+                    self.update(dependent)
+                    self.invalidate(dependent)
+        self.invalidate(layer)
+
+    def layerRemoved(self,layer:'Layer')->NoReturn:
+        """
+        call whenever a layer is dropped from the document
+        """
+        for dependent in list(self.layerDependents.pop(layer,())):
+            self.invalidate(dependent)
+        self.remove(layer)
+
+    def dependents(self,layer:'Layer')->Set['Layer']:
+        """
+        every layer that would render differently if this layer changed
+        (including the layer itself)
+        """
+        ret=set()
+        todo=[layer]
+        while todo:
+            layer=todo.pop()
+            if layer is None or layer in ret:
+                continue
+            ret.add(layer)
+            # whatever contains us changes as well
+            todo.append(layer.parent)
+            todo.extend(self.layerDependents.get(layer,()))
+        return ret
+
+    def invalidate(self,layer:'Layer')->NoReturn:
+        """
+        mark a layer and everything that depends upon it as needing a re-render
+        """
+        for dependent in self.dependents(layer):
+            dependent._renderKeyValid=False
+            dependent._attributes=None
+
+    def layerChanged(self,layer:'Layer')->NoReturn:
+        """
+        call whenever a layer's xml is changed
+        """
+        self.update(layer)
+        self.invalidate(layer)
+
+    def variableChanged(self,name:str)->NoReturn:
+        """
+        call whenever a variable value is changed
+        """
+        for layer in list(self.variableDependents.get(name,())):
+            self.invalidate(layer)
+
+    def componentChanged(self,name:str)->NoReturn:
+        """
+        call whenever the contents of a component are changed
+        """
+        for layer in list(self.componentDependents.get(name,())):
+            self.invalidate(layer)
@@ -28,6 +28,13 @@ class ExtensionLayer(ImageLayer):
         """
         return self.type+'/'+self.elementId+'.png'
 
+    @property
+    def cacheable(self)->bool:
+        """
+        there is no telling what an external extension depends upon
+        """
+        return False
+
     @property
     def extensionClass(self):
         """
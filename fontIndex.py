@@ -0,0 +1,463 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+An index of the fonts on this system, so that fonts can be found by name
+without searching directories or going out to the network while rendering
+
+The index is built by scanning the system font directories the first time
+it is needed (or with prefetchFonts(), the --prefetchFonts command), and is
+saved (along with the modification time of every font file) so that later
+runs simply load it.  Refreshing the index only re-reads the font files that
+have changed.
+
+Text layers never scan the font directories or download fonts, they only
+look fonts up in the index.  Fonts that are not installed are downloaded by
+prefetchFonts(), which documents do before they start rendering.
+"""
+from typing import *
+import os
+import sys
+import json
+import tempfile
+import threading
+import urllib.request
+import urllib.parse
+import urllib.error
+from PIL import ImageFont
+
+
+FONT_EXTENSIONS=('ttf','otf','otc','ttc')
+
+# where downloaded fonts are kept
+FONT_CACHE_DIR=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep+'font_cache'+os.sep
+
+# fonts to try, in order, when none is specified
+DEFAULT_FONTS=('Arial','Helvetica','Liberation Sans','DejaVu Sans','FreeSans','Noto Sans')
+
+# font styles that go by the plain family name
+REGULAR_STYLES=('regular','normal','book','roman','medium','')
+
+# the most faces to look for in a font collection
+MAX_FACES=64
+
+
+def fontKey(name:str)->str:
+    """
+    normalize a font name for lookup, so that "Hi Melody", "HiMelody",
+    "hi-melody", and "HiMelody.ttf" are all the same font
+    """
+    name=name.rsplit(os.sep,1)[-1]
+    base,_,ext=name.rpartition('.')
+    if base and ext.lower() in FONT_EXTENSIONS:
+        name=base
+    return ''.join(c for c in name.lower() if c not in ' -_')
+
+
+def systemFontDirectories()->List[str]:
+    """
+    the directories where this operating system keeps fonts
+    """
+    home=os.path.expanduser('~')
+    if sys.platform.startswith('win'):
+        directories=[os.path.join(os.environ.get('WINDIR',r'C:\Windows'),'Fonts')]
+        if 'LOCALAPPDATA' in os.environ:
+            directories.append(os.path.join(os.environ['LOCALAPPDATA'],'Microsoft','Windows','Fonts'))
+    elif sys.platform=='darwin':
+        directories=['/System/Library/Fonts','/Library/Fonts',os.path.join(home,'Library','Fonts')]
+    else:
+        directories=['/usr/share/fonts','/usr/local/share/fonts',
+            os.path.join(home,'.fonts'),os.path.join(home,'.local','share','fonts')]
+    directories.append(FONT_CACHE_DIR)
+    return directories
+
+
+def defaultIndexFilename()->str:
+    """
+    where the index is saved
+    (can be changed with the SMARTIMAGE_FONT_INDEX environment variable)
+    """
+    if os.environ.get('SMARTIMAGE_FONT_INDEX'):
+        return os.environ['SMARTIMAGE_FONT_INDEX']
+    return os.path.join(os.path.expanduser('~'),'.cache','smartimage','fontIndex.json')
+
+
+def indexFilenames()->List[str]:
+    """
+    everywhere the index can be saved, in the order they are tried
+    (the temp directory is for when the home directory is read-only)
+    """
+    user=os.environ.get('USER') or os.environ.get('USERNAME') or 'default'
+    return [defaultIndexFilename(),
+        os.path.join(tempfile.gettempdir(),'smartimage-%s'%user,'fontIndex.json')]
+
+
+def fontFaces(filename:str)->List[Tuple[str,str]]:
+    """
+    the (family,style) of every face in a font file
+    (a font collection can have several)
+    """
+    ret=[]
+    for index in range(MAX_FACES):
+        try:
+            font=ImageFont.truetype(filename,10,index)
+        except (IOError,ValueError):
+            break
+        family,style=font.getname()
+        ret.append((family or '',style or ''))
+    return ret
+
+
+def faceKeys(filename:str,faces:List[Tuple[str,str]])->List[Tuple[str,int,bool]]:
+    """
+    all of the names a font file can be found by
+
+    :return: [(key,faceIndex,isPreferred)] where preferred keys win out
+        over others (eg, "Arial" should be the regular face, not the bold one)
+    """
+    ret=[(fontKey(filename),0,True)]
+    for index,(family,style) in enumerate(faces):
+        ret.append((fontKey(family+style),index,True))
+        ret.append((fontKey(family),index,style.lower() in REGULAR_STYLES))
+    return ret
+
+
+class FontIndex:
+    """
+    A persistent map of font names to font files
+
+    :param filename: where to save the index (default is defaultIndexFilename())
+    :param directories: where to look for fonts (default is systemFontDirectories())
+    """
+
+    def __init__(self,filename:Union[str,None]=None,directories:Union[List[str],None]=None):
+        if filename is None:
+            filename=defaultIndexFilename()
+        if directories is None:
+            directories=systemFontDirectories()
+        self.filename:str=filename
+        self.directories:List[str]=list(directories)
+        # {filename:{'mtime':mtime,'faces':[(family,style)]}}
+        self.files:Dict[str,Dict[str,Any]]={}
+        # names that fonts were fetched by, that are not in the font itself
+        # {fontKey:(filename,faceIndex)}
+        self.aliases:Dict[str,Tuple[str,int]]={}
+        self._fonts:Union[Dict[str,Tuple[str,int]],None]=None
+        self._lock=threading.RLock()
+
+    @property
+    def fonts(self)->Dict[str,Tuple[str,int]]:
+        """
+        {fontKey:(filename,faceIndex)}
+        """
+        with self._lock:
+            if self._fonts is None:
+                fonts={}
+                preferred=set()
+                for filename in sorted(self.files):
+                    for key,index,isPreferred in faceKeys(filename,self.files[filename]['faces']):
+                        if not key or key in preferred:
+                            continue
+                        if isPreferred:
+                            preferred.add(key)
+                            fonts[key]=(filename,index)
+                        elif key not in fonts:
+                            fonts[key]=(filename,index)
+                self._fonts=fonts
+            return self._fonts
+
+    def resolve(self,name:str)->Union[Tuple[str,int],None]:
+        """
+        look up a font by name (no directories are searched)
+
+        :return: (filename,faceIndex) or None if it is not in the index
+        """
+        key=fontKey(name)
+        found=self.fonts.get(key)
+        if found is None:
+            found=self.aliases.get(key)
+        return found
+
+    def load(self)->bool:
+        """
+        load the saved index
+
+        :return: whether there was a saved index to load
+        """
+        try:
+            with open(self.filename,'r',encoding='utf-8') as f:
+                data=json.load(f)
+        except (IOError,ValueError):
+            return False
+        with self._lock:
+            self.files={filename:{'mtime':info['mtime'],'faces':[tuple(face) for face in info['faces']]}
+                for filename,info in data.get('files',{}).items()}
+            self.aliases={key:tuple(found) for key,found in data.get('aliases',{}).items()}
+            self._fonts=None
+        return True
+
+    def save(self)->NoReturn:
+        """
+        save the index (so later runs do not have to scan)
+        """
+        directory=os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory,exist_ok=True)
+        with self._lock:
+            data={'version':1,'directories':self.directories,'files':self.files,
+                'aliases':self.aliases}
+        # write then rename, so other processes never see half an index
+        tempName=self.filename+'.%d.tmp'%os.getpid()
+        with open(tempName,'w',encoding='utf-8') as f:
+            json.dump(data,f,indent=1)
+        os.replace(tempName,self.filename)
+
+    def addFile(self,filename:str)->bool:
+        """
+        add a font file to the index (or update it if it changed)
+
+        :return: whether it is a font
+        """
+        filename=os.path.abspath(filename)
+        try:
+            mtime=os.path.getmtime(filename)
+        except OSError:
+            return False
+        with self._lock:
+            info=self.files.get(filename)
+            if info is not None and info['mtime']==mtime:
+                return True
+        faces=fontFaces(filename)
+        if not faces:
+            return False
+        with self._lock:
+            self.files[filename]={'mtime':mtime,'faces':faces}
+            self._fonts=None
+        return True
+
+    def refresh(self)->int:
+        """
+        scan the font directories, reading only the font files that are
+        new or have changed, and forgetting the ones that are gone
+
+        :return: how many fonts are in the index
+        """
+        found=set()
+        for directory in self.directories:
+            for path,_,filenames in os.walk(directory):
+                for filename in filenames:
+                    if filename.rsplit('.',1)[-1].lower() not in FONT_EXTENSIONS:
+                        continue
+                    filename=os.path.abspath(os.path.join(path,filename))
+                    if self.addFile(filename):
+                        found.add(filename)
+        with self._lock:
+            for filename in list(self.files.keys()):
+                if filename not in found and not os.path.exists(filename):
+                    del self.files[filename]
+            self.aliases={key:found for key,found in self.aliases.items() if found[0] in self.files}
+            self._fonts=None
+            return len(self.files)
+
+
+_defaultIndex:Union[FontIndex,None]=None
+_defaultIndexLock=threading.Lock()
+
+
+def defaultFontIndex()->FontIndex:
+    """
+    the index everything uses unless told otherwise
+
+    It is loaded from wherever it was saved (see indexFilenames) the first
+    time it is needed.  If the fonts have never been indexed, they are
+    indexed now, once, and the index is saved so no later run has to.
+    (Documents ask for this before rendering starts, so text layers
+    only ever look fonts up.)
+    """
+    global _defaultIndex
+    with _defaultIndexLock:
+        if _defaultIndex is None:
+            index=FontIndex()
+            for filename in indexFilenames():
+                index.filename=filename
+                if index.load():
+                    break
+            else:
+                index.filename=defaultIndexFilename()
+                print('WARN: the installed fonts have not been indexed yet, indexing them now')
+                index.refresh()
+                saveFontIndex(index)
+            _defaultIndex=index
+        return _defaultIndex
+
+
+def saveFontIndex(index:FontIndex)->bool:
+    """
+    save an index to the first place that can be written (see indexFilenames)
+
+    If there is nowhere, it is still kept in memory for the rest of this run.
+
+    :return: whether it was saved
+    """
+    filenames=[index.filename]+[f for f in indexFilenames() if f!=index.filename]
+    for filename in filenames:
+        index.filename=filename
+        try:
+            index.save()
+            return True
+        except OSError as e:
+            print('WARN: unable to save font index "%s" - %s'%(filename,e))
+    index.filename=filenames[0]
+    return False
+
+
+def componentFonts(componentNames:Iterable[str])->Dict[str,str]:
+    """
+    the font files among a document's components
+
+    :return: {fontKey:componentName}
+    """
+    ret={}
+    for name in componentNames:
+        if name.rsplit('.',1)[-1].lower() in FONT_EXTENSIONS:
+            ret.setdefault(fontKey(name),name)
+    return ret
+
+
+def googleFontsGet(fontName:str,cacheDir:str):
+    """
+    download the font from google fonts
+
+    :param fontName: the named font to fetch
+    :param cacheDir: the location to cache fonts
+    """
+    font=None
+    # try to download from google fonts
+    fontcache=cacheDir+fontName
+    if not os.path.exists(fontcache):
+        # download the info file if we don't have one
+        url='https://fonts.googleapis.com/css?family='+urllib.parse.quote_plus(fontName)
+        req=urllib.request.Request(url)
+        try:
+            response=urllib.request.urlopen(req)
+            f=open(fontcache,'wb')
+            f.write(response.read())
+            f.close()
+        except urllib.error.URLError as e:
+            print(url)
+            print(e)
+    if os.path.exists(fontcache):
+        # peek in the info file and get the real url
+        f=open(fontcache,'rb')
+        url=f.read().decode('utf-8').split('url(',1)[-1].split(')',1)[0]
+        f.close()
+        fontcache=cacheDir+urllib.parse.quote_plus(url)
+        if not os.path.exists(fontcache):
+            # download the real font if we don't already have it
+            req=urllib.request.Request(url)
+            try:
+                response=urllib.request.urlopen(req)
+                f=open(fontcache,'wb')
+                f.write(response.read())
+                f.close()
+            except urllib.error.URLError as e:
+                print(url)
+                print(e)
+        font=fontcache
+    return font
+
+
+def downloadFont(fontName:str):
+    """
+    locate and download the named font
+
+    :param fontName: the named font to fetch
+    """
+    os.makedirs(FONT_CACHE_DIR,exist_ok=True)
+    font=googleFontsGet(fontName,FONT_CACHE_DIR)
+    # TODO: fontsquirrel not implemented
+    #if font is None:
+    #\tfont=fontSquirrelGet(fontName,cacheDir)
+    return font
+
+
+def prefetchFonts(fontNames:Iterable[str]=(),index:Union[FontIndex,None]=None,
+    refresh:bool=True)->Dict[str,Union[Tuple[str,int],None]]:
+    """
+    bring the index up to date, and download any of the named fonts
+    that are not installed, so that rendering never has to
+
+    :param refresh: whether to rescan the font directories first
+    :return: {fontName:(filename,faceIndex) or None if it could not be found}
+    """
+    if index is None:
+        index=defaultFontIndex()
+    if refresh:
+        index.refresh()
+    ret={}
+    for fontName in fontNames:
+        found=index.resolve(fontName)
+        if found is None:
+            filename=downloadFont(fontName)
+            if filename is not None and index.addFile(filename):
+                found=index.resolve(fontName)
+                if found is None:
+                    # the file is not named after the font, so remember
+                    # the name it was asked for
+                    found=(os.path.abspath(filename),0)
+                    index.aliases[fontKey(fontName)]=found
+        ret[fontName]=found
+    saveFontIndex(index)
+    return ret
+
+
+def cmdline(args):
+    """
+    Run the command line
+
+    :param args: command line arguments (WITHOUT the filename)
+    """
+    printhelp=False
+    if len(args)<1:
+        printhelp=True
+    else:
+        for arg in args:
+            if arg.startswith('-'):
+                arg=[a.strip() for a in arg.split('=',1)]
+                if arg[0] in ['-h','--help']:
+                    printhelp=True
+                elif arg[0]=='--prefetchFonts':
+                    names=[]
+                    if len(arg)>1:
+                        names=[name.strip() for name in arg[1].split(',') if name.strip()]
+                    for name,found in prefetchFonts(names).items():
+                        if found is None:
+                            print('ERR: unable to find font "%s"'%name)
+                        else:
+                            print('%s: %s'%(name,found[0]))
+                    print('%d font files indexed in %s'%(len(defaultFontIndex().files),
+                        defaultFontIndex().filename))
+                elif arg[0]=='--resolve':
+                    found=defaultFontIndex().resolve(arg[1])
+                    if found is None:
+                        print('ERR: font "%s" is not in the index'%arg[1])
+                    else:
+                        print('%s: %s (face %d)'%(arg[1],found[0],found[1]))
+                elif arg[0]=='--list':
+                    for key,(filename,index) in sorted(defaultFontIndex().fonts.items()):
+                        print('%s: %s (face %d)'%(key,filename,index))
+                else:
+                    print('ERR: unknown argument "'+arg[0]+'"')
+            else:
+                print('ERR: unknown argument "'+arg+'"')
+    if printhelp:
+        print('Usage:')
+        print('  fontIndex.py [options]')
+        print('Options:')
+        print('   --prefetchFonts[=name,...] .... rescan the font directories and download')
+        print('         any of the named fonts that are not installed')
+        print('   --resolve=name ................ show which file a font name resolves to')
+        print('   --list ........................ list every font in the index')
+
+
+if __name__=='__main__':
+    cmdline(sys.argv[1:])
@@ -62,6 +62,7 @@ class FormElement(SmartimageXmlObject):
         set the value of this element
         """
         self._value=value
+        self.root.variableChanged(self)
 
     def __int__(self)->int:
         return int(self.value)
@@ -7,6 +7,7 @@ import io
 from imageTools import *
 from smartimage.layer import *
 from smartimage.errors import SmartimageError
+from smartimage.compositing import aspectSize
 
 
 class ImageLayer(Layer):
@@ -56,22 +57,25 @@ class ImageLayer(Layer):
         """
         the image for this layer
         """
+        w=self._getProperty('w','auto')
+        h=self._getProperty('h','auto')
+        size=None
+        if (w not in ['0','auto']) or (h not in ['0','auto']):
+            # with only one side given, the other keeps the aspect ratio
+            size=(None if w in ['0','auto'] else int(float(w)),
+                None if h in ['0','auto'] else int(float(h)))
         try:
-            img=self.root.imageByRef(self.src)
+            # since we know the size, this only decodes as much as it needs to
+            img=self.root.imageByRef(self.src,size=size)
         except FileNotFoundError as e:
             raise SmartimageError(self,'Missing image src resource "%s"'%e.filename)
         if img is None:
             return img
-        w=self._getProperty('w','auto')
-        h=self._getProperty('h','auto')
-        if (w not in ['0','auto']) and (h not in ['0','auto']):
-            if w in ['0','auto']:
-                w=img.width*(img.height/h)
-            elif h in ['0','auto']:
-                h=img.height*(img.width/w)
-            img=img.resize((int(w),int(h)),img.ANTIALIAS)
-        if img is not None:
-            img.immutable=True # mark this image so that compositor will not alter it
+        if size is not None:
+            size=aspectSize(img.size,size)
+            if img.size!=size: # eg, a reference to another layer
+                img=img.resize(size,img.ANTIALIAS)
+        img.immutable=True # mark this image so that compositor will not alter it
         return img
     @image.setter
     def image(self,image):
@@ -7,6 +7,10 @@ from imageTools import *
 from smartimage.smartimageXmlObject import SmartimageXmlObject
 from smartimage.errors import SmartimageError
 from smartimage.renderingContext import *
+from smartimage.layerAttributes import LayerAttributes
+from smartimage.layerIndex import LayerIndex
+from smartimage.compositing import clipToBox
+from smartimage.damage import Damage,CompositeState
 
 
 class Layer(SmartimageXmlObject,Bounds):
@@ -14,10 +18,19 @@ class Layer(SmartimageXmlObject,Bounds):
     The base class for image layers
     """
 
+    # attributes that name a component, so the component's
+    # contents (rather than its name) go into the renderKey
+    _componentAttributes=('src','mask','roi','normalMap','bumpMap','dispersionMap')
+
     def __init__(self,parent:Union[None,'Layer']=None,xml:str='<group/>'):
         SmartimageXmlObject.__init__(self,parent,xml)
         self._children=None
-        self._lastRenderedImage=None
+        self._renderKey=None
+        self._renderKeyValid=False
+        self._attributes=None
+        # what changed since the last render (see damage.py)
+        self._damage:Union[Damage,None]=None
+        self._compositeState:Union[CompositeState,None]=None
 
     def __hash__(self)->int:
         """
@@ -37,8 +50,10 @@ class Layer(SmartimageXmlObject,Bounds):
         fetch a layer with the given name or id
 
         :param idOrName: find the idOrName
-        :param ignore: list of layers to ignore (prevent looping)
         """
+        l=None
+        if not idOrName:
+            return None
         if idOrName[0]=='@':
             idOrName=idOrName[1:]
         if idOrName:
@@ -53,54 +68,83 @@ class Layer(SmartimageXmlObject,Bounds):
                         l=self._getLayerByName(idOrName,True)
         return l
 
-    def _getLayerById(self,layerId:str,ignorecase:bool=False,fromRoot:bool=False)->'Layer':
+    def _getLayerById(self,layerId:str,ignorecase:bool=False)->'Layer':
         """
         fetch a layer with the given id
 
-        :param layerId: find the id
-        :param fromRoot: whether we are being scanned or the scanner
+        :param layerId: find the id (if ignorecase, must be lower cased)
         """
-        l=None
-        #print('comparing id',layerId,self.elementId)
-        if layerId==self.elementId:
-            l=self
-        elif ignorecase and str(self.elementId).lower()==layerId:
-            l=self
-        elif not fromRoot:
-            l=self.root._getLayerById(layerId,ignorecase,True)
-        else:
-            for c in self.children:
-                l=c._getLayerById(layerId,ignorecase,True)
-                if l is not None:
-                    break
-        return l
+        return self._layerIndex.getById(str(layerId),ignorecase)
 
-    def _getLayerByName(self,name:str,ignorecase:bool=False,ignore:Union[bool,None]=None)->'Layer':
+    def _getLayerByName(self,name:str,ignorecase:bool=False)->'Layer':
         """
         fetch a layer with the given name
 
+        If more than one layer has that name, the nearest one wins
+        (first this layer and its children, then its parent's, etc)
+
         :param name: find the name (if ignorecase, must be lower cased)
-        :param ignore: list of layers to ignore (prevent looping)
         """
-        #print('comparing name',name,self.name)
-        if ignore is None:
-            ignore=[self]
-        else:
-            ignore.append(self)
-        l=None
-        if self.name==name:
-            l=self
-        elif ignorecase and self.name.lower()==name:
-            l=self
+        return self._layerIndex.getByName(name,ignorecase,self)
+
+    @property
+    def _layerIndex(self)->LayerIndex:
+        """
+        the document's layer index, or for a layer that is not part of a
+        document, a (throwaway) index of the tree it is in
+        """
+        index=getattr(self.root,'layerIndex',None)
+        if index is None:
+            index=LayerIndex(self.root)
+        return index
+
+    def _setProperty(self,name:str,value):
+        """
+        name - set this property from the xml attributes
+        value -
+        """
+        SmartimageXmlObject._setProperty(self,name,value)
+        if name in ('id','name'):
+            index=getattr(self.root,'layerIndex',None)
+            if index is not None:
+                index.update(self)
+        self.invalidate()
+
+    def invalidate(self)->NoReturn:
+        """
+        mark this layer, and everything depending upon it, as needing to be re-rendered
+        (only necessary if you modify the xml directly)
+        """
+        dependencies=getattr(self.root,'dependencies',None)
+        if dependencies is not None:
+            dependencies.layerChanged(self)
         else:
-            for c in self.children:
-                if c not in ignore:
-                    l=c._getLayerByName(name,ignorecase,ignore)
-                    if l is not None:
-                        break
-        if l is None and self.parent is not None:
-            l=self.parent._getLayerByName(name,ignorecase,ignore)
-        return l
+            # not part of a document, so only this layer can be affected
+            self._renderKeyValid=False
+            self._attributes=None
+
+    def childrenChanged(self)->NoReturn:
+        """
+        call after adding or removing child elements of this layer's xml
+        so that the child layers are re-created
+        """
+        if self._children is not None:
+            layerRemoved=getattr(self.root,'layerRemoved',None)
+            if layerRemoved is not None:
+                for child in self._children:
+                    layerRemoved(child)
+            self._children=None
+        self.invalidate()
+
+    @property
+    def attributes(self)->LayerAttributes:
+        """
+        the layer's commonly-used attributes, all resolved
+        (kept until something they depend upon changes)
+        """
+        if self._attributes is None:
+            self._attributes=LayerAttributes(self)
+        return self._attributes
 
     @property
     def x(self)->float:
@@ -109,7 +153,7 @@ class Layer(SmartimageXmlObject,Bounds):
         """
         x=self._getProperty('x','auto')
         if x in ('','auto','None'):
-            x=[child.x for child in self.children]
+            x=[child.attributes.x for child in self.children]
             if x:
                 x=min(x)
             else:
@@ -132,7 +176,7 @@ class Layer(SmartimageXmlObject,Bounds):
         """
         y=self._getProperty('y','auto')
         if y in ('','auto','None'):
-            y=[child.y for child in self.children]
+            y=[child.attributes.y for child in self.children]
             if y:
                 y=min(y)
             else:
@@ -156,7 +200,7 @@ class Layer(SmartimageXmlObject,Bounds):
         w=self._getProperty('w','auto')
         if w in ('','0','auto','None'):
             if self.children:
-                w=[child.x+child.w for child in self.children]
+                w=[child.attributes.x+child.attributes.w for child in self.children]
                 w=max(w)-self.x
             else:
                 w=0
@@ -177,7 +221,7 @@ class Layer(SmartimageXmlObject,Bounds):
         h=self._getProperty('h','auto')
         if h in ('','0','auto','None'):
             if self.children:
-                h=[child.y+child.h for child in self.children]
+                h=[child.attributes.y+child.attributes.h for child in self.children]
                 h=max(h)-self.y
             else:
                 h=0
@@ -243,9 +287,11 @@ class Layer(SmartimageXmlObject,Bounds):
     @property
     def blendMode(self)->str:
         """
-        available: (from imagechops module)
-            'normal','darker','difference','add','add_mod','multiply',
-            'and','or','screen','subtract','subtract_mod'
+        available: (see compositing.BLEND_MODES)
+            'normal','multiply','screen','overlay','darker','lighter',
+            'dodge','burn','hardlight','softlight','difference','exclusion',
+            'add','add_mod','subtract','subtract_mod','and','or',
+            'hue','saturation','color','luminosity'
         """
         return self._getProperty('blendMode','normal')
     @blendMode.setter
@@ -315,6 +361,9 @@ class Layer(SmartimageXmlObject,Bounds):
                 child=self._createChild(self,tag)
                 if child is not None:
                     self._children.append(child)
+                    layerCreated=getattr(self.root,'layerCreated',None)
+                    if layerCreated is not None:
+                        layerCreated(child)
                 #else:
                 #\traise SmartimageError(self,'Null child element')
         return self._children
@@ -375,6 +424,35 @@ class Layer(SmartimageXmlObject,Bounds):
         """
         return None
 
+    def imageRegion(self,box:Tuple[int,int,int,int])->Tuple[Union[PilPlusImage,None],
+        Union[Tuple[int,int],None]]:
+        """
+        get only part of this layer's own image (not including children)
+
+        Child classes that can create part of their image without
+        creating all of it should override this.
+
+        :param box: (left,top,right,bottom) in this layer's coordinates
+        :return: (image,(x,y)) of only the part the image actually covers,
+            or (None,None)
+        """
+        return clipToBox(self.image,(0,0),box)
+
+    def _baseImage(self,renderContext:RenderingContext)->Union[PilPlusImage,None]:
+        """
+        this layer's own image, as used while rendering
+        (the same as self.image, unless making it means rendering other layers)
+        """
+        return self.image
+
+    def _baseImageRegion(self,renderContext:RenderingContext,box:Tuple[int,int,int,int]
+        )->Tuple[Union[PilPlusImage,None],Union[Tuple[int,int],None]]:
+        """
+        only part of this layer's own image, as used while rendering tiles
+        (see imageRegion)
+        """
+        return self.imageRegion(box)
+
     @property
     def mask(self)->Union[PilPlusImage,None]:
         """
@@ -399,25 +477,189 @@ class Layer(SmartimageXmlObject,Bounds):
             img=img.convert("L")
         return img
 
-    def renderImage(self,renderContext:RenderingContext=None)->Union[PilPlusImage,None]:
+    # whether rendering this layer changes state that other layers read
+    # (such as variables) so that it cannot be rendered on a worker thread
+    changesSharedState=False
+
+    # whether the children are composited on top of this layer's own image
+    # (otherwise, the layer makes its image out of them, such as Pattern)
+    compositesChildren=True
+
+    @property
+    def threadSafe(self)->bool:
+        """
+        whether this layer, and everything it renders (its children and
+        any layers it refers to), can be rendered on a worker thread
+        at the same time as other layers
+        """
+        return self._threadSafe(set())
+
+    def _threadSafe(self,visited:Set['Layer'])->bool:
+        if self in visited:
+            return True
+        visited.add(self)
+        if self.changesSharedState:
+            return False
+        layers=list(self.children)
+        dependencies=getattr(self.root,'dependencies',None)
+        if dependencies is not None:
+            layers.extend(dependencies.layerDeps.get(self,()))
+        for layer in layers:
+            if not layer._threadSafe(visited):
+                return False
+        return True
+
+    @property
+    def cacheable(self)->bool:
+        """
+        whether this layer always renders the same given the same renderKey
+        (for instance, a layer using unseeded randomness does not)
+        """
+        return True
+
+    @property
+    def renderKey(self)->Union[str,None]:
+        """
+        a stable hash of everything that goes into rendering this layer
+
+        returns None if the layer cannot be cached
+        """
+        return RenderingContext().renderKey(self)
+
+    def _renderKeyParts(self,renderContext:RenderingContext)->Union[list,None]:
+        """
+        everything that goes into rendering this layer, namely its type,
+        its dereferenced attributes and text, the contents of any components
+        it uses, and the renderKeys of its children
+
+        returns None if the layer cannot be cached
+        """
+        if not self.cacheable:
+            return None
+        parts=[self.__class__.__name__,self.xml.tag,self.text]
+        for name in sorted(self.xml.attrib.keys()):
+            if name in ('id','name'):
+                continue
+            value=self._getProperty(name)
+            if name in self._componentAttributes and isinstance(value,str):
+                if value.startswith('@'):
+                    ref=self.root.getLayer(value[1:])
+                    if ref is not None:
+                        value=renderContext.renderKey(ref)
+                        if value is None:
+                            return None
+                else:
+                    digest=self.root.componentDigest(value)
+                    if digest is not None:
+                        value=digest
+            parts.append((name,value))
+        for child in self.children:
+            childKey=renderContext.renderKey(child)
+            if childKey is None:
+                return None
+            parts.append(childKey)
+        return parts
+
+    def renderImage(self,renderContext:RenderingContext=None,
+        workers:Union[int,None]=None)->Union[PilPlusImage,None]:
         """
         render this layer to a final image
 
         renderContext - used to keep track for child renders
             (Used internally, so no need to specify this)
+        workers - how many threads to render with
+            (default is the document's renderWorkers)
 
         WARNING: Do not modify the image without doing a .copy() first!
         """
-        if self.root.cacheRenderedLayers and not self.dirty:
-            if self._lastRenderedImage is not None:
-                return self._lastRenderedImage
         if renderContext is None:
-            renderContext=RenderingContext()
-        ret=renderContext.renderImage(self)
-        if self.root.cacheRenderedLayers:
-            self._lastRenderedImage=ret
+            if workers is None:
+                workers=self.root.renderWorkers
+            renderContext=RenderingContext(workers)
+            renderContext.compile(self)
+            try:
+                return self.renderImage(renderContext)
+            finally:
+                renderContext.close()
+        key=None
+        if self.root.cacheRenderedLayers and renderContext.cacheRenders:
+            key=renderContext.renderKey(self)
+            if key is not None:
+                found,image=self.root.renderCache.lookup(key)
+                if found:
+                    renderContext.log('cached',self.name)
+                    if self.root.trackDamage:
+                        renderContext.recordDamage(self,image)
+                    return image
+        ret=self._renderImage(renderContext)
+        if key is not None:
+            if ret is not None:
+                ret.immutable=True # mark this image so that compositor will not alter it
+            self.root.renderCache.put(key,ret)
+        if self.root.trackDamage:
+            renderContext.recordDamage(self,ret)
         return ret
 
+    def _renderImage(self,renderContext:RenderingContext)->Union[PilPlusImage,None]:
+        """
+        actually render this layer, bypassing the render cache
+
+        This is what child classes override to change how they render
+        """
+        return renderContext.renderImage(self)
+
+    def _damageAfterRender(self,rect:Union[Tuple[int,int,int,int],Tuple,None]
+        )->Union[Tuple[int,int,int,int],Tuple,None]:
+        """
+        given what part of renderContext.renderImage() changed, what part
+        of this layer's final image changed
+
+        Child classes that do something more to the image in _renderImage()
+        should override this.
+
+        :param rect: the changed rectangle, () for nothing, or None for everything
+        """
+        return rect
+
+    def renderTiled(self,filename:str,tileSize:int=1024,workers:Union[int,None]=None,
+        size:Union[Tuple[int,int],None]=None)->NoReturn:
+        """
+        render straight to an image file, one tile at a time, so that memory
+        use depends upon the tile size rather than the size of the image
+        (for very large images, such as posters)
+
+        Layers that cannot render only part of themselves are still rendered
+        whole (see RenderingContext.renderTiled for which ones).
+
+        :param filename: the image file to save
+        :param tileSize: how big of squares to render at a time
+        :param workers: how many tiles to render at once
+            (default is the document's renderWorkers)
+        :param size: the (w,h) of the final image, if known
+        """
+        if workers is None:
+            workers=self.root.renderWorkers
+        renderContext=RenderingContext(workers)
+        renderContext.compile(self)
+        try:
+            renderContext.renderTiled(self,filename,tileSize,size)
+        finally:
+            renderContext.close()
+
+    def _renderRegion(self,renderContext:RenderingContext,box:Tuple[int,int,int,int]
+        )->Tuple[Union[PilPlusImage,None],Union[Tuple[int,int],None]]:
+        """
+        render only part of this layer (used for tiled rendering)
+
+        Child classes that override _renderImage() should also override this,
+        even if it is only to use renderContext.cropRegion()
+
+        :param box: (left,top,right,bottom) in this layer's coordinates
+        :return: (image,(x,y)) of only the part the layer actually covers,
+            or (None,None)
+        """
+        return renderContext.renderRegion(self,box)
+
     @property
     def finalRoi(self)->Union[PilPlusImage,None]:
         """
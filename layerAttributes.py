@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+A layer's commonly-used attributes, resolved once
+"""
+from typing import *
+
+
+class LayerAttributes:
+    """
+    A layer's commonly-used attributes, resolved once.
+
+    Getting an attribute from the layer itself means digging it out of the
+    xml and following any @references every time.  Rendering needs these
+    values many times per layer, so they are resolved into plain values
+    here, and kept until the layer is invalidated (see DependencyGraph).
+    """
+
+    __slots__=('x','y','w','h','opacity','blendMode','visible','rotation','cropping')
+
+    def __init__(self,layer:'Layer'):
+        self.x:float=layer.x
+        self.y:float=layer.y
+        self.w:float=layer.w
+        self.h:float=layer.h
+        self.opacity:float=layer.opacity
+        self.blendMode:str=layer.blendMode
+        self.visible:bool=layer.visible
+        self.rotation:float=layer.rotation
+        self.cropping:Union[list,None]=layer.cropping
+
+    @property
+    def location(self)->Tuple[float,float]:
+        """
+        the (x,y) location of the layer
+        """
+        return (self.x,self.y)
+
+    @property
+    def size(self)->Tuple[float,float]:
+        """
+        the (w,h) size of the layer
+        """
+        return (self.w,self.h)
+
+    def __repr__(self)->str:
+        return 'LayerAttributes(%s)'%(', '.join(['%s=%s'%(k,getattr(self,k)) for k in self.__slots__]))
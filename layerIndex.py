@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+An index to quickly find layers by id or name
+"""
+from typing import *
+
+
+class LayerIndex:
+    """
+    An index to quickly find layers by id or name,
+    rather than searching the whole layer tree every time.
+
+    Kept up to date as children are created (see Layer.children)
+    and as ids and names are changed (see Layer._setProperty).
+    """
+
+    def __init__(self,root:'Layer'):
+        self._byId:Dict[str,List['Layer']]={}
+        self._byIdLower:Dict[str,List['Layer']]={}
+        self._byName:Dict[str,List['Layer']]={}
+        self._byNameLower:Dict[str,List['Layer']]={}
+        self._keys:Dict['Layer',Tuple[str,str]]={}
+        self._addTree(root)
+
+    def _addTree(self,layer:'Layer')->NoReturn:
+        self.add(layer)
+        for child in layer.children:
+            self._addTree(child)
+
+    @staticmethod
+    def _layerKeys(layer:'Layer')->Tuple[str,str]:
+        """
+        the (id,name) to index a layer under
+
+        NOTE: this uses the raw name, rather than following @references,
+            since following references is what we are indexing for!
+        """
+        layerId=str(layer.elementId)
+        name=layer.xml.attrib.get('name')
+        if name is None:
+            name='Layer '+layerId
+        return layerId,name
+
+    def add(self,layer:'Layer')->NoReturn:
+        """
+        add a layer to the index
+        """
+        if layer in self._keys:
+            return
+        layerId,name=self._layerKeys(layer)
+        self._keys[layer]=(layerId,name)
+        for index,key in self._entries(layerId,name):
+            index.setdefault(key,[]).append(layer)
+
+    def remove(self,layer:'Layer')->NoReturn:
+        """
+        remove a layer from the index
+        """
+        keys=self._keys.pop(layer,None)
+        if keys is None:
+            return
+        for index,key in self._entries(*keys):
+            layers=index.get(key,[])
+            if layer in layers:
+                layers.remove(layer)
+            if not layers:
+                index.pop(key,None)
+
+    def _entries(self,layerId:str,name:str)->List[Tuple[Dict[str,List['Layer']],str]]:
+        """
+        all of the (index,key) pairs a layer goes into
+        """
+        return [(self._byId,layerId),(self._byIdLower,layerId.lower()),
+            (self._byName,name),(self._byNameLower,name.lower())]
+
+    def update(self,layer:'Layer')->NoReturn:
+        """
+        call whenever the id or name of a layer changes
+        """
+        self.remove(layer)
+        self.add(layer)
+
+    def getById(self,layerId:str,ignorecase:bool=False)->Union['Layer',None]:
+        """
+        fetch a layer with the given id
+
+        :param layerId: find the id (if ignorecase, must be lower cased)
+        """
+        if ignorecase:
+            layers=self._byIdLower.get(layerId)
+        else:
+            layers=self._byId.get(layerId)
+        if not layers:
+            return None
+        # the first one wins, same as a tree search would
+        return layers[0]
+
+    def getByName(self,name:str,ignorecase:bool=False,
+        nearTo:Union['Layer',None]=None)->Union['Layer',None]:
+        """
+        fetch a layer with the given name
+
+        :param name: find the name (if ignorecase, must be lower cased)
+        :param nearTo: if more than one layer has the name, pick the nearest
+            to this layer (first itself and its children, then its parent's, etc)
+        """
+        if ignorecase:
+            layers=self._byNameLower.get(name)
+        else:
+            layers=self._byName.get(name)
+        if not layers:
+            return None
+        if len(layers)==1 or nearTo is None:
+            return layers[0]
+        # how many levels up do we need to go to contain each candidate?
+        scopes={}
+        scope=nearTo
+        distance=0
+        while scope is not None:
+            scopes[scope]=distance
+            distance+=1
+            scope=scope.parent
+        best=None
+        bestDistance=None
+        for layer in layers:
+            ancestor=layer
+            while ancestor is not None and ancestor not in scopes:
+                ancestor=ancestor.parent
+            if ancestor is None:
+                continue
+            if bestDistance is None or scopes[ancestor]<bestDistance:
+                best=layer
+                bestDistance=scopes[ancestor]
+        if best is None:
+            best=layers[0]
+        return best
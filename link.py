@@ -27,7 +27,9 @@ class Link(Layer):
         set the reference
         """
         self.xml.attrib['ref']=ref
+        self._target=None
         self.root.dirty=True
+        self.invalidate()
 
     def _getProperty(self,name:str,default=None):
         """
@@ -53,6 +55,19 @@ class Link(Layer):
                 raise SmartimageError(self,'ERR: broken link to layer %s'%layerId)
         return self._target
 
+    def _renderKeyParts(self,renderContext:RenderingContext)->Union[list,None]:
+        """
+        a link renders whatever its target does
+        """
+        parts=Layer._renderKeyParts(self,renderContext)
+        if parts is None:
+            return None
+        targetKey=renderContext.renderKey(self.target)
+        if targetKey is None:
+            return None
+        parts.append(targetKey)
+        return parts
+
     @property
     def image(self)->Union[PilPlusImage,None]:
         """
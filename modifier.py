@@ -2,10 +2,18 @@
 """
 This is a modifier layer such as blur, sharpen, posterize, etc
 """
+import math
+import numpy as np
 from PIL import ImageFilter, ImageOps, ImageEnhance
 from imageTools import *
 from smartimage.layer import *
 from smartimage.errors import SmartimageError
+from smartimage.compositing import clipToBox
+from smartimage.damage import expandRect
+from smartimage.convolution import convolveImage
+from smartimage.blur import gaussianBlur,boxBlur,unsharpMask,gaussianSupport
+from smartimage.pointwise import PointwiseChain
+from smartimage.colorLut import CubeLut,cachedCube
 
 
 class Modifier(Layer):
@@ -20,7 +28,7 @@ class Modifier(Layer):
     def filterType(self)->str:
         """
         supported types:
-            brightness,contrast,rotate
+            brightness,contrast,rotate,lut,...
         """
         return self._getProperty('type','?')
 
@@ -37,6 +45,7 @@ class Modifier(Layer):
         """
         treatment for edges
             options: mirror,repeat,clamp,[color]
+            (see convolution.padArray)
 
         useful for:
             convolve, expand_border, others?
@@ -68,31 +77,31 @@ class Modifier(Layer):
         return divide
 
     @property
-    def matrix(self)->list:
+    def matrix(self)->List[List[float]]:
         """
-        a 3x3 or 5x5 convolution matrix
+        a convolution matrix of any size, eg "[[0,-1,0],[-1,5,-1],[0,-1,0]]"
+
+        It is centered on each pixel (for an even size, the center
+        is the one right of/below the middle)
 
         useful for:
             convolve
         """
         ret=[]
         matrix=self._getProperty('matrix','[[0,0,0],[0,1,0],[0,0,0]]').replace(' ','')
-        if matrix.startswith('[['):
-            matrix=matrix[1:-1]
-        else:
-            matrix=matrix
-        matrix=matrix.split('[')[1:]
-        size=None
-        for row in matrix:
-            row=row.split(']',1)[0].split(',')
-            if (size is None and len(row) not in [5,3]) or size!=len(row):
-                size=len(row)
-                info=(matrix,len(row))
-                raise SmartimageError(self,'Convolution matrix "%s" size %d not 3x3 or 5x5!'%info)
-            ret.append([float(v) for v in row])
-        if len(ret)!=size:
-            info=(matrix,len(ret))
-            raise SmartimageError(self,'Convolution matrix "%s" size %d not 3x3 or 5x5!'%info)
+        for row in matrix.split('[')[1:]:
+            row=row.split(']',1)[0]
+            if not row:
+                continue
+            try:
+                ret.append([float(v) for v in row.split(',')])
+            except ValueError:
+                raise SmartimageError(self,'Convolution matrix "%s" has a non-numeric value'%matrix)
+            if len(ret[-1])!=len(ret[0]):
+                info=(matrix,len(ret[-1]),len(ret[0]))
+                raise SmartimageError(self,'Convolution matrix "%s" row size %d does not match %d'%info)
+        if not ret:
+            raise SmartimageError(self,'Convolution matrix "%s" is empty'%matrix)
         return ret
 
     @property
@@ -128,6 +137,151 @@ class Modifier(Layer):
         """
         return float(self._getProperty('threshold',0))
 
+    @property
+    def bits(self)->int:
+        """
+        how many bits of each color to keep
+
+        supported types:
+            posterize
+        """
+        return int(self._getProperty('bits',4))
+
+    @property
+    def src(self)->Union[str,None]:
+        """
+        a file the modifier uses
+
+        supported types:
+            lut - a .cube color lookup table
+        """
+        return self._getProperty('src')
+
+    @property
+    def interpolation(self)->str:
+        """
+        how to look colors up in between the entries of a table
+            tetrahedral - most accurate
+            trilinear - faster
+            table - precompute every possible color (fastest for huge images)
+
+        supported types:
+            lut
+        """
+        return self._getProperty('interpolation','tetrahedral')
+
+    @property
+    def lut(self)->CubeLut:
+        """
+        the parsed color lookup table
+        (parsed once, then shared by everything that uses the same file)
+
+        supported types:
+            lut
+        """
+        src=self.src
+        if src is None:
+            raise SmartimageError(self,'No lut src given')
+        digest=self.root.componentDigest(src)
+        if digest is None:
+            raise SmartimageError(self,'Missing lut src resource "%s"'%src)
+        def load()->bytes:
+            f=self.root.getComponent(src)
+            try:
+                return f.read()
+            finally:
+                f.close()
+        try:
+            return cachedCube(digest,load)
+        except ValueError as e:
+            raise SmartimageError(self,'Bad lut "%s": %s'%(src,e))
+
+    @property
+    def pointwiseOperations(self)->Union[List[Tuple[str,Any]],None]:
+        """
+        if this modifier only changes each pixel based upon itself,
+        what it does, as a list of PointwiseChain operations
+
+        None if it is not pointwise
+        """
+        filterType=self.filterType
+        if filterType in ('brightness','contrast','saturation'):
+            return [(filterType,self.amount)]
+        if filterType=='invert':
+            return [('invert',None)]
+        if filterType=='posterize':
+            return [('posterize',self.bits)]
+        if filterType=='solarize':
+            return [('solarize',float(self._getProperty('threshold',128)))]
+        return None
+
+    def _pointwiseChain(self)->Tuple[PointwiseChain,Layer]:
+        """
+        follow a stack of nested pointwise modifiers downwards, for instance
+            <modifier type="contrast"><modifier type="invert">...</modifier></modifier>
+        so that they can all be done in one go
+
+        Only modifiers that would simply pass the image of the one below
+        straight through are included.
+
+        :return: (chain,source) where chain includes this modifier and
+            source is the bottom modifier, whose children are what the
+            chain is applied to
+        """
+        stack=[self]
+        source=self
+        while True:
+            if source.image is not None or len(source.children)!=1:
+                break
+            attributes=source.attributes
+            if attributes.cropping is not None or attributes.rotation%360!=0:
+                break
+            child=source.children[0]
+            if not isinstance(child,Modifier) or child.pointwiseOperations is None:
+                break
+            childAttributes=child.attributes
+            if not childAttributes.visible or childAttributes.opacity!=1.0 or \
+                childAttributes.blendMode!='normal' or childAttributes.location!=(0,0) or \
+                child.mask is not None:
+                break
+            stack.append(child)
+            source=child
+        chain=PointwiseChain()
+        for modifier in reversed(stack):
+            for operation,value in modifier.pointwiseOperations:
+                chain.add(operation,value)
+        if self.attributes.opacity<1.0:
+            chain.add('opacity',self.attributes.opacity)
+        return chain,source
+
+    @property
+    def halo(self)->Union[int,None]:
+        """
+        how far away from a pixel the modifier looks to decide its value
+        (tiles are rendered with this much extra around them so the seams don't show)
+
+        None if the modifier moves pixels around, or otherwise depends upon
+        the whole image (eg, contrast uses the average color), so it needs all of it
+        """
+        filterType=self.filterType
+        if filterType in ('brightness','saturation','invert','posterize','solarize','lut'):
+            return 0
+        if filterType in ('contour','detail','edge_enhance','edge_enhance_more',
+            'emboss','edge_detect','smooth','sharpen'):
+            return 1 # 3x3 kernels
+        if filterType in ('blur','smooth_more'):
+            return 2 # 5x5 kernels
+        if filterType=='convolve':
+            if self.edge=='repeat':
+                return None # wraps around to the other side of the whole image
+            matrix=self.matrix
+            return max(len(matrix),len(matrix[0]))//2
+        if filterType in ('gaussian_blur','unsharp_mask'):
+            return gaussianSupport(self.blurRadius)+1
+        if filterType=='box_blur':
+            return int(math.ceil(self.blurRadius))+1
+        return None
+
     def roi(self,image:PilPlusImage)->Union[PilPlusImage,None]:
         """
         the region of interest
@@ -147,47 +301,47 @@ class Modifier(Layer):
             offsX=10
             offsY=10
             blurRadius=self.blurRadius
-            shadow=img.copy()
-            control=ImageEnhance.Brightness(shadow)
-            shadow=control.enhance(0)
-            final=Image.new("RGBA",(img.width+abs(offsX),img.height+abs(offsX)))
-            final.putalpha(int(self.modifierOpacity*255))
+            if img.mode!='RGBA':
+                img=img.convert('RGBA')
+            # the shadow is black all over, so only its alpha needs to be blurred
+            alpha=np.full((img.height+abs(offsX),img.width+abs(offsX)),
+                int(self.modifierOpacity*255)/255.0,dtype=np.float32)
             dest=(int(max(offsX-blurRadius,0)),int(max(offsY-blurRadius,0)))
-            final.alpha_composite(shadow,dest=dest)
-            if blurRadius>0:
-                final=final.filter(ImageFilter.GaussianBlur(radius=blurRadius))
+            shadowAlpha=np.asarray(img.getchannel('A'),dtype=np.float32)/255.0
+            region=alpha[dest[1]:dest[1]+img.height,dest[0]:dest[0]+img.width]
+            shadowAlpha=shadowAlpha[0:region.shape[0],0:region.shape[1]]
+            region[...]=shadowAlpha+region*(1.0-shadowAlpha)
+            alpha=Image.fromarray(np.clip(alpha*255.0+0.5,0,255).astype(np.uint8))
+            alpha=gaussianBlur(alpha,blurRadius)
+            final=Image.new('RGBA',alpha.size)
+            final.putalpha(alpha)
             final.alpha_composite(img,dest=(max(-offsX,0),max(-offsY,0)))
             img=final
         elif filterType=='convolve':
-            # TODO: make use of separable convoutions, fourier domain convolutions,
-            #       and other speed-ups
-            matrix=self.matrix
-            ImageFilter.Kernel((len(matrix),len(matrix)),matrix,scale=self.divide,offset=self.add)
+            # (separable and fourier domain speed-ups are taken care of by convolveImage)
+            try:
+                img=convolveImage(img,self.matrix,edge=self.edge,add=self.add,
+                    divide=self.divide,channels=self.channels)
+            except ValueError as e:
+                raise SmartimageError(self,str(e))
+        elif filterType=='lut':
+            img=self.lut.apply(img,self.interpolation)
         elif filterType=='autocrop':
             # the idea is you cut off as many rows from each side that are all alpha=0
             raise NotImplementedError()
-        elif filterType=='brightness':
-            control=ImageEnhance.Brightness(img)
-            control.amount=self.amount
-        elif filterType=='contrast':
-            control=ImageEnhance.Contrast(img)
-            control.amount=self.amount
-        elif filterType=='saturation':
-            control=ImageEnhance.Color(img)
-            control.amount=self.amount
+        elif self.pointwiseOperations is not None:
+            chain=PointwiseChain()
+            for operation,value in self.pointwiseOperations:
+                chain.add(operation,value)
+            img=chain.apply(img)
         elif filterType=='blur':
             img=img.filter(ImageFilter.BLUR)#,self.amount)
         elif filterType=='gaussian_blur':
-            blurRadius=self.blurRadius
-            if blurRadius>0:
-                img=img.filter(ImageFilter.GaussianBlur(radius=blurRadius))
+            img=gaussianBlur(img,self.blurRadius)
         elif filterType=='box_blur':
-            blurRadius=self.blurRadius
-            if blurRadius>0:
-                img.filter(ImageFilter.BoxBlur(radius=blurRadius))
+            img=boxBlur(img,self.blurRadius)
         elif filterType=='unsharp_mask':
-            ImageFilter.UnsharpMask(radius=self.blurRadius,
-                percent=self.amount*100,threshold=self.threshold)
+            img=unsharpMask(img,self.blurRadius,self.amount,self.threshold)
         elif filterType=='contour':
             img=img.filter(ImageFilter.CONTOUR,self.amount)
         elif filterType=='detail':
@@ -206,30 +360,70 @@ class Modifier(Layer):
             img=img.filter(ImageFilter.SMOOTH_MORE,self.amount)
         elif filterType=='sharpen':
             img=img.filter(ImageFilter.SHARPEN,self.amount)
-        elif filterType=='invert':
-            img=ImageOps.invert(img)
         elif filterType=='flip':
             img=ImageOps.flip(img)
         elif filterType=='mirror':
             img=ImageOps.mirror(img)
-        elif filterType=='posterize':
-            img=ImageOps.posterize(img)
-        elif filterType=='solarize':
-            img=ImageOps.solarize(img)
         else:
             raise SmartimageError(self,'Unknown modifier "%s"'%filterType)
         return img
 
-    def renderImage(self,renderContext=None)->Union[PilPlusImage,None]:
+    def _renderImage(self,renderContext:RenderingContext)->Union[PilPlusImage,None]:
         """
         WARNING: Do not modify the image without doing a .copy() first!
         """
-        opacity=self.opacity
-        if opacity<=0.0 or not self.visible:
+        attributes=self.attributes
+        opacity=attributes.opacity
+        if opacity<=0.0 or not attributes.visible:
             return None
-        image=Layer.renderImage(self,renderContext)
+        if self.pointwiseOperations is not None:
+            # a stack of color adjustments is done in a single pass
+            chain,source=self._pointwiseChain()
+            if source is not self:
+                renderContext.log('fusing %d pointwise modifiers under "%s"'%(len(chain),self.name))
+            image=Layer._renderImage(source,renderContext)
+            if source is not self:
+                renderContext.compositeDamage.pop(source,None)
+            if image is None:
+                return None
+            return chain.apply(image)
+        image=Layer._renderImage(self,renderContext)
         if image is not None:
             image=self._transform(image.copy())
-            if self.opacity<1.0:
+            if opacity<1.0:
                 adjustOpacity(image,opacity)
         return image
+
+    def _damageAfterRender(self,rect:Union[Tuple[int,int,int,int],Tuple,None]
+        )->Union[Tuple[int,int,int,int],Tuple,None]:
+        """
+        a change spreads as far as the modifier looks (see halo)
+        """
+        if not rect:
+            return rect
+        halo=self.halo
+        if halo is None:
+            return None
+        return expandRect(rect,halo)
+
+    def _renderRegion(self,renderContext:RenderingContext,box:Tuple[int,int,int,int]
+        )->Tuple[Union[PilPlusImage,None],Union[Tuple[int,int],None]]:
+        """
+        render the part of the modified image within a box, using
+        a little extra around it (see halo) for the modifier to work with
+        """
+        attributes=self.attributes
+        halo=self.halo
+        if halo is None or attributes.rotation%360!=0 or attributes.cropping is not None:
+            return renderContext.cropRegion(self,box)
+        opacity=attributes.opacity
+        if opacity<=0.0 or not attributes.visible:
+            return None,None
+        expanded=(box[0]-halo,box[1]-halo,box[2]+halo,box[3]+halo)
+        image,position=renderContext.renderRegion(self,expanded)
+        if image is None:
+            return None,None
+        image=self._transform(image.copy())
+        if opacity<1.0:
+            adjustOpacity(image,opacity)
+        return clipToBox(image,position,box)
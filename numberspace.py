@@ -48,15 +48,32 @@ class NumberSpace(Layer):
         """
         return self._getPropertyBool('complex')
 
-    def renderImage(self,renderContext=None)->Union[PilPlusImage,None]:
+    def _renderImage(self,renderContext:RenderingContext)->Union[PilPlusImage,None]:
         """
         WARNING: Do not modify the image without doing a .copy() first!
         """
-        opacity=self.opacity
-        if opacity<=0.0 or not self.visible:
+        attributes=self.attributes
+        opacity=attributes.opacity
+        if opacity<=0.0 or not attributes.visible:
             return None
-        image=numberspaceTransform(Layer.renderImage(self,renderContext).copy(),
+        image=numberspaceTransform(Layer._renderImage(self,renderContext).copy(),
             self.space,invert=self.invert,complex=self.complex,level=self.levels,mode=self.mode)
-        if self.opacity<1.0:
+        if opacity<1.0:
             self.setOpacity(image,opacity)
-        return image
\ No newline at end of file
+        return image
+
+    def _damageAfterRender(self,rect:Union[Tuple[int,int,int,int],Tuple,None]
+        )->Union[Tuple[int,int,int,int],Tuple,None]:
+        """
+        the transform can depend upon the whole image, so assume it all changed
+        """
+        if rect==():
+            return rect
+        return None
+
+    def _renderRegion(self,renderContext:RenderingContext,box:Tuple[int,int,int,int]
+        )->Tuple[Union[PilPlusImage,None],Union[Tuple[int,int],None]]:
+        """
+        the transform needs the whole image, so render it all and cut out the box
+        """
+        return renderContext.cropRegion(self,box)
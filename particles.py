@@ -4,7 +4,64 @@ This is a particles type layer
 """
 import random
 from typing import *
+import numpy as np
+from PIL import Image
 from smartimage.layer import *
+from smartimage.compositing import Canvas,Stamp
+
+
+class DispersionSampler:
+    """
+    Picks pixels from a dispersion map, where the chance of getting
+    each pixel goes up with how bright it is
+
+    The running total of the pixel weights is worked out once, and then
+    every pick is a binary search into it, so picking lots of pixels
+    costs O(qty log pixels) no matter how big the map is.
+    (If the map is completely black, every pixel is equally likely.)
+    """
+
+    def __init__(self,dispersionMap:Image.Image):
+        if dispersionMap.mode!='L':
+            dispersionMap=dispersionMap.convert('L')
+        self.size:Tuple[int,int]=dispersionMap.size
+        weights=np.asarray(dispersionMap).ravel()
+        self.total=int(weights.sum(dtype=np.uint64))
+        self.cdf:Union[np.ndarray,None]=None
+        if self.total>0:
+            # (32 bits is enough for most maps, and takes half the memory)
+            dtype=np.uint32 if self.total<2**32 else np.uint64
+            self.cdf=np.cumsum(weights,dtype=dtype)
+
+    def sample(self,rng:np.random.Generator,qty:int)->np.ndarray:
+        """
+        pick pixels
+
+        :return: array of (x,y) for each pick
+        """
+        w,h=self.size
+        if self.cdf is None:
+            indices=rng.integers(0,w*h,qty)
+        else:
+            # (draw in the same type as the cdf, so it isn't converted to search it)
+            picks=rng.integers(0,self.total,qty,dtype=self.cdf.dtype)
+            indices=np.searchsorted(self.cdf,picks,side='right')
+        return np.stack((indices%w,indices//w),axis=-1)
+
+
+def dispersionSampler(dispersionMap:Image.Image)->DispersionSampler:
+    """
+    get the sampler for a dispersion map, only creating it the first time
+    (it is kept with the image, which must not be modified afterwards)
+    """
+    sampler=getattr(dispersionMap,'_dispersionSampler',None)
+    if sampler is None:
+        sampler=DispersionSampler(dispersionMap)
+        try:
+            dispersionMap._dispersionSampler=sampler
+        except AttributeError:
+            pass
+    return sampler
 
 
 class Particles(Layer):
@@ -12,6 +69,9 @@ class Particles(Layer):
     This is a particles type layer
     """
 
+    # randomizing sets variables, which every other layer can see
+    changesSharedState=True
+
     def __init__(self,parent:Layer,xml:str):
         Layer.__init__(self,parent,xml)
 
@@ -53,6 +113,8 @@ class Particles(Layer):
     def dispersionMap(self)->Union[PilPlusImage,None]:
         """
         an image to define where particles are more likely to land
+        (the brighter the pixel, the more likely, and it is stretched
+        to the size of the layer)
         """
         ref=self._getProperty('dispersionMap')
         try:
@@ -61,6 +123,25 @@ class Particles(Layer):
             raise SmartimageError(self,'Missing dispersionMap resource "%s"'%e.filename)
         return img
 
+    @property
+    def cacheable(self)->bool:
+        """
+        without a seed, every render comes out different
+        """
+        return self.seed is not None
+
+    @property
+    def variants(self)->Union[int,None]:
+        """
+        how many different values each randomized range is rounded to,
+        so that particles can share the same sprite
+        (by default, not rounded, so every particle is its own)
+        """
+        variants=self._getProperty('variants',None)
+        if variants is not None:
+            variants=max(int(variants),1)
+        return variants
+
     @property
     def qty(self)->int:
         """
@@ -69,7 +150,7 @@ class Particles(Layer):
         return int(self._getProperty('qty','1'))
 
     def randomizedValues(self,valsToRandomize:Dict[str,Union[float,Tuple[float,float],
-        List[str]]]=None)->Dict[str,Union[str,float]]:
+        List[str]]]=None,rng:Union[random.Random,None]=None)->Dict[str,Union[str,float]]:
         """
         Selects a set of randomized values
 
@@ -77,65 +158,162 @@ class Particles(Layer):
             a) a maximum float value
             b) a 2-tuple range of float values
             c) a list of choices
+        :rng: the random number generator to use (default is the global one)
         """
+        if rng is None:
+            rng=random
         vals={}
         if valsToRandomize is None:
             return vals
         for k,v in valsToRandomize.items():
             if isinstance(v,list): # choice
-                v=random.choice(v)
+                v=rng.choice(v)
             elif isinstance(v,tuple): # range
-                v=random.uniform(float(v[0]),float(v[1]))
+                v=rng.uniform(float(v[0]),float(v[1]))
             else: # max value only
-                v=random.uniform(0.0,float(v))
+                v=rng.uniform(0.0,float(v))
             vals[k]=v
         return vals
 
-    def renderImage(self,renderContext:RenderingContext=None)->Union[PilPlusImage,None]:
+    @staticmethod
+    def _quantize(values:np.ndarray,low:float,high:float,variants:int)->np.ndarray:
+        """
+        round randomized range values to one of a number of evenly spaced steps
+        """
+        if variants<2 or high==low:
+            return np.full_like(values,(low+high)/2.0)
+        step=(high-low)/(variants-1)
+        return low+np.round((values-low)/step)*step
+
+    def _randomizedColumns(self,rng:np.random.Generator,qty:int,
+        valsToRandomize:Dict[str,Union[float,Tuple[float,float],List[str]]],
+        variants:Union[int,None])->np.ndarray:
+        """
+        pick the randomized values for every particle at once
+
+        :return: a (qty,len(valsToRandomize)) array, with a column for each
+            value in turn (choices are the index of the choice)
+        """
+        columns=[]
+        for limits in valsToRandomize.values():
+            if isinstance(limits,list): # choice
+                columns.append(rng.integers(0,len(limits),qty).astype(np.float64))
+                continue
+            if isinstance(limits,tuple): # range
+                low,high=float(limits[0]),float(limits[1])
+            else: # max value only
+                low,high=0.0,float(limits)
+            values=rng.uniform(low,high,qty)
+            if variants is not None:
+                values=self._quantize(values,low,high,variants)
+            columns.append(values)
+        if not columns:
+            return np.empty((qty,0))
+        return np.stack(columns,axis=-1)
+
+    def _renderImage(self,renderContext:RenderingContext)->Union[PilPlusImage,None]:
         """
         render this layer to a final image
 
-        renderContext - used to keep track for child renders
-            (Used internally, so no need to specify this)
+        Every random value is picked up front, and then the copies are
+        stamped onto a single canvas, a run of the same particle at a time.
+        Each different particle (a child with a set of randomized values)
+        is rendered only once, when it is first needed, and let go of
+        as soon as its last copy is down.
 
         WARNING: Do not modify the image without doing a .copy() first!
         """
-        image=None
-        if self.root.cacheRenderedLayers and not self.dirty:
-            if self._lastRenderedImage is not None:
-                return self._lastRenderedImage
-        if renderContext is None:
-            renderContext=RenderingContext()
-        if self.seed is not None: # set the random seed if necessary
-            random.seed(self.seed)
+        qty=self.qty
+        children=self.children
+        if qty<1 or not children:
+            return None
+        # use our own generator so that other layers rendering
+        # at the same time can't change our sequence
+        rng=np.random.default_rng(self.seed)
         valsToRandomize=self.randomize
-        locations=self.dispersionMap
-        if locations is not None:
-            locations=np.argsort(self.dispersionMap.ndarray)
-        # keep a layer variable backup
+        variants=self.variants
+        dispersionMap=self.dispersionMap
+        w,h=self.w,self.h
+        # pick what every particle is, and group the ones that are the same
+        picks=np.concatenate((rng.integers(0,len(children),qty)[:,None].astype(np.float64),
+            self._randomizedColumns(rng,qty,valsToRandomize,variants)),axis=-1)
+        variantList,kinds=np.unique(picks,axis=0,return_inverse=True)
+        kinds=kinds.reshape(-1)
+        if dispersionMap is None:
+            positions=(rng.random((qty,2))*(w-1,h-1)).astype(np.intp)
+        else:
+            # place all of them at once, weighted by the map
+            sampler=dispersionSampler(dispersionMap)
+            positions=sampler.sample(rng,qty)
+            mapW,mapH=sampler.size
+            if (mapW,mapH)!=(w,h):
+                # stretch the map over the layer
+                positions=positions*np.array([w,h])//np.array([mapW,mapH])
+        # the last particle of each variant, after which it is not needed
+        lastUse=np.zeros(len(variantList),dtype=np.intp)
+        np.maximum.at(lastUse,kinds,np.arange(qty,dtype=np.intp))
+        stamps:Dict[int,Union[Stamp,None]]={}
+        # (the canvas grows to fit, so it ends up just big enough for all of them)
+        canvas=Canvas()
         varBak=self._variables.copy()
-        for _ in range(self.qty):
-            # pick what we are drawing
-            childLayer=random.choice(self.children)
-            # randomize its values
-            if valsToRandomize:
-                #childLayer.dirty=True
-                for k,v in self.randomizedValues(valsToRandomize).items():
-                    self._variables[k]=v
-            # randomize the location
-            dispersionMap=self.dispersionMap
-            if dispersionMap is None:
-                childLayer.x=int(random.random()*(self.w-1))
-                childLayer.y=int(random.random()*(self.h-1))
+        # when every particle is different, the renders are one-offs, so keep them
+        # out of the render cache (where they would only push out everything worth keeping)
+        cacheRenders=renderContext.cacheRenders
+        if valsToRandomize and variants is None:
+            renderContext.cacheRenders=False
+        try:
+            # stamp down each run of the same variant in one go
+            runStarts=np.concatenate(([0],np.flatnonzero(np.diff(kinds))+1,[qty]))
+            for start,end in zip(runStarts[:-1],runStarts[1:]):
+                kind=int(kinds[start])
+                if kind not in stamps:
+                    stamps[kind]=self._variantStamp(renderContext,children[int(variantList[kind,0])],
+                        self._variantValues(valsToRandomize,variantList[kind,1:]))
+                if stamps[kind] is not None:
+                    canvas.stamp(stamps[kind],positions[start:end])
+                if lastUse[kind]<end:
+                    del stamps[kind]
+        finally:
+            renderContext.cacheRenders=cacheRenders
+            self._variables=varBak
+            for k in valsToRandomize:
+                self.root.dependencies.variableChanged(k)
+        return canvas.image
+
+    @staticmethod
+    def _variantValues(valsToRandomize:Dict[str,Union[float,Tuple[float,float],List[str]]],
+        row:np.ndarray)->Tuple[Tuple[str,Union[str,float]],...]:
+        """
+        turn one row of randomized values back into (name,value) pairs
+        """
+        vals=[]
+        for (k,limits),v in zip(valsToRandomize.items(),row):
+            if isinstance(limits,list):
+                v=limits[int(v)]
             else:
-                pick=abs(int(random.random()*len(location)-random.random()*len(location)))
-                location=locations[pick]
-                childLayer.x=int(location[0])
-                childLayer.y=int(location[1])
-            # now draw it
-            childImage=childLayer.renderImage(renderContext)
-            image=composite(childImage,image,
-                opacity=childLayer.opacity,blendMode=childLayer.blendMode,mask=childLayer.mask,
-                position=childLayer.location,resize=True)
-        self._variables=varBak
-        return image
\ No newline at end of file
+                v=float(v)
+            vals.append((k,v))
+        return tuple(vals)
+
+    def _variantStamp(self,renderContext:RenderingContext,childLayer:Layer,
+        vals:Tuple[Tuple[str,Union[str,float]],...])->Union[Stamp,None]:
+        """
+        render one child with a set of randomized values, ready to stamp down
+
+        :return: the stamp, or None if there is nothing to draw
+        """
+        for k,v in vals:
+            self._variables[k]=v
+            self.root.dependencies.variableChanged(k)
+        childImage=childLayer.renderImage(renderContext)
+        childAttributes=childLayer.attributes
+        if childImage is None or childAttributes.opacity<=0.0:
+            return None
+        return Stamp(childImage,childAttributes.opacity,childAttributes.blendMode,childLayer.mask)
+
+    def _renderRegion(self,renderContext:RenderingContext,box:Tuple[int,int,int,int]
+        )->Tuple[Union[PilPlusImage,None],Union[Tuple[int,int],None]]:
+        """
+        particles land anywhere, so render them all and cut out the box
+        """
+        return renderContext.cropRegion(self,box)
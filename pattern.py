@@ -2,28 +2,196 @@
 """
 This is a layer for creating repeating patterns
 """
+import math
+import numpy as np
+from PIL import Image
 from imageTools import *
 from smartimage.layer import *
+from smartimage.compositing import Canvas
+from smartimage.convolution import edgeColor
+from smartimage import textureGenerators
+
+
+# repeat values that fill their whole axis with copies
+REPEATING=('all','bricks','isometric')
+
+
+def _scaled(cell:Image.Image,size:Tuple[int,int],repeat:Tuple[str,str])->Image.Image:
+    """
+    resize the cell as called for by the repeat values
+    """
+    w,h=size
+    cw,ch=cell.size
+    scaleX=scaleY=1.0
+    if repeat[0]=='maximize' or repeat[1]=='maximize':
+        scaleX=scaleY=max(w/cw,h/ch)
+    elif repeat[0]=='minimize' or repeat[1]=='minimize':
+        scaleX=scaleY=min(w/cw,h/ch)
+    else:
+        if repeat[0]=='stretch':
+            scaleX=w/cw
+        if repeat[1]=='stretch':
+            scaleY=h/ch
+        if repeat[0]=='maintainAspect':
+            scaleX=scaleY
+        elif repeat[1]=='maintainAspect':
+            scaleY=scaleX
+    newSize=(max(int(round(cw*scaleX)),1),max(int(round(ch*scaleY)),1))
+    if newSize==cell.size:
+        return cell
+    return cell.resize(newSize,Image.BICUBIC)
+
+
+def _period(cell:Image.Image,repeat:Tuple[str,str],mortar:int,
+    mortarColor:np.ndarray)->np.ndarray:
+    """
+    the smallest block of the pattern that repeats in both directions,
+    as an rgba array
+
+    For "all" that is simply the cell with the mortar on the right and bottom.
+    For "bricks" every other row is shifted over by half, and for "isometric"
+    the rows are also squeezed together onto a triangular grid,
+    so the block is two rows tall.
+    """
+    cw,ch=cell.size
+    pw=cw+mortar
+    if 'isometric' in repeat:
+        # rows are as far apart as the height of an equilateral triangle
+        pitch=max(int(round(pw*math.sqrt(3.0)/2.0)),1)
+        shift=pw//2
+    elif 'bricks' in repeat:
+        pitch=ch+mortar
+        shift=pw//2
+    else:
+        pitch=ch+mortar
+        shift=None
+    rows=1 if shift is None else 2
+    ph=pitch*rows
+    # draw every cell that touches the middle copy of the block, then cut it out
+    # (only a handful of cells, no matter how big the final image is)
+    reachX=int(math.ceil(cw/pw))+1
+    reachY=int(math.ceil(ch/pitch))+1
+    big=Image.new('RGBA',(pw*(2*reachX+1),ph+2*reachY*pitch),tuple(int(v) for v in mortarColor))
+    for row in range(-reachY,rows+reachY):
+        offset=shift if (shift is not None and row%2) else 0
+        for column in range(-reachX,reachX+1):
+            x=pw*reachX+column*pw+offset
+            y=reachY*pitch+row*pitch
+            big.alpha_composite(cell,(x,y))
+    left=pw*reachX
+    top=reachY*pitch
+    return np.asarray(big)[top:top+ph,left:left+pw]
+
+
+def _align(value:str,space:int,length:int)->int:
+    """
+    where a single copy goes along an axis
+    """
+    if value in ('once','left','top'):
+        return 0
+    if value in ('right','bottom'):
+        return space-length
+    return (space-length)//2 # center, middle, and anything scaled
+
+
+def tilePattern(cell:Image.Image,size:Tuple[int,int],repeat:Tuple[str,str]=('all','all'),
+    mortar:int=0,mortarColor:Union[str,np.ndarray]='transparent',
+    box:Union[Tuple[int,int,int,int],None]=None)->Union[Image.Image,None]:
+    """
+    fill an area with copies of a cell
+
+    The cell is only ever scaled once, and the copies are made by indexing
+    into a single repeating block of pixels (see tileRegion) rather than
+    pasting each copy, so it costs the same as copying the final image.
+
+    :param cell: the image to repeat
+    :param size: the (w,h) of the whole pattern
+    :param repeat: (repeatX,repeatY), see Pattern.repeat
+    :param mortar: how many pixels to leave between copies
+    :param mortarColor: what to fill the gaps with
+    :param box: (left,top,right,bottom) to only create that part of the pattern
+    :return: an rgba image of the box (or the whole size)
+    """
+    w,h=int(size[0]),int(size[1])
+    if box is None:
+        box=(0,0,w,h)
+    left,top=max(int(box[0]),0),max(int(box[1]),0)
+    right,bottom=min(int(box[2]),w),min(int(box[3]),h)
+    if right<=left or bottom<=top or cell is None or w<=0 or h<=0:
+        return None
+    if isinstance(mortarColor,str):
+        mortarColor=edgeColor(mortarColor,'rgba')
+    mortar=max(int(mortar),0)
+    cell=_scaled(cell.convert('RGBA'),(w,h),repeat)
+    cw,ch=cell.size
+    repeatX=repeat[0] in REPEATING
+    repeatY=repeat[1] in REPEATING
+    if repeatX and repeatY:
+        if repeat[0]=='all' and repeat[1] in ('bricks','isometric'):
+            # the columns are the ones offset, so do it sideways
+            block=_period(cell.transpose(Image.TRANSPOSE),repeat[::-1],mortar,mortarColor)
+            block=block.transpose(1,0,2)
+        else:
+            block=_period(cell,repeat,mortar,mortarColor)
+        return Image.fromarray(np.ascontiguousarray(textureGenerators.tileRegion(block,(left,top,right,bottom))))
+    ret=np.zeros((bottom-top,right-left,4),dtype=np.uint8)
+    if repeatX:
+        # a single row of copies
+        block=_period(cell,('all','all'),mortar,mortarColor)[0:ch]
+        x,y=0,_align(repeat[1],h,ch)
+        stripBox=(left,max(top,y),right,min(bottom,y+ch))
+    elif repeatY:
+        # a single column of copies
+        block=_period(cell,('all','all'),mortar,mortarColor)[:,0:cw]
+        x,y=_align(repeat[0],w,cw),0
+        stripBox=(max(left,x),top,min(right,x+cw),bottom)
+    else:
+        block=np.asarray(cell)
+        x,y=_align(repeat[0],w,cw),_align(repeat[1],h,ch)
+        stripBox=(max(left,x),max(top,y),min(right,x+cw),min(bottom,y+ch))
+    if stripBox[2]>stripBox[0] and stripBox[3]>stripBox[1]:
+        ret[stripBox[1]-top:stripBox[3]-top,stripBox[0]-left:stripBox[2]-left]=textureGenerators.tileRegion(block,
+            (stripBox[0]-x,stripBox[1]-y,stripBox[2]-x,stripBox[3]-y))
+    return Image.fromarray(ret)
 
 
 class Pattern(Layer):
     """
     This is a layer for creating repeating
 
+    The children are composited together into a single cell,
+    which is then repeated to fill the layer.
+    (That is this layer's own image, so the rest, such as cropping
+    and rotation, is the same as for any other layer.)
+
     TODO: this could/should overlap with gradients, as in the CSS magic:
         http://lea.verou.me/2010/12/checkered-stripes-other-background-patterns-with-css3-gradients/
         http://lea.verou.me/2011/04/css3-patterns-gallery-and-a-new-pattern/
     """
 
+    # the children make up the cell, rather than going on top of the pattern
+    compositesChildren=False
+
     def __init__(self,parent:Layer,xml:str):
         Layer.__init__(self,parent,xml)
 
     @property
-    def mortarThickness(self):
+    def mortarThickness(self)->int:
         """
         how thick the mortar is
         """
-        return self._getProperty('mortarThickness','0')
+        mortar=self._getProperty('mortarThickness','0')
+        try:
+            return int(float(mortar))
+        except ValueError:
+            raise SmartimageError(self,'Unable to convert mortarThickness="%s" to a number'%mortar)
+
+    @property
+    def mortarColor(self)->str:
+        """
+        the color of the mortar [default="transparent"]
+        """
+        return self._getProperty('mortarColor','transparent')
 
     @property
     def repeat(self)->Tuple[str,str]:
@@ -36,7 +204,7 @@ class Pattern(Layer):
             "top","left","right", or "bottom" - display once at that particular edge
             "maintainAspect" - keep the same aspect ratio based on whatever the opposite value is
             "maximize"-a lone value, maximizes pattern just large enough that all screen is covered
-            "minimize"- a lone value, makes the
+            "minimize"- a lone value, makes the pattern just small enough that all of it fits
             "bricks" - tessalate in a brick wall pattern
             "isometric" - tessalate on an isometric triangle grid
                 (for instance, like a honeycomb pattern)
@@ -49,9 +217,58 @@ class Pattern(Layer):
             repeat.append(repeat[0])
         return repeat
 
+    @property
+    def size(self)->Tuple[int,int]:
+        """
+        the (w,h) to fill with the pattern
+        """
+        return (int(self.w),int(self.h))
+
+    def cellImage(self,renderContext:Union[RenderingContext,None]=None)->Union[PilPlusImage,None]:
+        """
+        the children composited together, which is what gets repeated
+        """
+        if renderContext is None:
+            renderContext=RenderingContext()
+        canvas=Canvas()
+        for childLayer in self.children:
+            childImage=childLayer.renderImage(renderContext)
+            childAttributes=childLayer.attributes
+            canvas.composite(childImage,childAttributes.opacity,
+                childAttributes.blendMode,childLayer.mask,childAttributes.location)
+        return canvas.image
+
+    def _pattern(self,renderContext:Union[RenderingContext,None],
+        box:Union[Tuple[int,int,int,int],None]=None)->Union[PilPlusImage,None]:
+        cell=self.cellImage(renderContext)
+        if cell is None or cell.width<1 or cell.height<1:
+            return None
+        try:
+            mortarColor=edgeColor(self.mortarColor,'rgba')
+        except ValueError:
+            raise SmartimageError(self,'Unknown mortarColor "%s"'%self.mortarColor)
+        return tilePattern(cell,self.size,self.repeat,self.mortarThickness,mortarColor,box)
+
     @property
     def image(self)->Union[PilPlusImage,None]:
         """
         final image generated from the given pattern
         """
-        raise NotImplementedError()
+        return self._pattern(None)
+
+    def _baseImage(self,renderContext:RenderingContext)->Union[PilPlusImage,None]:
+        """
+        render the cell once and repeat it
+        """
+        return self._pattern(renderContext)
+
+    def _baseImageRegion(self,renderContext:RenderingContext,box:Tuple[int,int,int,int]
+        )->Tuple[Union[PilPlusImage,None],Union[Tuple[int,int],None]]:
+        """
+        only create the part of the pattern that is needed
+        """
+        left,top=max(int(box[0]),0),max(int(box[1]),0)
+        image=self._pattern(renderContext,(left,top,int(box[2]),int(box[3])))
+        if image is None:
+            return None,None
+        return image,(left,top)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Pointwise color adjustments, fused together
+
+A pointwise adjustment changes each pixel based only upon that pixel
+(and perhaps a statistic of the whole image), so a whole stack of them,
+such as nested brightness/contrast/invert modifiers, can be folded into
+a single lookup table (or color matrix) and run over the image once,
+rather than copying and re-processing the image for every step.
+
+The adjustments match PIL.ImageEnhance and PIL.ImageOps, give or take
+a few levels, since the fused version only rounds off between passes
+rather than after every step.
+"""
+from typing import *
+import numpy as np
+from PIL import Image
+
+
+# the modifier types that are pointwise
+POINTWISE_OPERATIONS=('brightness','contrast','saturation','invert','posterize','solarize','opacity')
+
+# what the color space's luma is made of
+LUMA=np.array([0.299,0.587,0.114])
+
+
+def saturationMatrix(amount:float)->np.ndarray:
+    """
+    a color matrix that blends between grayscale (0.0) and the original (1.0)
+    """
+    return amount*np.identity(3)+(1.0-amount)*np.tile(LUMA,(3,1))
+
+
+class PointwiseChain:
+    """
+    A series of pointwise adjustments to apply to an image in one go
+
+    Usage:
+        chain=PointwiseChain()
+        chain.add('contrast',1.2)
+        chain.add('invert')
+        image=chain.apply(image)
+    """
+
+    def __init__(self):
+        self.operations:List[Tuple[str,Any]]=[]
+
+    def add(self,operation:str,value:Any=None)->NoReturn:
+        """
+        add an adjustment to the end of the chain
+
+        :param operation: one of
+            brightness - multiply colors by value (0.0=black, 1.0=unchanged)
+            contrast - stretch colors away from the average gray by value
+                (0.0=solid gray, 1.0=unchanged)
+            saturation - blend from grayscale (0.0) to unchanged (1.0) and beyond
+            invert - negative image
+            posterize - keep only value bits of each color
+            solarize - invert colors at or above the threshold value
+            opacity - multiply alpha by value
+        """
+        if operation not in POINTWISE_OPERATIONS:
+            raise ValueError('Unknown pointwise operation "%s"'%operation)
+        self.operations.append((operation,value))
+
+    def __len__(self)->int:
+        return len(self.operations)
+
+    def apply(self,image:Image.Image)->Image.Image:
+        """
+        apply the whole chain to an image
+
+        Runs of lookup table operations (everything but saturation)
+        are done as a single pass, as are runs of color matrix operations
+        (saturation and brightness).
+
+        :return: a new image
+        """
+        alphaScale=1.0
+        for operation,value in self.operations:
+            if operation=='opacity':
+                alphaScale*=value
+        if image.mode not in ('L','LA','RGB','RGBA'):
+            image=image.convert('RGBA')
+        if alphaScale<1.0 and image.mode in ('L','RGB'):
+            image=image.convert(image.mode+'A')
+        colorBands=len(image.getbands())-(1 if image.mode.endswith('A') else 0)
+        lut=None # [band][value] for the pending table operations
+        matrix=None # pending color matrix
+        for operation,value in self.operations:
+            if operation=='opacity':
+                continue # only affects alpha, so it is done at the end
+            if operation=='saturation':
+                if colorBands<3:
+                    continue
+                if lut is not None:
+                    image=self._applyTable(image,lut,1.0)
+                    lut=None
+                m=saturationMatrix(value)
+                matrix=m if matrix is None else m@matrix
+                continue
+            if matrix is not None:
+                if operation=='brightness':
+                    matrix=value*matrix
+                    continue
+                image=self._applyMatrix(image,matrix,1.0)
+                matrix=None
+            if lut is None:
+                lut=np.tile(np.arange(256,dtype=np.float64),(colorBands,1))
+            lut=self._adjustTable(operation,value,lut,image)
+        if matrix is not None:
+            return self._applyMatrix(image,matrix,alphaScale)
+        if lut is not None or alphaScale!=1.0:
+            if lut is None:
+                lut=np.tile(np.arange(256,dtype=np.float64),(colorBands,1))
+            return self._applyTable(image,lut,alphaScale)
+        return image.copy()
+
+    @staticmethod
+    def _adjustTable(operation:str,value:Any,lut:np.ndarray,image:Image.Image)->np.ndarray:
+        """
+        add an operation onto the end of a lookup table
+
+        (each step is clipped to 0..255 and truncated just like PIL)
+        """
+        if operation=='brightness':
+            lut=lut*value
+        elif operation=='contrast':
+            # the average gray of the image, as it would be at this point
+            histogram=np.asarray(image.histogram(),dtype=np.float64).reshape(-1,256)
+            count=histogram[0].sum()
+            means=(histogram[0:lut.shape[0]]*lut).sum(axis=1)/max(count,1)
+            if lut.shape[0]>=3:
+                mean=float((means[0:3]*LUMA).sum())
+            else:
+                mean=float(means[0])
+            mean=int(mean+0.5)
+            lut=mean+(lut-mean)*value
+        elif operation=='invert':
+            lut=255-lut
+        elif operation=='posterize':
+            lut=np.bitwise_and(lut.astype(np.int32),~(2**(8-int(value))-1))
+        elif operation=='solarize':
+            lut=np.where(lut>=value,255-lut,lut)
+        return np.trunc(np.clip(lut,0,255))
+
+    @staticmethod
+    def _applyTable(image:Image.Image,lut:np.ndarray,alphaScale:float)->Image.Image:
+        """
+        run every band of the image through its lookup table
+        """
+        table=[int(v) for v in lut.flatten()]
+        if image.mode.endswith('A'):
+            table.extend(int(v*alphaScale) for v in range(256))
+        return image.point(table)
+
+    @staticmethod
+    def _applyMatrix(image:Image.Image,matrix:np.ndarray,alphaScale:float)->Image.Image:
+        """
+        run the color of every pixel through a color matrix
+        """
+        pixels=np.asarray(image)
+        color=pixels[...,0:3].astype(np.float32)@matrix.T.astype(np.float32)
+        ret=np.empty(pixels.shape,dtype=np.uint8)
+        ret[...,0:3]=np.clip(color,0,255)
+        if pixels.shape[2]>3:
+            ret[...,3]=pixels[...,3]*alphaScale if alphaScale!=1.0 else pixels[...,3]
+        return Image.fromarray(ret)
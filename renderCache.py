@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+A content-addressed cache of rendered layer images
+"""
+from typing import *
+import os
+import struct
+import mmap
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import PIL
+from PIL import Image
+
+
+def hashParts(parts:Iterable[Any])->str:
+    """
+    create a stable hash from a list of simple values
+    (strings, numbers, tuples, and nested lists of the same)
+    """
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def hashStream(f:BinaryIO,chunkSize:int=1024*1024)->str:
+    """
+    create a stable hash of the contents of a file-like object
+    """
+    h=hashlib.sha1()
+    while True:
+        data=f.read(chunkSize)
+        if not data:
+            break
+        if isinstance(data,str):
+            data=data.encode('utf-8')
+        h.update(data)
+    return h.hexdigest()
+
+
+def imageBytes(image:Union[PIL.Image.Image,None])->int:
+    """
+    roughly how much memory an image takes up
+    """
+    if image is None:
+        return 0
+    if image.mode in ('I','F'):
+        bytesPerBand=4
+    elif image.mode.startswith('I;16'):
+        bytesPerBand=2
+    else:
+        bytesPerBand=1
+    return image.width*image.height*len(image.getbands())*bytesPerBand
+
+
+class DiskRenderCache:
+    """
+    A directory of rendered layer images that can be shared by
+    several processes (for instance, a farm of render workers).
+
+    Each image is stored as a small header followed by its raw pixels,
+    so reading it back is simply a memory map, not a decode.
+    Images smaller than minBytes are not worth a file, so are not kept.
+
+    A running total of the size of the directory is kept, so the
+    directory is only listed when it grows past maxBytes, at which point
+    the least recently used images are thrown away until it is back
+    down to 90% of maxBytes (so that it does not have to be listed again
+    with the very next image).
+    """
+
+    # bump this whenever rendering changes such that old results are wrong
+    MAGIC=b'SIMGRC01'
+    HEADER=struct.Struct('<8s8sII') # magic, mode, width, height
+
+    def __init__(self,directory:str,maxBytes:int=1024*1024*1024,minBytes:int=64*1024):
+        self.directory=os.path.abspath(directory)
+        self.maxBytes=maxBytes
+        self.minBytes=minBytes
+        self._totalBytes=None
+        self._lock=threading.Lock()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _filename(self,key:str)->str:
+        return os.path.join(self.directory,key[0:2],key+'.raw')
+
+    def __contains__(self,key:str)->bool:
+        return self.lookup(key)[0]
+
+    @property
+    def totalBytes(self)->int:
+        """
+        how big the cache directory is
+        (only actually measured the first time, then kept up to date)
+        """
+        with self._lock:
+            if self._totalBytes is None:
+                self._totalBytes=sum([f[1] for f in self._files()])
+            return self._totalBytes
+
+    def lookup(self,key:str)->Tuple[bool,Union[PIL.Image.Image,None]]:
+        """
+        look up a cached image (memory mapped, so it is read-only)
+
+        :return: (found,image) since a layer can legitimately render to None
+        """
+        filename=self._filename(key)
+        try:
+            f=open(filename,'rb')
+        except IOError:
+            return False,None
+        with f:
+            header=f.read(self.HEADER.size)
+            if len(header)<self.HEADER.size:
+                return False,None
+            magic,mode,width,height=self.HEADER.unpack(header)
+            if magic!=self.MAGIC:
+                return False,None
+            if width==0 or height==0:
+                mapped=None
+            else:
+                mapped=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        try:
+            os.utime(filename) # remember that it was used recently
+        except OSError:
+            pass
+        if mapped is None:
+            return True,None
+        mode=mode.rstrip(b'\0').decode('ascii')
+        data=memoryview(mapped)[self.HEADER.size:]
+        return True,Image.frombuffer(mode,(width,height),data,'raw',mode,0,1)
+
+    def put(self,key:str,image:Union[PIL.Image.Image,None])->NoReturn:
+        """
+        add a rendered image to the cache
+        (unless it is smaller than minBytes)
+        """
+        if imageBytes(image)<self.minBytes:
+            return
+        filename=self._filename(key)
+        dirname=os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname,exist_ok=True)
+        if image.mode=='P': # raw pixels would lose the palette
+            image=image.convert('RGBA')
+        header=self.HEADER.pack(self.MAGIC,image.mode.encode('ascii'),image.width,image.height)
+        data=image.tobytes()
+        totalBytes=self.totalBytes
+        try:
+            replaced=os.stat(filename).st_size
+        except OSError:
+            replaced=0
+        # write to a temp file first, so other processes never see half an image
+        fd,tmpName=tempfile.mkstemp(dir=dirname,suffix='.tmp')
+        with os.fdopen(fd,'wb') as f:
+            f.write(header)
+            f.write(data)
+        os.replace(tmpName,filename)
+        with self._lock:
+            self._totalBytes+=len(header)+len(data)-replaced
+        self.evict()
+
+    def _files(self)->List[Tuple[float,int,str]]:
+        """
+        list all the cached files as (lastUsed,size,filename)
+        """
+        ret=[]
+        for dirname,_,filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith('.raw'):
+                    continue
+                filename=os.path.join(dirname,filename)
+                try:
+                    stat=os.stat(filename)
+                except OSError: # somebody else got rid of it
+                    continue
+                ret.append((stat.st_mtime,stat.st_size,filename))
+        return ret
+
+    def evict(self)->NoReturn:
+        """
+        if the cache has grown past maxBytes, throw away the least
+        recently used images until it is down to 90% of maxBytes
+        """
+        if self.totalBytes<=self.maxBytes:
+            return
+        with self._lock:
+            # (other processes share the directory, so re-measure it)
+            files=self._files()
+            self._totalBytes=sum([f[1] for f in files])
+            if self._totalBytes<=self.maxBytes:
+                return
+            lowWater=self.maxBytes*0.9
+            files.sort()
+            for _,size,filename in files:
+                try:
+                    os.remove(filename)
+                except OSError: # in use or already gone
+                    continue
+                self._totalBytes-=size
+                if self._totalBytes<=lowWater:
+                    break
+
+    def clear(self)->NoReturn:
+        """
+        throw away everything in the cache
+        """
+        with self._lock:
+            for _,_,filename in self._files():
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+            self._totalBytes=0
+
+
+class RenderCache:
+    """
+    A cache of rendered layer images, keyed on a stable hash of
+    everything that went into the render (see Layer.renderKey)
+
+    Since the keys are content-addressed, a single cache can safely be
+    shared by every SmartImage in the process, which means identical
+    subtrees are only rendered once, even across separate loads.
+
+    Memory use is limited to maxBytes, throwing away the least recently
+    used images when it goes over.  (An image bigger than maxBytes
+    all by itself is simply not cached.)
+
+    Optionally, it can be backed by a DiskRenderCache to share
+    results with other processes.
+
+    It is safe to use from several rendering threads at once.
+
+    WARNING: Do not modify a cached image without doing a .copy() first!
+    """
+
+    def __init__(self,maxBytes:int=512*1024*1024,diskCache:Union[DiskRenderCache,None]=None):
+        self._images:Dict[str,Union[PIL.Image.Image,None]]=OrderedDict()
+        self.maxBytes=maxBytes
+        self.diskCache=diskCache
+        self.numBytes=0
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.rejections=0 # images too big to cache at all
+        self._lock=threading.RLock()
+
+    @property
+    def stats(self)->Dict[str,int]:
+        """
+        counters for tuning the cache
+        """
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions,
+            'rejections':self.rejections,
+            'images':len(self._images),
+            'bytes':self.numBytes,
+            'maxBytes':self.maxBytes}
+
+    def __contains__(self,key:str)->bool:
+        return self.lookup(key)[0]
+
+    def __len__(self)->int:
+        return len(self._images)
+
+    def get(self,key:str)->Union[PIL.Image.Image,None]:
+        """
+        get a cached image
+
+        NOTE: a layer can legitimately render to None, so use
+            lookup() to tell a miss from a cached None
+        """
+        return self.lookup(key)[1]
+
+    def lookup(self,key:str)->Tuple[bool,Union[PIL.Image.Image,None]]:
+        """
+        look up a cached image
+
+        :return: (found,image) since a layer can legitimately render to None
+        """
+        with self._lock:
+            if key in self._images:
+                self.hits+=1
+                self._images.move_to_end(key)
+                return True,self._images[key]
+        if self.diskCache is not None:
+            found,image=self.diskCache.lookup(key)
+            if found:
+                if image is not None:
+                    image.immutable=True # mark this image so that compositor will not alter it
+                with self._lock:
+                    self.hits+=1
+                    self._add(key,image)
+                return True,image
+        with self._lock:
+            self.misses+=1
+        return False,None
+
+    def put(self,key:str,image:Union[PIL.Image.Image,None])->NoReturn:
+        """
+        add a rendered image to the cache
+        """
+        with self._lock:
+            self._add(key,image)
+        if self.diskCache is not None:
+            self.diskCache.put(key,image)
+
+    def _add(self,key:str,image:Union[PIL.Image.Image,None])->NoReturn:
+        """
+        add an image to memory, evicting old ones as necessary
+
+        NOTE: call with self._lock held
+        """
+        if key in self._images:
+            self.numBytes-=imageBytes(self._images.pop(key))
+        numBytes=imageBytes(image)
+        if numBytes>self.maxBytes:
+            # it would push out everything else and then itself
+            self.rejections+=1
+            return
+        self._images[key]=image
+        self.numBytes+=numBytes
+        while self.numBytes>self.maxBytes and self._images:
+            _,image=self._images.popitem(last=False)
+            self.numBytes-=imageBytes(image)
+            self.evictions+=1
+
+    def clear(self)->NoReturn:
+        """
+        throw away everything in the cache
+        """
+        with self._lock:
+            self._images=OrderedDict()
+            self.numBytes=0
+
+
+# the cache all documents use unless told otherwise
+# (set the SMARTIMAGE_CACHE_DIR environment variable to back it with a disk cache)
+SHARED_RENDER_CACHE=RenderCache()
+if os.environ.get('SMARTIMAGE_CACHE_DIR'):
+    SHARED_RENDER_CACHE.diskCache=DiskRenderCache(os.environ['SMARTIMAGE_CACHE_DIR'])
@@ -3,22 +3,95 @@
 Used to track an image render
 """
 from typing import *
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import PIL
+from PIL import Image
 from imageTools import *
 from smartimage.errors import SmartimageError
+from smartimage.renderCache import hashParts
+from smartimage.compositing import Canvas,canvasSize,blendFunction,clipToBox
+from smartimage.damage import *
+from smartimage.stripWriter import stripWriter
+
+
+class WholeImages:
+    """
+    Whole renders of layers that cannot render only part of themselves
+    (see RenderingContext.cropRegion), kept for the length of a tiled render
+    so that each is only rendered once, no matter how many tiles need it
+    """
+
+    def __init__(self):
+        self._images:Dict[Hashable,Any]={}
+        self._locks:Dict[Hashable,threading.Lock]={}
+        self._lock=threading.Lock()
+
+    def get(self,key:Hashable,create:Callable[[],Any])->Any:
+        """
+        get something, only creating it the first time it is asked for
+        (another thread asking at the same time waits for that one)
+        """
+        with self._lock:
+            if key in self._images:
+                return self._images[key]
+            lock=self._locks.setdefault(key,threading.Lock())
+        with lock:
+            with self._lock:
+                if key in self._images:
+                    return self._images[key]
+            value=create()
+            with self._lock:
+                self._images[key]=value
+        return value
 
 
 class RenderingContext:
     """
     Used to keep track of atributes while rendering an image from layers
     and also a box to keep utility functions in.
+
+    :param workers: how many threads to render sibling layers on
+        (the result is identical no matter how many are used)
     """
-    def __init__(self):
+    def __init__(self,workers:int=1):
         self.desired:Bounds=Bounds(0,0,0,0)
         self.cur_rot:float=0
         self.cur:Bounds=Bounds(0,0,0,0)
         self.cur_image:Union[PIL.Image.Image,None]=None
         self.visitedLayers:Set['Layer']=set()
+        self._keysInProgress:Set['Layer']=set()
+        self.workers:int=max(1,workers)
+        self._executor:Union[ThreadPoolExecutor,None]=None
+        self._inWorker:bool=False
+        # whether renders go into the render cache (turned off for one-off
+        # renders that would only crowd out everything else, see Particles)
+        self.cacheRenders:bool=True
+        # {layer:rect} what part of renderImage(layer) changed since last time
+        self.compositeDamage:Dict['Layer',Union[Rect,Tuple,None]]={}
+        # only while rendering tiles (see renderTiled)
+        self._wholeImages:Union[WholeImages,None]=None
+
+    def fork(self)->'RenderingContext':
+        """
+        create a context for rendering a child layer on a worker thread
+        """
+        ret=RenderingContext()
+        ret.visitedLayers=set(self.visitedLayers)
+        ret.cacheRenders=self.cacheRenders
+        ret._wholeImages=self._wholeImages
+        ret._inWorker=True
+        return ret
+
+    def close(self)->NoReturn:
+        """
+        release the worker threads (if any)
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor=None
 
     def log(self,*vals)->NoReturn:
         """
@@ -26,6 +99,57 @@ class RenderingContext:
         """
         print((' '*len(self.visitedLayers))+(' '.join([str(v) for v in vals])))
 
+    def renderKey(self,layer:'Layer')->Union[str,None]:
+        """
+        get the render cache key for a layer
+
+        The key is remembered by the layer until something it depends upon
+        changes (see DependencyGraph), so unchanged layers are not re-hashed.
+
+        returns None if the layer cannot be cached
+        """
+        if layer._renderKeyValid:
+            return layer._renderKey
+        if layer in self._keysInProgress:
+            # a layer that (indirectly) depends upon itself cannot be cached
+            return None
+        self._keysInProgress.add(layer)
+        try:
+            parts=layer._renderKeyParts(self)
+        finally:
+            self._keysInProgress.discard(layer)
+        key=None
+        if parts is not None:
+            key=hashParts(parts)
+        layer._renderKey=key
+        layer._renderKeyValid=True
+        return key
+
+    def compile(self,layer:'Layer')->NoReturn:
+        """
+        resolve everything needed to render a layer up front, namely the
+        attributes and render keys of it and all of its children
+
+        Anything already resolved, and not changed since, is left alone.
+
+        NOTE: this also means that worker threads only ever read these
+            (layers that change things while they render, such as Particles,
+            are never rendered on worker threads, see _renderChildren)
+        """
+        layer.root.dependencies # make sure the dependency graph exists
+        self._compileAttributes(layer)
+        if layer.root.cacheRenderedLayers:
+            self.renderKey(layer)
+
+    def _compileAttributes(self,layer:'Layer')->NoReturn:
+        """
+        resolve the attributes of a layer and all of its children
+        (children first, since "auto" sizes depend upon the children)
+        """
+        for child in layer.children:
+            self._compileAttributes(child)
+        layer.attributes
+
     def renderImage(self,layer:'Layer')->Union[PIL.Image.Image,None]:
         """
         render an image from the layer image and all of its children
@@ -40,26 +164,43 @@ class RenderingContext:
         self.visitedLayers.add(layer.elementId)
         # push a new variable context
         # do we need to do anything?
-        opacity=layer.opacity
-        if opacity<=0.0 or not layer.visible:
+        attributes=layer.attributes
+        if attributes.opacity<=0.0 or not attributes.visible:
             self.log('skipping',layer.name)
         else:
             self.log('creating new %s layer named "%s"'%(layer.__class__.__name__,layer.name))
-            image=layer.image # NOTE: base image can be None
-            for childLayer in layer.children:
-                childImage=childLayer.renderImage(self)
-                image=composite(childImage,image,
-                    opacity=childLayer.opacity,blendMode=childLayer.blendMode,mask=childLayer.mask,
-                    position=childLayer.location,resize=True)
-                self.log('adding child layer "%s" at %s'%(childLayer.name,childLayer.location))
-            if layer.cropping is not None:
-                image=image.crop(layer.cropping)
-            if layer.rotation%360!=0:
+            image=layer._baseImage(self) # NOTE: base image can be None
+            children=[]
+            if layer.compositesChildren:
+                children=[c for c in self._renderChildren(layer) if c[1] is not None]
+            damage=None
+            if children:
+                for childLayer,_,_ in children:
+                    if blendFunction(childLayer.attributes.blendMode) is None:
+                        raise SmartimageError(childLayer,'Unknown blend mode "%s"'%childLayer.attributes.blendMode)
+                # size the canvas once, up front, then stack the children onto it
+                size=canvasSize(image,[(c[1],c[0].attributes.location) for c in children])
+                if layer.root.trackDamage:
+                    image,damage=self._compositeDamaged(layer,image,children,size)
+                else:
+                    image=self._composite(image,children,size).image
+            if attributes.cropping is not None:
+                if damage:
+                    damage=clipRect(offsetRect(damage,
+                        -attributes.cropping[0],-attributes.cropping[1]),
+                        (attributes.cropping[2]-attributes.cropping[0],
+                        attributes.cropping[3]-attributes.cropping[1])) or ()
+                image=image.crop(attributes.cropping)
+            if attributes.rotation%360!=0:
                 self.log('rotating',layer.name)
+                size=image.size
                 bounds=Bounds(0,0,image.width,image.height)
-                bounds.rotateFit(layer.rotation)
+                bounds.rotateFit(attributes.rotation)
                 image=extendImageCanvas(image,bounds)
-                image=image.rotate(layer.rotation)
+                image=image.rotate(attributes.rotation)
+                if damage:
+                    damage=clipRect(rotateRect(damage,size,image.size,attributes.rotation),image.size) or ()
+            self.compositeDamage[layer]=damage
             # logging
             if image is None:
                 self.log('info','for "%s":'%layer.name)
@@ -70,5 +211,376 @@ class RenderingContext:
                 self.log('info','   bounds=(0,0,%d,%d)'%(image.width,image.height))
         self.log('finished',layer.name)
         # pop off tracking info for this layer
-        self.visitedLayers.pop()
+        self.visitedLayers.discard(layer.elementId)
         return image
+
+    def _composite(self,image:Union[PIL.Image.Image,None],children:List[Tuple['Layer',
+        PIL.Image.Image,Union[PIL.Image.Image,None]]],size:Tuple[int,int])->Canvas:
+        """
+        stack all the children onto the base image
+        """
+        canvas=Canvas(image,size)
+        for childLayer,childImage,mask in children:
+            childAttributes=childLayer.attributes
+            canvas.composite(childImage,childAttributes.opacity,
+                childAttributes.blendMode,mask,childAttributes.location)
+            self.log('adding child layer "%s" at %s'%(childLayer.name,childAttributes.location))
+        return canvas
+
+    def _compositeDamaged(self,layer:'Layer',image:Union[PIL.Image.Image,None],
+        children:List[Tuple['Layer',PIL.Image.Image,Union[PIL.Image.Image,None]]],
+        size:Tuple[int,int])->Tuple[PIL.Image.Image,Union[Rect,Tuple,None]]:
+        """
+        stack all the children onto the base image, but only re-do the part
+        that changed since the last time this layer was composited
+
+        :return: (image,damagedRect) where damagedRect is () for nothing
+            or None for everything
+        """
+        records=[]
+        for childLayer,childImage,mask in children:
+            childAttributes=childLayer.attributes
+            x,y=childAttributes.location
+            records.append(ChildComposite(childLayer,childImage,mask,int(x),int(y),
+                childAttributes.opacity,childAttributes.blendMode))
+        state=layer._compositeState
+        rect=None
+        if state is not None and state.image is not None and state.image.mode==state.mode:
+            rect=state.damage(image,records,size)
+        if rect==():
+            self.log('unchanged composite',layer.name)
+            ret=state.image
+        elif rect is None:
+            canvas=self._composite(image,children,size)
+            ret=canvas.image
+        else:
+            self.log('re-compositing',layer.name,'within',rect)
+            ret=self._recomposite(state,image,records,rect)
+            if ret is None:
+                rect=None
+                ret=self._composite(image,children,size).image
+        layer._compositeState=CompositeState(image,records,size,ret.mode,ret)
+        return ret,rect
+
+    def _recomposite(self,state:CompositeState,image:Union[PIL.Image.Image,None],
+        records:List[ChildComposite],rect:Rect)->Union[PIL.Image.Image,None]:
+        """
+        re-do only one rectangle of a previous composite
+
+        :return: the new composite, or None if it can't be patched
+            (because it would come out in a different mode)
+        """
+        left,top,right,bottom=rect
+        # since the rect is within the canvas, the base always starts at its top left
+        patch,_=clipToBox(image,(0,0),rect)
+        canvas=Canvas(patch,(right-left,bottom-top),mode=state.mode)
+        for record in records:
+            patch,position=clipToBox(record.image,(record.x,record.y),rect)
+            if patch is None:
+                continue
+            mask=record.mask
+            if mask is not None:
+                # the same way Canvas.composite() would have stretched it
+                if mask.mode!='L':
+                    mask=mask.convert('L')
+                if mask.size!=record.image.size:
+                    mask=mask.resize(record.image.size,Image.BILINEAR)
+                mask=mask.crop((position[0]-record.x,position[1]-record.y,
+                    position[0]-record.x+patch.width,position[1]-record.y+patch.height))
+            canvas.composite(patch,record.opacity,record.blendMode,mask,
+                (position[0]-left,position[1]-top))
+        patch=canvas.image
+        if patch.mode!=state.mode:
+            # what changed needs a wider mode, so the whole thing has to be re-done
+            return None
+        ret=state.image.copy()
+        ret.paste(patch,(left,top))
+        return ret
+
+    def recordDamage(self,layer:'Layer',image:Union[PIL.Image.Image,None])->NoReturn:
+        """
+        remember what part of a layer changed since it was last rendered
+        (see damage.py) so that its parent only needs to re-composite that
+        """
+        rect=self.compositeDamage.pop(layer,None)
+        previous=None
+        if layer._damage is not None:
+            previous=layer._damage.current
+        if image is previous:
+            rect=()
+        else:
+            rect=layer._damageAfterRender(rect)
+        layer._damage=Damage(previous,image,rect)
+
+    def _renderChild(self,childLayer:'Layer')->Tuple['Layer',Union[PIL.Image.Image,None],
+        Union[PIL.Image.Image,None]]:
+        """
+        render a child layer, and its mask, ready for compositing
+
+        :return: (childLayer,childImage,mask)
+        """
+        return childLayer,childLayer.renderImage(self),childLayer.mask
+
+    def _renderChildren(self,layer:'Layer')->List[Tuple['Layer',Union[PIL.Image.Image,None],
+        Union[PIL.Image.Image,None]]]:
+        """
+        render all the children of a layer, ready for compositing
+
+        If we have workers, the children are rendered at the same time,
+        but the results always come back in compositing order.
+
+        NOTE: only the first level that has several children to render is
+            split across workers.  Each worker then renders its subtree on its own,
+            which keeps workers from tying each other up waiting on one another.
+
+        NOTE: children that change shared state while rendering (see
+            Layer.threadSafe) are rendered first, on this thread, before
+            any workers start, and then everything they may have invalidated
+            is resolved again, so that the workers still only read it.
+
+        :return: [(childLayer,childImage,mask)]
+        """
+        children=[c for c in layer.children if c.attributes.visible and c.attributes.opacity>0.0]
+        if self.workers<2 or self._inWorker or len(children)<2:
+            return [self._renderChild(childLayer) for childLayer in layer.children]
+        results={}
+        for childLayer in layer.children:
+            if not childLayer.threadSafe:
+                results[childLayer]=self._renderChild(childLayer)
+        if results:
+            self.compile(layer.root)
+        remaining=[c for c in children if c not in results]
+        if len(remaining)>=2:
+            if self._executor is None:
+                self._executor=ThreadPoolExecutor(self.workers)
+            self.log('rendering %d children of "%s" on %d workers'%(len(remaining),layer.name,self.workers))
+            for childLayer in layer.children:
+                if childLayer in results:
+                    continue
+                results[childLayer]=self._executor.submit(self.fork()._renderChild,childLayer)
+        ret=[]
+        for childLayer in layer.children:
+            result=results.get(childLayer)
+            if result is None:
+                result=self._renderChild(childLayer)
+            elif not isinstance(result,tuple):
+                result=result.result()
+            ret.append(result)
+        return ret
+
+    def cropRegion(self,layer:'Layer',box:Tuple[int,int,int,int])->Tuple[
+        Union[PIL.Image.Image,None],Union[Tuple[int,int],None]]:
+        """
+        render part of a layer the simple way: render all of it and cut out the box
+
+        This is for layers that cannot render only part of themselves.
+        (During renderTiled() the whole image is kept until all the tiles
+        are done, rather than counting on it staying in the render cache.)
+
+        :param box: (left,top,right,bottom) in the layer's coordinates
+        :return: (image,(x,y)) or (None,None)
+        """
+        return clipToBox(self._wholeImage(layer),(0,0),box)
+
+    def keep(self,key:Hashable,create:Callable[[],Any])->Any:
+        """
+        during renderTiled(), create something only once and keep it until
+        all the tiles are done (otherwise, simply create it)
+        """
+        if self._wholeImages is None:
+            return create()
+        return self._wholeImages.get(key,create)
+
+    def _wholeImage(self,layer:'Layer')->Union[PIL.Image.Image,None]:
+        """
+        render all of a layer (only once per renderTiled())
+        """
+        return self.keep(layer,lambda:layer.renderImage(self))
+
+    def _regionMask(self,layer:'Layer',box:Tuple[int,int,int,int]
+        )->Union[PIL.Image.Image,None]:
+        """
+        the part of a layer's mask that goes with part of its image
+
+        The mask is stretched over the whole image first, the same way
+        Canvas.composite() would have, and then the box cut out of it.
+
+        :param box: (left,top,right,bottom) in the layer's coordinates
+        """
+        def stretched()->Union[PIL.Image.Image,None]:
+            mask=layer.mask
+            if mask is None:
+                return None
+            if mask.mode!='L':
+                mask=mask.convert('L')
+            if layer.attributes.rotation%360!=0 or layer.attributes.cropping is not None:
+                # the whole image was rendered anyway, so that is its real size
+                image=self._wholeImage(layer)
+                size=self.extent(layer) if image is None else image.size
+            else:
+                size=self.extent(layer)
+            if mask.size!=size:
+                mask=mask.resize(size,Image.BILINEAR)
+            return mask
+        mask=self.keep((layer,'mask'),stretched)
+        if mask is None:
+            return None
+        return mask.crop(box)
+
+    def renderRegion(self,layer:'Layer',box:Tuple[int,int,int,int])->Tuple[
+        Union[PIL.Image.Image,None],Union[Tuple[int,int],None]]:
+        """
+        render only part of a layer's image and children
+        (the tiled equivalent of renderImage)
+
+        Only the children that overlap the box are rendered, and each only
+        for the part of it that overlaps.
+
+        :param box: (left,top,right,bottom) in the layer's coordinates
+        :return: (image,(x,y)) of only the part the layer actually covers,
+            or (None,None)
+        """
+        attributes=layer.attributes
+        if attributes.opacity<=0.0 or not attributes.visible:
+            return None,None
+        if attributes.rotation%360!=0 or attributes.cropping is not None:
+            # everything moves around, so do it the simple way
+            return self.cropRegion(layer,box)
+        # nothing is ever above or left of a layer's origin (see Canvas)
+        left,top=max(0,int(box[0])),max(0,int(box[1]))
+        right,bottom=int(box[2]),int(box[3])
+        if right<=left or bottom<=top:
+            return None,None
+        box=(left,top,right,bottom)
+        # loop prevention
+        if layer.elementId in self.visitedLayers:
+            info=(layer.elementId,layer.name)
+            raise SmartimageError(layer,'Link loop with layer %s "%s"'%info)
+        self.visitedLayers.add(layer.elementId)
+        canvas=Canvas(None,(right-left,bottom-top))
+        extent=[left,top] # how far right/down anything went
+        image,position=layer._baseImageRegion(self,box)
+        if image is not None:
+            canvas.composite(image,position=(position[0]-left,position[1]-top))
+            extent=[max(extent[0],position[0]+image.width),max(extent[1],position[1]+image.height)]
+        for childLayer in (layer.children if layer.compositesChildren else ()):
+            childAttributes=childLayer.attributes
+            x,y=int(childAttributes.x),int(childAttributes.y)
+            childBox=(left-x,top-y,right-x,bottom-y)
+            image,position=childLayer._renderRegion(self,childBox)
+            if image is None:
+                continue
+            if blendFunction(childAttributes.blendMode) is None:
+                raise SmartimageError(childLayer,'Unknown blend mode "%s"'%childAttributes.blendMode)
+            mask=self._regionMask(childLayer,
+                (position[0],position[1],position[0]+image.width,position[1]+image.height))
+            x+=position[0]
+            y+=position[1]
+            canvas.composite(image,childAttributes.opacity,childAttributes.blendMode,
+                mask,(x-left,y-top))
+            extent=[max(extent[0],x+image.width),max(extent[1],y+image.height)]
+        self.visitedLayers.discard(layer.elementId)
+        image=canvas.image
+        if image is None:
+            return None,None
+        return clipToBox(image,(left,top),(left,top,extent[0],extent[1]))
+
+    def extent(self,layer:'Layer')->Tuple[int,int]:
+        """
+        the (w,h) size of a layer's image, figured out
+        without actually rendering it
+        """
+        attributes=layer.attributes
+        w,h=attributes.w,attributes.h
+        for childLayer in (layer.children if layer.compositesChildren else ()):
+            childAttributes=childLayer.attributes
+            w=max(w,childAttributes.x+childAttributes.w)
+            h=max(h,childAttributes.y+childAttributes.h)
+        return int(math.ceil(w)),int(math.ceil(h))
+
+    def renderTiled(self,layer:'Layer',filename:str,tileSize:int=1024,
+        size:Union[Tuple[int,int],None]=None)->NoReturn:
+        """
+        render a layer straight to an image file, one tile at a time
+
+        Tiles are rendered a row at a time, and each finished row is
+        handed to the file writer (see stripWriter.py), so memory use
+        depends upon the tile size and the width of the image, not its height.
+        (A png is encoded as the rows come in, other formats are collected
+        in a memory mapped temp file and encoded at the end.)
+        If there are workers, tiles are rendered at the same time.
+
+        LIMITATION: layers that cannot render only part of themselves are
+        rendered whole, once, and kept until all the tiles are done
+        (see cropRegion), so they take as much memory as an ordinary render.
+        These are:
+            modifiers that depend upon the whole image (halo=None), such as
+                contrast, flip, mirror, shadow, and convolve with edge=repeat
+            numberspace and particles layers
+            any layer that is rotated or cropped
+
+        NOTE: the output is RGBA (or RGB for formats without alpha, such as jpeg)
+
+        :param filename: the image file to save
+        :param tileSize: how big of squares to render at a time
+        :param size: the (w,h) of the final image (default is self.extent(layer))
+        """
+        if size is None:
+            size=self.extent(layer)
+        w,h=int(size[0]),int(size[1])
+        if w<1 or h<1:
+            raise SmartimageError(layer,'Unable to save %dx%d pixel image.'%(w,h))
+        if filename.rsplit('.',1)[-1].lower() in ('jpg','jpeg','bmp'):
+            mode='RGB'
+        else:
+            mode='RGBA'
+        rows=[(y,min(y+tileSize,h)) for y in range(0,h,tileSize)]
+
+        def renderTile(renderContext:RenderingContext,tile:Tuple[int,int,int,int],
+            pixels:np.ndarray)->NoReturn:
+            image,position=layer._renderRegion(renderContext,tile)
+            if image is None:
+                return
+            if image.mode!=mode:
+                image=image.convert(mode)
+            x,y=position[0],position[1]-tile[1]
+            pixels[y:y+image.height,x:x+image.width]=np.asarray(image)
+
+        def rowTiles(top:int,bottom:int)->List[Tuple[int,int,int,int]]:
+            return [(x,top,min(x+tileSize,w),bottom) for x in range(0,w,tileSize)]
+
+        self._wholeImages=WholeImages()
+        try:
+            with stripWriter(filename,(w,h),mode) as writer:
+                if self.workers<2 or len(rows)*len(rowTiles(0,0))<2 or not layer.threadSafe:
+                    # (layers that change shared state while rendering
+                    # cannot be rendered on several threads, see Layer.threadSafe)
+                    for top,bottom in rows:
+                        pixels=np.zeros((bottom-top,w,len(mode)),dtype=np.uint8)
+                        for tile in rowTiles(top,bottom):
+                            renderTile(self,tile,pixels)
+                        writer.write(pixels)
+                else:
+                    if self._executor is None:
+                        self._executor=ThreadPoolExecutor(self.workers)
+                    self.log('rendering %d rows of tiles of "%s" on %d workers'%(
+                        len(rows),layer.name,self.workers))
+                    # the next row is started before the last one is done, to keep
+                    # the workers busy, but no more than that to keep memory down
+                    # [(pixels,[futures])]
+                    pending:List[Tuple[np.ndarray,List[Any]]]=[]
+                    for top,bottom in rows:
+                        pixels=np.zeros((bottom-top,w,len(mode)),dtype=np.uint8)
+                        pending.append((pixels,[self._executor.submit(renderTile,self.fork(),tile,pixels)
+                            for tile in rowTiles(top,bottom)]))
+                        if len(pending)>2:
+                            pixels,futures=pending.pop(0)
+                            for future in futures:
+                                future.result()
+                            writer.write(pixels)
+                    for pixels,futures in pending:
+                        for future in futures:
+                            future.result()
+                        writer.write(pixels)
+        finally:
+            self._wholeImages=None
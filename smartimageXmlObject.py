@@ -108,16 +108,18 @@ class SmartimageXmlObject(XmlBackedObject):
                             newVal=xob.xml.attrib[nameHint]
             # --- search in context
             if newVal is None:
+                # (scoped values, such as randomized particles, win out over form variables)
+                newVal=self.getVariableValue(idFind[0])
                 if newVal is None:
-                    newVal=self.getVariableValue(idFind[0])
-                if idFind[0] in self.root.variables:
-                    newVal=self.root.variables[idFind[0]].value
+                    variable=self.root.getVariable(idFind[0])
+                    if variable is not None:
+                        newVal=variable.value
             # --- search by filename
             if newVal is None:
                 newVal=self.root.getItemByFilename(name,nofollow)
             # --- search by nameHint
             if newVal is None:
-                xob=self.root.getLayerByName(idFind[0])
+                xob=self.root._getLayerByName(idFind[0])
                 if xob is not None:
                     nameHint=idFind[1]
                     if nameHint=='_':
@@ -150,11 +152,7 @@ class SmartimageXmlObject(XmlBackedObject):
         value=default
         if self.xml is not None and name in self.xml.attrib:
             value=self.xml.attrib[name]
-        val1=value
-        value=self._dereference(value,name,default,['@%s.%s'%(self.elementId,name)])
-        if val1!=value:
-            print('dereferenced "%s" to "%s"'%(val1,value))
-        return value
+        return self._dereference(value,name,default,['@%s.%s'%(self.elementId,name)])
 
     def _getPropertyArray(self,name:str,default=None)->Union[list,None]:
         val=self._getProperty(name,default)
@@ -35,4 +35,18 @@ class Solid(Layer):
             self.w=1
         if self.h==0:
             self.h=1
-        return PilPlusImage(Image.new('RGBA',(int(self.w),int(self.h)),tuple(self.color)))
\ No newline at end of file
+        return PilPlusImage(Image.new('RGBA',(int(self.w),int(self.h)),tuple(self.color)))
+
+    def imageRegion(self,box:Tuple[int,int,int,int])->Tuple[Union[PilPlusImage,None],
+        Union[Tuple[int,int],None]]:
+        """
+        only create the part of the solid that is needed
+        """
+        w=max(int(self.w),1)
+        h=max(int(self.h),1)
+        left,top=max(int(box[0]),0),max(int(box[1]),0)
+        right,bottom=min(int(box[2]),w),min(int(box[3]),h)
+        if right<=left or bottom<=top:
+            return None,None
+        image=PilPlusImage(Image.new('RGBA',(right-left,bottom-top),tuple(self.color)))
+        return image,(left,top)
\ No newline at end of file
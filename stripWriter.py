@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Writes an image file a strip of rows at a time, top to bottom,
+so that the whole image never has to be in memory at once
+(used by tiled rendering, see RenderingContext.renderTiled)
+
+PNG files are encoded as the rows come in.  Other formats cannot be
+written a piece at a time by PIL, so their rows are collected in a
+memory mapped temp file and then encoded all at once.
+"""
+from typing import *
+import os
+import struct
+import tempfile
+import zlib
+import numpy as np
+from PIL import Image
+
+
+# png color types, by image mode
+PNG_COLOR_TYPES={'L':0,'RGB':2,'LA':4,'RGBA':6}
+
+# don't let a single IDAT chunk grow past this
+MAX_PNG_CHUNK=1024*1024
+
+
+class StripWriter:
+    """
+    Base class for something that writes an image file from
+    strips of rows, which must come in order from top to bottom
+
+    Use it as a context manager, so that the file is finished
+    (or, if something went wrong, removed) no matter what.
+
+    :param filename: the image file to write
+    :param size: the (w,h) of the image
+    :param mode: the PIL mode of the image
+    """
+
+    def __init__(self,filename:str,size:Tuple[int,int],mode:str):
+        self.filename:str=filename
+        self.size:Tuple[int,int]=(int(size[0]),int(size[1]))
+        self.mode:str=mode
+        self.rowsWritten:int=0
+
+    def write(self,rows:np.ndarray)->NoReturn:
+        """
+        write the next strip of rows
+
+        :param rows: (rows,w,channels) array of uint8 pixels
+        """
+        if rows.shape[1]!=self.size[0] or self.rowsWritten+rows.shape[0]>self.size[1]:
+            raise ValueError('strip of %dx%d does not fit in a %dx%d image at row %d'%(
+                rows.shape[1],rows.shape[0],self.size[0],self.size[1],self.rowsWritten))
+        self._write(rows)
+        self.rowsWritten+=rows.shape[0]
+
+    def _write(self,rows:np.ndarray)->NoReturn:
+        """
+        Implemented by child classes
+        """
+        raise NotImplementedError()
+
+    def close(self)->NoReturn:
+        """
+        finish writing the file
+        """
+        if self.rowsWritten!=self.size[1]:
+            raise ValueError('only %d of %d rows were written'%(self.rowsWritten,self.size[1]))
+
+    def abort(self)->NoReturn:
+        """
+        give up on the file, and remove whatever was written
+        """
+
+    def __enter__(self)->'StripWriter':
+        return self
+
+    def __exit__(self,excType,excValue,traceback)->NoReturn:
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PngStripWriter(StripWriter):
+    """
+    Encodes a png file as the rows come in
+
+    Every row uses the "sub" filter, which works out the same for
+    every row and compresses photographic images nearly as well as
+    picking the best filter for each row.
+    """
+
+    def __init__(self,filename:str,size:Tuple[int,int],mode:str):
+        StripWriter.__init__(self,filename,size,mode)
+        if mode not in PNG_COLOR_TYPES:
+            raise ValueError('unable to write "%s" images to png'%mode)
+        self.channels:int=len(mode)
+        # write to a temp name, so that a half-written file never shows up
+        self._tmpName:str=filename+'.%d.tmp'%os.getpid()
+        self._file:BinaryIO=open(self._tmpName,'wb')
+        self._compressor=zlib.compressobj(6)
+        self._pending:List[bytes]=[]
+        self._pendingBytes:int=0
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR',struct.pack('>IIBBBBB',self.size[0],self.size[1],
+            8,PNG_COLOR_TYPES[mode],0,0,0))
+
+    def _chunk(self,chunkType:bytes,data:bytes)->NoReturn:
+        """
+        write a png chunk
+        """
+        self._file.write(struct.pack('>I',len(data))+chunkType+data
+            +struct.pack('>I',zlib.crc32(chunkType+data)&0xffffffff))
+
+    def _flushPending(self)->NoReturn:
+        """
+        write the compressed data collected so far as an IDAT chunk
+        """
+        if self._pending:
+            self._chunk(b'IDAT',b''.join(self._pending))
+            self._pending=[]
+            self._pendingBytes=0
+
+    def _write(self,rows:np.ndarray)->NoReturn:
+        n=rows.shape[0]
+        rows=np.ascontiguousarray(rows,dtype=np.uint8).reshape(n,-1)
+        filtered=np.empty((n,rows.shape[1]+1),dtype=np.uint8)
+        filtered[:,0]=1 # the "sub" filter: each byte less the one a pixel to the left
+        filtered[:,1:self.channels+1]=rows[:,:self.channels]
+        np.subtract(rows[:,self.channels:],rows[:,:-self.channels],out=filtered[:,self.channels+1:])
+        data=self._compressor.compress(filtered.tobytes())
+        if data:
+            self._pending.append(data)
+            self._pendingBytes+=len(data)
+            if self._pendingBytes>=MAX_PNG_CHUNK:
+                self._flushPending()
+
+    def close(self)->NoReturn:
+        try:
+            StripWriter.close(self)
+            self._pending.append(self._compressor.flush())
+            self._flushPending()
+            self._chunk(b'IEND',b'')
+            self._file.close()
+            os.replace(self._tmpName,self.filename)
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self)->NoReturn:
+        self._file.close()
+        try:
+            os.remove(self._tmpName)
+        except OSError:
+            pass
+
+
+class MemmapStripWriter(StripWriter):
+    """
+    Collects the rows in a memory mapped temp file, and then
+    saves them all at once with PIL (for any format PIL can save)
+    """
+
+    def __init__(self,filename:str,size:Tuple[int,int],mode:str):
+        StripWriter.__init__(self,filename,size,mode)
+        fd,self._tmpName=tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),suffix='.tmp')
+        os.close(fd)
+        self._pixels=np.memmap(self._tmpName,dtype=np.uint8,mode='w+',
+            shape=(self.size[1],self.size[0],len(mode)))
+
+    def _write(self,rows:np.ndarray)->NoReturn:
+        self._pixels[self.rowsWritten:self.rowsWritten+rows.shape[0]]=rows
+
+    def close(self)->NoReturn:
+        try:
+            StripWriter.close(self)
+            self._pixels.flush()
+            image=Image.frombuffer(self.mode,self.size,self._pixels,'raw',self.mode,0,1)
+            image.save(self.filename)
+            del image
+        finally:
+            self.abort()
+
+    def abort(self)->NoReturn:
+        self._pixels=None
+        try:
+            os.remove(self._tmpName)
+        except OSError:
+            pass
+
+
+def stripWriter(filename:str,size:Tuple[int,int],mode:str)->StripWriter:
+    """
+    get the best way to write an image file a strip at a time
+    (based on its extension)
+    """
+    if filename.rsplit('.',1)[-1].lower()=='png' and mode in PNG_COLOR_TYPES:
+        return PngStripWriter(filename,size,mode)
+    return MemmapStripWriter(filename,size,mode)
@@ -0,0 +1,88 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import io
+import tempfile
+import shutil
+import contextlib
+from PIL import Image
+from smartimage import *
+from smartimage.batch import renderBatch,readVariableSets
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Render one template for every row of a variable file,
+	on more than one process
+	"""
+
+	def setUp(self):
+		self.outDir=tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.outDir,ignore_errors=True)
+
+	def testName(self):
+		varFilename=os.path.join(self.outDir,'colors.csv')
+		with open(varFilename,'w') as f:
+			f.write('fg,label\n#0000ff,blue\n#00ff00,green\n#ff0000,red\n')
+		assert len(list(readVariableSets(varFilename)))==3
+		pattern=os.path.join(self.outDir,'{label}.png')
+		jobs=list(renderBatch(__HERE__,pattern,varFilename,processes=2))
+		assert len(jobs)==3
+		expected={'blue':(0,0,255),'green':(0,255,0),'red':(255,0,0)}
+		for label,color in expected.items():
+			img=Image.open(os.path.join(self.outDir,label+'.png')).convert('RGB')
+			assert img.getpixel((20,20))==color
+			assert img.getpixel((2,2))==(255,255,255)
+
+	def testStartingValues(self):
+		# values set beforehand (eg, with --set) carry over to every render
+		pattern=os.path.join(self.outDir,'card_{index}.png')
+		variableSets=[{},{'fg':'#0000ff'}]
+		jobs=list(renderBatch(__HERE__,pattern,variableSets,processes=1,
+			variables={'fg':'#00ff00'}))
+		assert len(jobs)==2
+		img=Image.open(os.path.join(self.outDir,'card_0.png')).convert('RGB')
+		assert img.getpixel((20,20))==(0,255,0)
+		img=Image.open(os.path.join(self.outDir,'card_1.png')).convert('RGB')
+		assert img.getpixel((20,20))==(0,0,255)
+
+	def testUnknownNames(self):
+		pattern=os.path.join(self.outDir,'{label}.png')
+		variableSets=[{'fg':'#0000ff','label':'a','fgg':'#00ff00'},
+			{'fg':'#0000ff','label':'b','fgg':'#00ff00'}]
+		output=io.StringIO()
+		with contextlib.redirect_stdout(output):
+			list(renderBatch(__HERE__,pattern,variableSets,processes=1))
+		warnings=[line for line in output.getvalue().split('\n') if line.startswith('WARN:')]
+		assert len(warnings)==1 # only once, and not for "label" since the filename uses it
+		assert warnings[0].find('"fgg"')>=0
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testStartingValues"))
+	testSuite.addTest(Test("testUnknownNames"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
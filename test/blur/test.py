@@ -0,0 +1,59 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import numpy as np
+from PIL import ImageFilter
+from smartimage import *
+from smartimage.blur import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	The fast blurs (including a large, downsampled one)
+	should look the same as the plain Pillow ones
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		original=self.dut.getLayer('rice').renderImage()
+		expected=np.asarray(original.filter(ImageFilter.GaussianBlur(40)),dtype=np.int32)
+		img=np.asarray(self.dut.renderImage(),dtype=np.int32)
+		assert np.abs(img-expected).mean()<1.0
+		pixels=np.asarray(original,dtype=np.float64)
+		for radius in (1.5,6):
+			expected=np.asarray(original.filter(ImageFilter.GaussianBlur(radius)),dtype=np.int32)
+			assert np.abs(np.rint(gaussianBlurArray(pixels,radius))-expected).max()<=2
+			expected=np.asarray(original.filter(ImageFilter.BoxBlur(radius)),dtype=np.int32)
+			assert np.abs(np.rint(boxBlurArray(pixels,radius))-expected).max()<=1
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
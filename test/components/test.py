@@ -0,0 +1,85 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import io
+import zipfile
+import tempfile
+import shutil
+from PIL import Image
+from smartimage import *
+from smartimage.componentStream import MappedStream
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Make sure components of a zipped file are streamed lazily,
+	and survive being saved back out
+	"""
+
+	def setUp(self):
+		self.outDir=tempfile.mkdtemp()
+		self.photo=io.BytesIO()
+		Image.new('RGB',(64,48),'#336699').save(self.photo,'PNG')
+		self.filename=os.path.join(self.outDir,'test.simg')
+		with zipfile.ZipFile(self.filename,'w') as zf:
+			zf.write(__HERE__+'smartimage.xml','smartimage.xml',zipfile.ZIP_DEFLATED)
+			zf.writestr('photo.png',self.photo.getvalue(),zipfile.ZIP_STORED)
+
+	def tearDown(self):
+		shutil.rmtree(self.outDir,ignore_errors=True)
+
+	def testName(self):
+		dut=SmartImage(self.filename)
+		dut.autoUi=False
+		component=dut.getComponent('photo.png')
+		# stored, so it should come straight out of the file
+		assert isinstance(component,MappedStream)
+		assert component.read()==self.photo.getvalue()
+		component.close()
+		img=dut.renderImage()
+		assert img.size==(64,48)
+		# save it back out, over the top of itself
+		# (which has to let go of the file first)
+		container=dut.container
+		dut.save(self.filename)
+		assert container.zipfile.fp is None
+		assert dut._container is None
+		with zipfile.ZipFile(self.filename) as zf:
+			assert zf.read('photo.png')==self.photo.getvalue()
+			assert zf.getinfo('photo.png').compress_type==zipfile.ZIP_STORED
+		again=SmartImage(self.filename)
+		again.autoUi=False
+		assert again.renderImage().size==(64,48)
+		# loading something else lets go of the old file as well
+		container=again.container
+		again.load(self.filename)
+		assert container.zipfile.fp is None
+		# a component that has gone missing is skipped, not a crash
+		again.getComponent=lambda name:None if name=='photo.png' else SmartImage.getComponent(again,name)
+		again.save(os.path.join(self.outDir,'copy.simg'))
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
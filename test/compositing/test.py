@@ -0,0 +1,125 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+from PIL import Image
+from smartimage.compositing import Canvas,composite
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+def _near(a,b,tolerance:int=1)->bool:
+	return all(abs(x-y)<=tolerance for x,y in zip(a,b))
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	The canvas comes out in a mode that can hold everything
+	put on it, and blends the way the spec says
+	"""
+
+	def setUp(self):
+		pass
+
+	def tearDown(self):
+		pass
+
+	def testModes(self):
+		# color on top of grayscale stays in color
+		background=Image.new('L',(10,10),128)
+		red=Image.new('RGB',(4,4),(255,0,0))
+		img=composite(red,background,position=(2,2))
+		assert img.mode=='RGB'
+		assert img.getpixel((3,3))==(255,0,0)
+		assert img.getpixel((0,0))==(128,128,128)
+		# grayscale on top of color doesn't take the color away
+		img=composite(background,red,resize=False)
+		assert img.mode=='RGB'
+		assert img.getpixel((0,0))==(128,128,128)
+		# grayscale on grayscale stays grayscale
+		img=composite(Image.new('L',(4,4),255),background,position=(2,2))
+		assert img.mode=='L'
+		assert img.getpixel((3,3))==255
+		# a canvas that is given a mode still widens it if it has to
+		canvas=Canvas(background,mode='L')
+		canvas.composite(red,position=(2,2))
+		assert canvas.image.mode=='RGB'
+
+	def testGrow(self):
+		# growing past the background leaves the new area see-through
+		background=Image.new('RGB',(10,10),(0,0,255))
+		red=Image.new('RGBA',(4,4),(255,0,0,255))
+		img=composite(red,background,position=(8,8))
+		assert img.size==(12,12)
+		assert img.mode=='RGBA'
+		assert img.getpixel((0,0))==(0,0,255,255)
+		assert img.getpixel((9,9))==(255,0,0,255)
+		assert img.getpixel((11,0))[3]==0
+		assert img.getpixel((0,11))[3]==0
+		# but fully covered stays opaque
+		img=composite(red,background,position=(6,6),resize=False)
+		assert img.mode=='RGB'
+		assert img.getpixel((7,7))==(255,0,0)
+
+	def testOpacityMask(self):
+		background=Image.new('RGB',(10,10),(0,0,0))
+		white=Image.new('RGB',(10,10),(255,255,255))
+		img=composite(white,background,opacity=0.5)
+		assert img.mode=='RGB'
+		assert _near(img.getpixel((5,5)),(128,128,128))
+		# only the left half of the mask lets the image through
+		mask=Image.new('L',(2,1),0)
+		mask.putpixel((0,0),255)
+		img=composite(white,background,mask=mask.resize((10,10),Image.NEAREST))
+		assert img.getpixel((0,5))==(255,255,255)
+		assert img.getpixel((9,5))==(0,0,0)
+		# with nothing underneath, the opacity ends up in the alpha
+		img=composite(white,None,opacity=0.5)
+		assert img.mode=='RGBA'
+		assert _near(img.getpixel((5,5)),(255,255,255,128))
+
+	def testBlendModes(self):
+		background=Image.new('RGB',(4,4),(128,128,128))
+		source=Image.new('RGB',(4,4),(128,128,128))
+		expected={
+			'multiply':64,
+			'screen':192,
+			'difference':0,
+			'darken':128,
+			'add':255,
+			}
+		for blendMode,value in expected.items():
+			img=composite(source,background,blendMode=blendMode)
+			assert _near(img.getpixel((1,1)),(value,value,value)),blendMode
+		# a blend mode only applies where there is something to blend with
+		img=composite(source,Image.new('RGBA',(4,4),(0,0,0,0)),blendMode='multiply')
+		assert _near(img.getpixel((1,1)),(128,128,128,255))
+		self.assertRaises(ValueError,composite,source,background,blendMode='nonsense')
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testModes"))
+	testSuite.addTest(Test("testGrow"))
+	testSuite.addTest(Test("testOpacityMask"))
+	testSuite.addTest(Test("testBlendModes"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
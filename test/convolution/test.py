@@ -0,0 +1,60 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import numpy as np
+from PIL import Image
+from smartimage import *
+from smartimage.convolution import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	All the ways of convolving should agree with each other,
+	and an identity kernel should leave the image alone
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		original=self.dut.getLayer('identity').children[0].renderImage()
+		img=self.dut.renderImage()
+		assert np.array_equal(np.asarray(img),np.asarray(original))
+		pixels=np.asarray(original.convert('RGB'),dtype=np.float64)
+		gaussian=np.outer([1,4,6,4,1],[1,4,6,4,1])/256.0
+		assert len(separableKernel(gaussian))==1
+		emboss=[[-2,-1,0],[-1,1,1],[0,1,2]]
+		for kernel in (gaussian,emboss,np.arange(35).reshape(5,7)):
+			direct=correlate(pixels,kernel,fftThreshold=1000000)
+			fourier=correlate(pixels,kernel,fftThreshold=0)
+			assert np.abs(direct-fourier).max()<1e-6
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
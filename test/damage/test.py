@@ -0,0 +1,60 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import numpy as np
+from smartimage import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Changing one small layer should only re-composite where it is,
+	and still come out the same as rendering it from scratch
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+		self.dut.trackDamage=True
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		self.dut.renderImage()
+		self.dut.getLayer('small').color='#00ff00'
+		img=self.dut.renderImage()
+		assert self.dut._damage.rect==(200,40,240,70)
+		fresh=SmartImage(__HERE__)
+		fresh.autoUi=False
+		fresh.getLayer('small').color='#00ff00'
+		expected=np.asarray(fresh.renderImage(),dtype=np.int32)
+		assert np.abs(np.asarray(img,dtype=np.int32)-expected).max()<=1
+		# nothing changed, so nothing is damaged
+		self.dut.renderImage()
+		assert self.dut._damage.rect==()
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
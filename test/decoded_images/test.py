@@ -0,0 +1,78 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+from PIL import JpegImagePlugin
+from smartimage import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Images are only decoded once, and a jpeg that is going to be
+	shrunk anyway is decoded at reduced resolution
+	"""
+
+	def setUp(self):
+		# keep track of what size jpegs are decoded at
+		self.drafts=[]
+		self.draft=JpegImagePlugin.JpegImageFile.draft
+		drafts=self.drafts
+		draft=self.draft
+		def recordDraft(img,mode,size):
+			ret=draft(img,mode,size)
+			drafts.append(img.size)
+			return ret
+		JpegImagePlugin.JpegImageFile.draft=recordDraft
+
+	def tearDown(self):
+		JpegImagePlugin.JpegImageFile.draft=self.draft
+
+	def testName(self):
+		# only the width is given, so the height keeps the aspect ratio
+		dut=SmartImage(__HERE__)
+		dut.autoUi=False
+		img=dut.getLayer('photo').image
+		assert img.size==(240,154)
+		# (the picnic is 960 wide, so a quarter is exactly enough)
+		assert self.drafts==[(240,154)]
+
+	def testCacheHit(self):
+		dut=SmartImage(__HERE__)
+		dut.autoUi=False
+		img=dut.imageByRef('../picnic.jpg',size=(None,154))
+		assert img.size==(240,154)
+		hits=dut.decodedImages.stats['hits']
+		again=dut.imageByRef('../picnic.jpg',size=(None,154))
+		assert again is img
+		assert dut.decodedImages.stats['hits']==hits+1
+		# not decoded a second time
+		assert len(self.drafts)==1
+		# a different size is a different image
+		full=dut.imageByRef('../picnic.jpg')
+		assert full.size==(960,616)
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testCacheHit"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import lxml.etree
+from smartimage import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Make sure changing a layer only invalidates the
+	layers that depend upon it
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		original=self.dut.getLayer('original')
+		copy=self.dut.getLayer('copy')
+		unrelated=self.dut.getLayer('unrelated')
+		dependents=self.dut.dependencies.dependents(original)
+		assert copy in dependents
+		assert self.dut in dependents
+		assert unrelated not in dependents
+		copyKey=copy.renderKey
+		unrelatedKey=unrelated.renderKey
+		original.color='#00ff00'
+		assert copy.renderKey!=copyKey
+		assert unrelated.renderKey==unrelatedKey
+
+	def testChildAdded(self):
+		original=self.dut.getLayer('original')
+		self.dut.dependencies # the graph already exists before the child is added
+		holder=self.dut.getLayer('holder')
+		holder.xml.append(lxml.etree.fromstring('<solid id="late" color="@original" w="10" h="10" />'))
+		holder.childrenChanged()
+		late=self.dut.getLayer('late')
+		assert late is holder.children[0]
+		assert late in self.dut.dependencies.dependents(original)
+		lateKey=late.renderKey
+		original.color='#0000ff'
+		assert late.renderKey!=lateKey
+
+	def testDetached(self):
+		# layers that are not part of a document can still be changed
+		group=Layer(None,'<group id="1"><solid id="2" color="#ff0000" w="10" h="10" /></group>')
+		solid=group.children[0]
+		solid.color='#00ff00'
+		solid.w=20
+		assert solid.attributes.w==20
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testChildAdded"))
+	testSuite.addTest(Test("testDetached"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from PIL import Image
+from smartimage import *
+from smartimage.renderCache import RenderCache,DiskRenderCache
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+def _image(value:int,size:int=200)->Image.Image:
+	return Image.new('RGBA',(size,size),(value,0,0,255))
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Rendered layers are kept on disk where other processes
+	(or another cache in this one) can find them
+	"""
+
+	def setUp(self):
+		self.directory=tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory,ignore_errors=True)
+
+	def testName(self):
+		dut=SmartImage(__HERE__)
+		dut.autoUi=False
+		dut.renderCache=RenderCache(diskCache=DiskRenderCache(self.directory))
+		first=dut.renderImage()
+		# a separate memory cache finds it on disk
+		other=SmartImage(__HERE__)
+		other.autoUi=False
+		cache=RenderCache(diskCache=DiskRenderCache(self.directory))
+		other.renderCache=cache
+		again=other.renderImage()
+		assert cache.stats['hits']>0
+		assert np.array_equal(np.asarray(again),np.asarray(first))
+
+	def testReadWrite(self):
+		cache=DiskRenderCache(self.directory)
+		cache.put('aa01',_image(10))
+		found,image=cache.lookup('aa01')
+		assert found
+		assert np.array_equal(np.asarray(image),np.asarray(_image(10)))
+		assert cache.lookup('bb02')==(False,None)
+		# too small to be worth a file
+		cache.put('cc03',_image(20,8))
+		assert not cache.lookup('cc03')[0]
+		# the running total matches what is really there
+		assert cache.totalBytes==DiskRenderCache(self.directory).totalBytes
+
+	def testEviction(self):
+		imageSize=len(_image(0).tobytes())+DiskRenderCache.HEADER.size
+		cache=DiskRenderCache(self.directory,maxBytes=imageSize*3)
+		for i in range(3):
+			key='%02d'%i
+			cache.put(key,_image(i))
+			os.utime(cache._filename(key),(1000+i,1000+i)) # oldest first
+		cache.lookup('00') # now used most recently
+		cache.put('03',_image(3))
+		assert cache.totalBytes<=cache.maxBytes
+		assert cache.lookup('00')[0]
+		assert not cache.lookup('01')[0] # least recently used goes first
+		assert cache.lookup('03')[0]
+		cache.clear()
+		assert cache.totalBytes==0
+		assert not cache.lookup('03')[0]
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testReadWrite"))
+	testSuite.addTest(Test("testEviction"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import shutil
+import tempfile
+from PIL import ImageFont
+from smartimage import fontIndex
+from smartimage.fontIndex import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Fonts are found by name from a saved index, without scanning or downloading
+	"""
+
+	def setUp(self):
+		self.directory=tempfile.mkdtemp()
+		self.fontFilename=os.path.join(self.directory,'fonts','My-Font.ttf')
+		os.makedirs(os.path.dirname(self.fontFilename))
+		with open(self.fontFilename,'wb') as f:
+			f.write(ImageFont.load_default(20).font_bytes) # the "Aileron" font
+		self.indexFilename=os.path.join(self.directory,'fontIndex.json')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory,ignore_errors=True)
+
+	def testName(self):
+		index=FontIndex(self.indexFilename,[os.path.join(self.directory,'fonts')])
+		assert index.resolve('Aileron') is None # nothing until it is scanned
+		assert index.refresh()==1
+		found=(os.path.abspath(self.fontFilename),0)
+		for name in ('Aileron','aileron regular','Aileron-Regular.ttf','My Font','myfont.otf'):
+			assert index.resolve(name)==found,name
+		assert index.resolve('Nonexistent Sans') is None
+		index.aliases[fontKey('Fancy Name')]=found
+		index.save()
+		# a saved index is simply loaded
+		loaded=FontIndex(self.indexFilename,[])
+		assert loaded.load()
+		assert loaded.resolve('Aileron')==found
+		assert loaded.resolve('Fancy Name')==found
+		# refreshing only reads the fonts that changed
+		reads=[]
+		originalFontFaces=fontIndex.fontFaces
+		fontIndex.fontFaces=lambda filename:reads.append(filename) or originalFontFaces(filename)
+		try:
+			index.refresh()
+			assert reads==[]
+			os.utime(self.fontFilename,(1,1))
+			index.refresh()
+			assert reads==[os.path.abspath(self.fontFilename)]
+		finally:
+			fontIndex.fontFaces=originalFontFaces
+		# and ones that are gone are forgotten
+		os.remove(self.fontFilename)
+		assert index.refresh()==0
+		assert index.resolve('Aileron') is None and index.resolve('Fancy Name') is None
+		assert componentFonts(['a.png','Hi Melody.ttf','sub/Other.OTF'])=={
+			'himelody':'Hi Melody.ttf','other':'sub/Other.OTF'}
+
+	def testFallback(self):
+		# somewhere that can't be written (under a file, rather than a directory)
+		unwritable=os.path.join(self.fontFilename,'cache','fontIndex.json')
+		environ=os.environ.get('SMARTIMAGE_FONT_INDEX')
+		tempdir=tempfile.tempdir
+		refresh=FontIndex.refresh
+		defaultIndex=fontIndex._defaultIndex
+		os.environ['SMARTIMAGE_FONT_INDEX']=unwritable
+		tempfile.tempdir=self.directory
+		try:
+			index=FontIndex(None,[os.path.join(self.directory,'fonts')])
+			index.refresh()
+			# it ends up in the temp directory instead
+			assert saveFontIndex(index)
+			assert index.filename==indexFilenames()[1]
+			assert index.filename.startswith(self.directory)
+			# and rendering finds it there, without ever scanning
+			def noScanning(index):
+				raise AssertionError('scanned the font directories')
+			FontIndex.refresh=noScanning
+			fontIndex._defaultIndex=None
+			assert defaultFontIndex().resolve('Aileron')==(os.path.abspath(self.fontFilename),0)
+			# with no index anywhere, the fonts are indexed once, and it is saved
+			FontIndex.refresh=refresh
+			os.remove(index.filename)
+			fontIndex._defaultIndex=None
+			directories=fontIndex.systemFontDirectories
+			fontIndex.systemFontDirectories=lambda:[os.path.join(self.directory,'fonts')]
+			try:
+				assert defaultFontIndex().resolve('Aileron')==(os.path.abspath(self.fontFilename),0)
+			finally:
+				fontIndex.systemFontDirectories=directories
+			assert os.path.isfile(indexFilenames()[1])
+		finally:
+			FontIndex.refresh=refresh
+			fontIndex._defaultIndex=defaultIndex
+			tempfile.tempdir=tempdir
+			if environ is None:
+				del os.environ['SMARTIMAGE_FONT_INDEX']
+			else:
+				os.environ['SMARTIMAGE_FONT_INDEX']=environ
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testFallback"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
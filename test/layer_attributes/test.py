@@ -0,0 +1,80 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+from smartimage import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	The resolved attributes of a layer are thrown out, and resolved
+	again, whenever something they depend upon changes
+	(and only then)
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+		self.box=self.dut.getLayer('box')
+		self.holder=self.dut.getLayer('holder')
+		self.unrelated=self.dut.getLayer('unrelated')
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		# changing a property
+		assert self.box.attributes.location==(10,10)
+		assert self.holder.attributes.x==10 # auto, from the child
+		unrelated=self.unrelated.attributes
+		self.box.x=30
+		assert self.box.attributes.location==(30,10)
+		assert self.holder.attributes.x==30
+		assert self.unrelated.attributes is unrelated
+
+	def testVariable(self):
+		assert self.box.attributes.size==(40,40)
+		assert self.box.attributes.opacity==0.5
+		unrelated=self.unrelated.attributes
+		self.dut.setVariable('boxSize','60')
+		assert self.box.attributes.size==(60,60)
+		assert self.holder.attributes.w==60 # auto, from the child
+		assert self.box.attributes.opacity==0.5
+		self.dut.setVariable('fade','1.0')
+		assert self.box.attributes.opacity==1.0
+		assert self.unrelated.attributes is unrelated
+
+	def testUnchanged(self):
+		# nothing changed, so the very same record is kept
+		attributes=self.box.attributes
+		self.dut.renderImage()
+		assert self.box.attributes is attributes
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testVariable"))
+	testSuite.addTest(Test("testUnchanged"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
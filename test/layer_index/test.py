@@ -0,0 +1,68 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+from smartimage import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Make sure layers can be found by id and name, and that
+	when names are duplicated, the nearest one wins
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		groupA=self.dut.getLayer('groupA')
+		groupB=self.dut.getLayer('groupB')
+		assert self.dut.getLayer('SOLIDA') is self.dut.getLayer('solidA')
+		assert groupA.getLayer('square') is self.dut.getLayer('solidA')
+		assert groupB.getLayer('square') is self.dut.getLayer('solidB')
+		# renaming is picked up
+		self.dut.getLayer('solidB').name='circle'
+		assert groupB.getLayer('circle') is self.dut.getLayer('solidB')
+		assert groupB.getLayer('square') is self.dut.getLayer('solidA')
+		assert self.dut.getLayer('') is None
+		assert self.dut.getLayer('@') is None
+
+	def testDetached(self):
+		# layers that are not part of a document can still find each other
+		group=Layer(None,'<group id="1"><solid id="2" name="square" color="#ff0000" w="10" h="10" /></group>')
+		solid=group.children[0]
+		assert group.getLayer('square') is solid
+		assert solid.getLayer('1') is group
+		assert group.getLayer('') is None
+		solid.name='circle'
+		assert group.getLayer('circle') is solid
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testDetached"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import numpy as np
+from smartimage import *
+from smartimage.colorLut import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+IDENTITY_CUBE="""TITLE "identity"
+LUT_3D_SIZE 2
+0 0 0
+1 0 0
+0 1 0
+1 1 0
+0 0 1
+1 0 1
+0 1 1
+1 1 1
+"""
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Color grade with a .cube file
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		original=self.dut.getLayer('rice').renderImage().convert('RGB')
+		identity=parseCube(IDENTITY_CUBE)
+		assert np.array_equal(np.asarray(identity.apply(original)),np.asarray(original))
+		graded=np.asarray(self.dut.renderImage(),dtype=np.int32)
+		assert not np.array_equal(graded,np.asarray(original,dtype=np.int32))
+		lut=self.dut.getLayer('graded').lut
+		assert lut is self.dut.getLayer('graded').lut # parsed only once
+		assert lut.size==33
+		trilinear=np.asarray(lut.apply(original,'trilinear'),dtype=np.int32)
+		assert np.abs(trilinear-graded).mean()<1.0
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from PIL import Image
+from smartimage import *
+from smartimage.renderCache import RenderCache
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+def _load()->SmartImage:
+	"""
+	a fresh copy, with nothing already rendered
+	"""
+	simg=SmartImage(__HERE__)
+	simg.autoUi=False
+	simg.renderCache=RenderCache()
+	return simg
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Rendering on several threads comes out exactly the same as on one,
+	even with layers (particles) that change variables while they render
+	"""
+
+	def setUp(self):
+		self.outDir=tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.outDir,ignore_errors=True)
+
+	def testName(self):
+		serial=np.asarray(_load().renderImage(workers=1))
+		for _ in range(3):
+			parallel=np.asarray(_load().renderImage(workers=4))
+			assert np.array_equal(parallel,serial)
+
+	def testTiled(self):
+		images=[]
+		for workers in (1,4):
+			filename=os.path.join(self.outDir,'tiled%d.png'%workers)
+			_load().renderTiled(filename,tileSize=64,workers=workers)
+			images.append(np.asarray(Image.open(filename)))
+		assert np.array_equal(images[0],images[1])
+
+	def testThreadSafe(self):
+		simg=_load()
+		assert not simg.getLayer('confetti').threadSafe
+		assert not simg.getLayer('inner').threadSafe # contains particles
+		assert not simg.threadSafe
+		assert simg.getLayer('inner').children[0].threadSafe # the texture
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testTiled"))
+	testSuite.addTest(Test("testThreadSafe"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
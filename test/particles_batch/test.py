@@ -0,0 +1,123 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import numpy as np
+from PIL import Image
+from smartimage import *
+from smartimage.compositing import Canvas,Stamp
+from smartimage.renderCache import RenderCache
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Particles are stamped down a run at a time, and come out
+	the same every time for the same seed
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		confetti=self.dut.getLayer('confetti')
+		img=confetti.renderImage()
+		assert img is not None
+		assert img.width<=320+6 and img.height<=240+9
+		again=SmartImage(__HERE__)
+		again.autoUi=False
+		assert np.array_equal(np.asarray(again.getLayer('confetti').renderImage()),np.asarray(img))
+
+	def testCache(self):
+		# with variants, the few different particles are worth keeping
+		# (2 children with 4 opacities each, plus the document and the particles layer)
+		cache=RenderCache()
+		self.dut.renderCache=cache
+		self.dut.renderImage()
+		assert 2<len(cache)<=2+2*4
+		# but without, they are one-offs, so only the document
+		# and the particles layer itself are kept
+		again=SmartImage(__HERE__)
+		again.autoUi=False
+		del again.getLayer('confetti').xml.attrib['variants']
+		cache=RenderCache()
+		again.renderCache=cache
+		again.renderImage()
+		assert len(cache)<=2
+
+	def testStamp(self):
+		sprite=Image.new('RGBA',(5,3),(255,0,0,128))
+		positions=[(0,0),(2,1),(-1,4),(10,10),(2,1)]
+		one=Canvas()
+		for position in positions:
+			one.composite(sprite,0.5,'multiply',None,position)
+		batch=Canvas()
+		batch.stamp(Stamp(sprite,0.5,'multiply'),positions)
+		assert np.array_equal(np.asarray(one.image),np.asarray(batch.image))
+		# lots of copies, some overlapping and some not, blended together
+		# in waves, still come out exactly the same as one at a time
+		rng=np.random.default_rng(3)
+		positions=[tuple(p) for p in rng.integers(-4,60,(400,2))]
+		background=Image.new('RGB',(64,64),(20,120,200))
+		one=Canvas(background)
+		for position in positions:
+			one.composite(sprite,0.5,'screen',None,position)
+		batch=Canvas(background)
+		batch.stamp(Stamp(sprite,0.5,'screen'),positions)
+		assert np.array_equal(one.pixels,batch.pixels)
+
+	def testVariantsFreed(self):
+		# with no variants, every particle is different, so each one
+		# should be let go of as soon as it has been stamped down
+		from smartimage import particles
+		alive=[0,0] # [now,most]
+		class CountedStamp(Stamp):
+			def __init__(self,*args,**kwargs):
+				Stamp.__init__(self,*args,**kwargs)
+				alive[0]+=1
+				alive[1]=max(alive)
+			def __del__(self):
+				alive[0]-=1
+		particles.Stamp=CountedStamp
+		try:
+			confetti=self.dut.getLayer('confetti')
+			del confetti.xml.attrib['variants']
+			confetti.xml.attrib['qty']='200'
+			img=confetti._renderImage(RenderingContext())
+		finally:
+			particles.Stamp=Stamp
+		assert img is not None
+		assert alive[1]<=2
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testCache"))
+	testSuite.addTest(Test("testStamp"))
+	testSuite.addTest(Test("testVariantsFreed"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import numpy as np
+from PIL import Image
+from smartimage import *
+from smartimage.particles import dispersionSampler
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Particles land according to the brightness of the dispersionMap
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		# the map is stretched over the whole layer
+		img=self.dut.getLayer('sprinkles').renderImage()
+		assert img is not None
+		assert img.width>300 and img.height>220
+
+	def testSampler(self):
+		weights=np.zeros((40,60),dtype=np.uint8)
+		weights[:,45:]=255 # only the right quarter
+		weights[10,5]=1 # and one dim pixel
+		dispersionMap=Image.fromarray(weights)
+		sampler=dispersionSampler(dispersionMap)
+		assert dispersionSampler(dispersionMap) is sampler # only worked out once
+		picks=sampler.sample(np.random.default_rng(42),10000)
+		assert picks.shape==(10000,2)
+		right=picks[:,0]>=45
+		assert right.sum()>9900
+		assert np.all(right|((picks[:,0]==5)&(picks[:,1]==10)))
+		again=sampler.sample(np.random.default_rng(42),10000)
+		assert np.array_equal(picks,again)
+		# black means anywhere
+		picks=dispersionSampler(Image.new('L',(8,8))).sample(np.random.default_rng(1),1000)
+		assert picks.min()==0 and picks.max()==7
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testSampler"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
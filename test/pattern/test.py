@@ -0,0 +1,87 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import numpy as np
+from PIL import Image
+from smartimage import *
+from smartimage.pattern import tilePattern
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Patterns repeat their children, and any region of them can be made on its own
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		wall=np.asarray(self.dut.getLayer('wall').renderImage(),dtype=np.int32)
+		assert wall.shape==(300,400,4)
+		brick=[0xAA,0x33,0x00,255]
+		mortar=[0x80,0x80,0x80,255]
+		assert list(wall[0,0])==brick and list(wall[0,30])==mortar and list(wall[12,0])==mortar
+		# every other row is shifted over by half a brick
+		assert np.array_equal(wall[14:26,16:48],wall[0:12,0:32])
+		assert np.array_equal(wall[28:40],wall[0:12])
+		# a region comes out the same as the part of the whole thing
+		honeycomb=self.dut.getLayer('honeycomb')
+		whole=np.asarray(tilePattern(honeycomb.cellImage(),(400,300),honeycomb.repeat))
+		region=np.asarray(tilePattern(honeycomb.cellImage(),(400,300),honeycomb.repeat,
+			box=(123,77,450,290)))
+		assert np.array_equal(region,whole[77:290,123:400])
+		# patterns that place a single copy
+		cell=Image.new('RGBA',(10,10),(255,0,0,255))
+		once=np.asarray(tilePattern(cell,(50,40),('right','center')))
+		assert once[15:25,40:50,3].all() and once[...,3].sum()==100*255
+		stretched=np.asarray(tilePattern(cell,(50,40),('stretch','stretch')))
+		assert stretched[...,3].all()
+
+	def testCropRotate(self):
+		# a pattern is cropped and rotated like any other layer
+		turned=self.dut.getLayer('turned')
+		renderContext=RenderingContext()
+		image=turned.renderImage(renderContext)
+		assert image.size==(20,20)
+		# blue on the left and red on the right, turned a quarter to the left
+		pixels=np.asarray(image.convert('RGBA'),dtype=np.int32)
+		assert list(pixels[5,10])==[255,0,0,255]
+		assert list(pixels[15,10])==[0,0,255,255]
+		assert turned in renderContext.compositeDamage
+		# and a region of it comes out the same
+		region,position=turned._renderRegion(RenderingContext(),(0,0,20,20))
+		assert position==(0,0)
+		assert np.array_equal(np.asarray(region.convert('RGBA'),dtype=np.int32),pixels)
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testCropRotate"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
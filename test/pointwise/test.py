@@ -0,0 +1,55 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import numpy as np
+from PIL import ImageOps
+from smartimage import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	A stack of pointwise modifiers is done in one pass,
+	but comes out the same as doing them one at a time
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		chain,source=self.dut.getLayer('invert')._pointwiseChain()
+		assert len(chain)==3
+		assert source.children[0] is self.dut.getLayer('rice')
+		original=self.dut.getLayer('rice').renderImage().convert('RGB')
+		expected=ImageOps.invert(ImageOps.solarize(ImageOps.posterize(original,3),200))
+		img=self.dut.renderImage().convert('RGB')
+		assert np.array_equal(np.asarray(img),np.asarray(expected))
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import numpy as np
+from PIL import ImageEnhance
+from smartimage import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	The brightness, contrast, and saturation modifiers come out
+	the same as PIL's ImageEnhance (to within rounding)
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def assertClose(self,img,expected):
+		img=np.asarray(img.convert('RGB'),dtype=np.int32)
+		expected=np.asarray(expected.convert('RGB'),dtype=np.int32)
+		assert img.shape==expected.shape
+		assert np.abs(img-expected).max()<=2
+
+	def testName(self):
+		chain,source=self.dut.getLayer('saturation')._pointwiseChain()
+		assert len(chain)==3
+		assert source.children[0] is self.dut.getLayer('rice')
+		original=self.dut.getLayer('rice').renderImage().convert('RGB')
+		expected=ImageEnhance.Brightness(original).enhance(1.3)
+		self.assertClose(self.dut.getLayer('brightness').renderImage(),expected)
+		expected=ImageEnhance.Contrast(expected).enhance(0.7)
+		self.assertClose(self.dut.getLayer('contrast').renderImage(),expected)
+		expected=ImageEnhance.Color(expected).enhance(1.5)
+		self.assertClose(self.dut.renderImage(),expected)
+		# and every one of them actually changes the image
+		previous=np.asarray(original,dtype=np.int32)
+		for layerId in ('brightness','contrast','saturation'):
+			img=np.asarray(self.dut.getLayer(layerId).renderImage().convert('RGB'),dtype=np.int32)
+			assert np.abs(img-previous).mean()>2,layerId
+			previous=img
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
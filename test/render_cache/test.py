@@ -0,0 +1,72 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+from smartimage import *
+from smartimage.renderCache import RenderCache
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Make sure identical layers are only rendered once,
+	even across separate loads of the same file
+	"""
+
+	def setUp(self):
+		self.cache=RenderCache()
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+		self.dut.renderCache=self.cache
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		first=self.dut.renderImage()
+		assert len(self.cache)>0
+		other=SmartImage(__HERE__)
+		other.autoUi=False
+		other.renderCache=self.cache
+		# same content, so should come straight out of the cache
+		assert other.renderKey==self.dut.renderKey
+		assert other.renderImage() is first
+		# changing one layer only changes the keys above it
+		background=other.getLayer('background')
+		backgroundKey=background.renderKey
+		other.getLayer('foreground').color='#ff0000'
+		assert other.renderKey!=self.dut.renderKey
+		assert background.renderKey==backgroundKey
+
+	def testBudget(self):
+		self.cache.maxBytes=200*200*4 # room for about one layer
+		self.dut.renderImage()
+		stats=self.cache.stats
+		assert stats['misses']>0
+		assert stats['evictions']>0
+		assert stats['bytes']<=self.cache.maxBytes
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testBudget"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
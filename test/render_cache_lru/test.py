@@ -0,0 +1,91 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+from PIL import Image
+from smartimage import *
+from smartimage.renderCache import RenderCache,imageBytes
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+def _image(value:int,size:int=10)->Image.Image:
+	return Image.new('RGBA',(size,size),(value,0,0,255))
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	The render cache throws out the least recently used images first,
+	and never caches an image too big to fit at all
+	"""
+
+	def setUp(self):
+		self.cache=RenderCache(maxBytes=imageBytes(_image(0))*3)
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		# a layer too big for the budget is rendered, but not cached
+		dut=SmartImage(__HERE__)
+		dut.autoUi=False
+		self.cache.maxBytes=200*200*4
+		dut.renderCache=self.cache
+		dut.renderImage()
+		assert self.cache.stats['rejections']>0
+		assert dut.getLayer('small').renderKey in self.cache
+		assert dut.getLayer('huge').renderKey not in self.cache
+		assert self.cache.numBytes<=self.cache.maxBytes
+
+	def testEvictionOrder(self):
+		cache=self.cache
+		for key in 'abc':
+			cache.put(key,_image(ord(key)))
+		assert cache.get('a') is not None # a is now the most recently used
+		cache.put('d',_image(4))
+		# (looking, even with "in", counts as using, so peek at the order directly)
+		assert list(cache._images.keys())==['c','a','d']
+		cache.put('e',_image(5))
+		assert list(cache._images.keys())==['a','d','e']
+		assert cache.stats['evictions']==2
+		assert cache.numBytes==imageBytes(_image(0))*3
+
+	def testOversized(self):
+		cache=self.cache
+		cache.put('a',_image(1))
+		cache.put('b',_image(2))
+		cache.put('big',_image(3,100))
+		assert 'big' not in cache
+		assert 'a' in cache and 'b' in cache
+		assert cache.stats['evictions']==0
+		assert cache.stats['rejections']==1
+		# a cached None takes no room
+		cache.put('none',None)
+		assert cache.lookup('none')==(True,None)
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testEvictionOrder"))
+	testSuite.addTest(Test("testOversized"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
@@ -34,6 +34,32 @@ TESTS=[
     'heartGimpPath',
     # #'collage',
     'cli_help',
+    'render_cache',
+    'disk_render_cache',
+    'render_cache_lru',
+    'dependencies',
+    'layer_attributes',
+    'layer_index',
+    'parallel_render',
+    'batch',
+    'components',
+    'decoded_images',
+    'compositing',
+    'tiled',
+    'damage',
+    'convolution',
+    'blur',
+    'pointwise',
+    'pointwise_enhance',
+    'lut',
+    'texture_cache',
+    'texture_tile',
+    'pattern',
+    'text_wrap',
+    'font_index',
+    'text_atlas',
+    'particles_batch',
+    'particles_dispersion',
 ]
 
 
@@ -9,6 +9,7 @@ See:
 import unittest
 import os
 from smartimage import *
+from smartimage.fontIndex import prefetchFonts
 
 
 __HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
@@ -18,6 +19,8 @@ class Test(unittest.TestCase):
     """
 
     def setUp(self):
+        # the font this test uses, whether or not it is installed
+        prefetchFonts(['Hi Melody'])
         self.dut=SmartImage()
 
     def tearDown(self):
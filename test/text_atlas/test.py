@@ -0,0 +1,60 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+from smartimage import *
+from smartimage.text import TEXT_CACHE
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	The same text, drawn the same way, is only drawn once
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		first=self.dut.getLayer('first').image
+		assert first is self.dut.getLayer('second').image # placed elsewhere, same drawing
+		red=self.dut.getLayer('red').image
+		assert red is not first and red.size==first.size
+		wrapped=self.dut.getLayer('wrapped').image
+		assert wrapped.width<=60 and wrapped.height>first.height
+		# and it is still there when the document is loaded again
+		hits=TEXT_CACHE.hits
+		again=SmartImage(__HERE__)
+		again.autoUi=False
+		assert again.getLayer('first').image is first
+		assert TEXT_CACHE.hits==hits+1
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
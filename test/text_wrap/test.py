@@ -0,0 +1,67 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import io
+from PIL import ImageFont
+from smartimage.textLayout import *
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Fonts are only loaded once, and text wraps to a width in pixels
+	"""
+
+	def setUp(self):
+		self.fontBytes=ImageFont.load_default(20).font_bytes
+		self.loads=0
+
+	def tearDown(self):
+		pass
+
+	def load(self):
+		self.loads+=1
+		return io.BytesIO(self.fontBytes)
+
+	def testName(self):
+		font=cachedFont('text_wrap test font',20,0,self.load)
+		assert font is cachedFont('text_wrap test font',20,0,self.load)
+		assert self.loads==1
+		assert cachedFont('text_wrap test font',30,0,self.load) is not font
+		assert self.loads==2
+		text=('The quick brown fox jumps over the lazy dog. '*10)+'\n\nSupercalifragilisticexpialidocious'
+		lines=wrapText(text,font,150)
+		for line in lines:
+			assert font.getlength(line)<=150
+			assert line==line.rstrip()
+		# nothing is lost (the long word is broken up, though)
+		assert ''.join(lines).replace(' ','')==text.replace(' ','').replace('\n','')
+		assert lines.count('')==1 # the blank line is kept
+		assert wrapText('one two',font,1000)==['one two']
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import numpy as np
+from smartimage import *
+from smartimage import textureGenerators
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Identical seeded textures are rendered once and shared, unseeded ones are not
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		wood=self.dut.getLayer('wood').renderImage()
+		assert wood is self.dut.getLayer('wood2').renderImage() # same texture, rendered once
+		assert wood.size==(256,256)
+		# the vectorized generators are only used when asked for,
+		# since they make a different pattern from the same seed
+		fast=self.dut.getLayer('fast')
+		assert fast.generator=='vectorized'
+		assert self.dut.getLayer('wood').generator=='classic'
+		assert fast.renderImage() is not wood
+		assert fast.renderImage() is fast.renderImage()
+		assert fast.renderImage().size==(256,256)
+		unseeded=self.dut.getLayer('unseeded')
+		assert unseeded.image is not unseeded.image
+		# the same seed always gives the same texture
+		assert np.array_equal(textureGenerators.voronoi((64,48),20,seed=5),textureGenerators.voronoi((64,48),20,seed=5))
+		# softened noise is smoother than raw noise
+		raw=textureGenerators.randomNoise((128,128),0.0,seed=5)
+		soft=textureGenerators.randomNoise((128,128),0.9,seed=5)
+		assert np.abs(np.diff(soft,axis=1)).mean()<np.abs(np.diff(raw,axis=1)).mean()/4
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
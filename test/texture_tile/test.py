@@ -0,0 +1,76 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import math
+import numpy as np
+from smartimage import *
+from smartimage.textureGenerators import seamlessWaves,SEAMLESS_ANGLE_TOLERANCE
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+
+
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	Tiled textures repeat a small seamless tile, and any region
+	of them can be made on its own
+	"""
+
+	def setUp(self):
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		pass
+
+	def testName(self):
+		for layerId,(tw,th) in (('marble',(64,64)),('clouds',(96,64))):
+			layer=self.dut.getLayer(layerId)
+			whole=np.asarray(layer.image,dtype=np.int32)
+			assert whole.shape==(200,300)
+			# it repeats
+			assert np.array_equal(whole[0:th,0:tw],whole[th:2*th,tw:2*tw])
+			# and every region lines up with the whole thing
+			region,position=layer.imageRegion((100,50,400,130))
+			assert position==(100,50)
+			assert np.array_equal(np.asarray(region,dtype=np.int32),whole[50:130,100:300])
+			# the seams are no rougher than anywhere else
+			steps=np.abs(np.diff(whole,axis=1))
+			assert steps[:,tw-1].mean()<steps.mean()*2+4
+
+	def testAngle(self):
+		# rounding across and down separately would lose the angle
+		for across,down in ((1.4,0.6),(5.46,1.46),(3.45,1.04),(1.41,0.0)):
+			a,d=seamlessWaves(across,down)
+			error=abs(math.degrees(math.atan2(d,a)-math.atan2(down,across)))
+			assert error<=SEAMLESS_ANGLE_TOLERANCE,(across,down)
+		assert seamlessWaves(3.0,-2.0)==(3,-2)
+		assert seamlessWaves(0.0,0.0)==(0,0)
+		# too few waves to get anywhere near the angle
+		self.assertRaises(ValueError,seamlessWaves,0.9659,0.2588)
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testAngle"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
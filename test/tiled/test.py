@@ -0,0 +1,98 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run unit tests
+
+See:
+	http://pyunit.sourceforge.net/pyunit.html
+"""
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+from PIL import Image
+from smartimage import *
+from smartimage.stripWriter import stripWriter,PngStripWriter
+
+
+__HERE__=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep
+class Test(unittest.TestCase):
+	"""
+	Run unit test
+
+	A tiled render (including a blur across the tile seams,
+	a stretched mask, and layers that can only render all of
+	themselves) should come out the same as rendering it all at once
+	"""
+
+	def setUp(self):
+		self.outDir=tempfile.mkdtemp()
+		self.dut=SmartImage(__HERE__)
+		self.dut.autoUi=False
+
+	def tearDown(self):
+		shutil.rmtree(self.outDir,ignore_errors=True)
+
+	def testName(self):
+		whole=np.asarray(self.dut.renderImage().convert('RGBA'),dtype=np.int32)
+		for workers in (1,3):
+			filename=os.path.join(self.outDir,'tiled%d.png'%workers)
+			self.dut.renderTiled(filename,tileSize=64,workers=workers)
+			tiled=np.asarray(Image.open(filename).convert('RGBA'),dtype=np.int32)
+			assert tiled.shape==whole.shape
+			assert np.abs(tiled-whole).max()<=1
+
+	def testWholeOnce(self):
+		# particles can't render part of themselves, but even without
+		# the render cache, they are only rendered once for all the tiles
+		from smartimage.particles import Particles
+		renders=[]
+		original=Particles._renderImage
+		def countingRender(layer,renderContext):
+			renders.append(layer)
+			return original(layer,renderContext)
+		Particles._renderImage=countingRender
+		try:
+			self.dut.cacheRenderedLayers=False
+			filename=os.path.join(self.outDir,'uncached.png')
+			self.dut.renderTiled(filename,tileSize=32)
+		finally:
+			Particles._renderImage=original
+		assert len(renders)==1
+
+	def testStripWriter(self):
+		# a png is written as the strips come in, and comes out the same as the pixels
+		pixels=np.random.default_rng(5).integers(0,256,(100,70,4),dtype=np.uint8)
+		filename=os.path.join(self.outDir,'strips.png')
+		with stripWriter(filename,(70,100),'RGBA') as writer:
+			assert isinstance(writer,PngStripWriter)
+			for y in range(0,100,32):
+				writer.write(pixels[y:y+32])
+		assert np.array_equal(np.asarray(Image.open(filename)),pixels)
+		# a file that is not finished is not left behind
+		filename=os.path.join(self.outDir,'unfinished.png')
+		try:
+			with stripWriter(filename,(70,100),'RGBA') as writer:
+				writer.write(pixels[:32])
+		except ValueError:
+			pass
+		assert os.listdir(self.outDir)==['strips.png']
+
+
+def testSuite():
+	"""
+	Combine unit tests into an entire suite
+	"""
+	testSuite = unittest.TestSuite()
+	testSuite.addTest(Test("testName"))
+	testSuite.addTest(Test("testWholeOnce"))
+	testSuite.addTest(Test("testStripWriter"))
+	return testSuite
+
+
+if __name__ == '__main__':
+	"""
+	Run all the test suites in the standard way.
+	"""
+	unittest.main()
@@ -2,23 +2,25 @@
 """
 This is a text layer
 """
+from typing import *
 import os
 import struct
 import urllib.request
 import urllib.parse
 import urllib.error
-import textwrap
 from PIL import Image,ImageFont,ImageDraw
 import lxml.etree
 from imageTools import *
 from smartimage.layer import Layer
 from smartimage.errors import SmartimageError
+from smartimage.textLayout import cachedFont,wrapText
+from smartimage.fontIndex import *
+from smartimage.renderCache import RenderCache,hashParts
 
 
-# TODO: select based on OS
-DEFAULT_FONT=r'c:\windows\fonts\arial.ttf'
-#DEFAULT_FONT='Helvetica'
-#DEFAULT_FONT='sans-serif'
+# drawn text, by everything that went into drawing it
+# (see TextLayer.image)
+TEXT_CACHE=RenderCache(maxBytes=64*1024*1024)
 
 
 def fontSquirrelGet(fontName:str,cacheDir:str):
@@ -75,62 +77,6 @@ def fontSquirrelLicense(fontName:str,cacheDir:str):
     return page.xpath('//*[@id="panel_eula"]')[0]
 
 
-def googleFontsGet(fontName:str,cacheDir:str):
-    """
-    download the font from google fonts
-
-    :param fontName: the named font to fetch
-    :param cacheDir: the location to cache fonts
-    """
-    font=None
-    # try to download from google fonts
-    fontcache=cacheDir+fontName
-    if not os.path.exists(fontcache):
-        # download the info file if we don't have one
-        url='https://fonts.googleapis.com/css?family='+urllib.parse.quote_plus(fontName)
-        req=urllib.request.Request(url)
-        try:
-            response=urllib.request.urlopen(req)
-            f=open(fontcache,'wb')
-            f.write(response.read())
-            f.close()
-        except urllib.error.URLError as e:
-            print(url)
-            print(e)
-    if os.path.exists(fontcache):
-        # peek in the info file and get the real url
-        f=open(fontcache,'rb')
-        url=f.read().decode('utf-8').split('url(',1)[-1].split(')',1)[0]
-        f.close()
-        fontcache=cacheDir+urllib.parse.quote_plus(url)
-        if not os.path.exists(fontcache):
-            # download the real font if we don't already have it
-            req=urllib.request.Request(url)
-            try:
-                response=urllib.request.urlopen(req)
-                f=open(fontcache,'wb')
-                f.write(response.read())
-                f.close()
-            except urllib.error.URLError as e:
-                print(url)
-                print(e)
-        font=fontcache
-    return font
-
-def downloadFont(fontName:str):
-    """
-    locate and download the named font
-
-    :param fontName: the named font to fetch
-    """
-    cacheDir=os.path.abspath(__file__).rsplit(os.sep,1)[0]+os.sep+'font_cache'+os.sep
-    font=googleFontsGet(fontName,cacheDir)
-    # TODO: fontsquirrel not implemented
-    #if font is None:
-    #\tfont=fontSquirrelGet(fontName,cacheDir)
-    return font
-
-
 class TextLayer(Layer):
     """
     This is a text layer
@@ -139,6 +85,7 @@ class TextLayer(Layer):
     def __init__(self,parent:Layer,xml:str):
         Layer.__init__(self,parent,xml)
         self._font=None
+        self._fontSource:Union[Tuple[Hashable,int,int],None]=None
 
     @property
     def fontName(self)->str:
@@ -201,42 +148,82 @@ class TextLayer(Layer):
         """
         change to any TrueType or OpenType font
 
-        TODO: check inside the zipfile for embedded fonts!
+        The font is looked for (in order) among the document's components,
+        in the system font index (see fontIndex.py), or as a filename.
+        Nothing is scanned or downloaded here, the document does that before
+        it starts rendering (see SmartImage.prepareFonts).
 
-        if the font is installed on your system, will attempt to install it from
-            fonts.google.com
+        If no font is specified, the first of DEFAULT_FONTS that is
+        installed is used, or failing that, PIL's built-in font.
 
         returns PIL font object
         """
-        if self.fontName is not None:
-            fontName=self.fontName
-        else:
-            fontName=DEFAULT_FONT
+        if self._font is not None:
+            return self._font
+        fontName=self.fontName
+        size=self.fontSize
+        typeFace=self.typeFace
+        if fontName is None:
+            index=defaultFontIndex()
+            for name in DEFAULT_FONTS:
+                found=index.resolve(name)
+                if found is not None:
+                    self._font=self._loadFont(found[0],size,found[1],lambda:found[0])
+                    if self._font is not None:
+                        return self._font
+            self._font=ImageFont.load_default(size)
+            self._fontSource=('<built in>',size,0)
+            return self._font
+        # first look in the zipped file
+        # (loaded fonts are shared by every document, by content)
+        name=self.root.fontComponents.get(fontKey(fontName))
+        if name is not None:
+            digest=self.root.componentDigest(name)
+            self._font=self._loadFont(('component',digest),size,typeFace,
+                lambda:self.root.getComponent(name))
         if self._font is None:
-            # first look in the zipped file
-            for name in self.root.componentNames:
-                name=name.rsplit('.',1)
-                if name[0]==fontName:
-                    if len(name)==1 or name[1] in ['ttf','otf','otc','ttc']:
-                        name='.'.join(name)
-                        component=self.root.getComponent(name)
-                        self._font=ImageFont.truetype(component,self.fontSize,self.typeFace)
-                        component.close()
-                        break
+            # then the installed fonts
+            found=defaultFontIndex().resolve(fontName)
+            if found is not None:
+                if typeFace==0:
+                    typeFace=found[1]
+                self._font=self._loadFont(found[0],size,typeFace,lambda:found[0])
+        if self._font is None and os.path.isfile(fontName):
+            self._font=self._loadFont(os.path.abspath(fontName),size,typeFace,lambda:fontName)
         if self._font is None:
-            # try the os
-            try:
-                self._font=ImageFont.truetype(fontName,self.fontSize,self.typeFace)
-            except IOError:
-                self._font=None
-        if self._font is None:
-            fontdata=downloadFont(fontName)
-            if fontdata is not None:
-                self._font=ImageFont.truetype(fontdata,self.fontSize,self.typeFace)
-        if self._font is None:
-            raise SmartimageError(self,'Cannot find font anywhere: "%s"'%fontName)
+            raise SmartimageError(self,'Cannot find font "%s" (it is not installed and could not be downloaded)'%fontName)
         return self._font
 
+    def _loadFont(self,source:Hashable,size:int,typeFace:int,
+        load:Callable[[],Union[str,BinaryIO,None]])->Union[ImageFont.FreeTypeFont,None]:
+        """
+        get a font from the font cache, remembering where it came from
+        (see cachedFont)
+        """
+        font=cachedFont(source,size,typeFace,load)
+        if font is not None:
+            self._fontSource=(source,size,typeFace)
+        return font
+
+    @property
+    def fontSource(self)->Tuple[Hashable,int,int]:
+        """
+        (source,size,typeFace) that uniquely identifies the font
+        """
+        self.font
+        return self._fontSource
+
+    @property
+    def _pilAnchor(self)->Union[str,None]:
+        """
+        the anchor as PIL understands it (a two-letter code such as "la"),
+        or None for the default
+        """
+        anchor=self.anchor
+        if anchor is None or len(anchor)!=2:
+            return None
+        return anchor
+
     @property
     def roi(self)->PilPlusImage:
         img=PilPlusImage(Image.new('L',self.size,0))
@@ -246,33 +233,52 @@ class TextLayer(Layer):
 
     @property
     def image(self)->PilPlusImage:
+        """
+        the rendered text
+
+        The same text, drawn the same way, is only ever drawn once, and shared
+        by every layer and page that uses it (no matter where it is placed).
+        """
         text=self.text
-        # create a fake image, ImageDraw to use for size calculation
-        img=Image.new('L',(1,1))
-        d=ImageDraw.Draw(img)
         # some sanity checking
         if not text:
             info=(self.name,self.root.filename,self.xml.sourceline)
             print('WARN: Layer "%s" has no text specified - %s line %d'%info)
             return None
+        key=hashParts(['text',text,self.fontSource,tuple(self.color),self.w,self.h,
+            self.align,self.verticalAlign,self.lineSpacing,self.anchor])
+        found,img=TEXT_CACHE.lookup(key)
+        if found:
+            return img
+        img=self._rasterize(text)
+        img.immutable=True # mark this image so that compositor will not alter it
+        TEXT_CACHE.put(key,img)
+        return img
+
+    def _rasterize(self,text:str)->PilPlusImage:
+        """
+        lay out and draw the text (without the cache)
+        """
+        # create a fake image, ImageDraw to use for size calculation
+        img=Image.new('L',(1,1))
+        d=ImageDraw.Draw(img)
+        font=self.font
+        spacing=self.lineSpacing
         if self.w==0:
-            size=d.textsize(text,font=self.font,spacing=self.lineSpacing)
-            w,h=size
+            w=None
         else:
-            # determine the text wrapping and final size
+            # word wrap to the width, using cached glyph widths
             w=self.w
-            textWrapper=textwrap.TextWrapper()
-            charSize=d.textsize('l',font=self.font,spacing=self.lineSpacing)[0]
-            textWrapper.width=int(w/len(text)*charSize)
-            size=d.textsize(text,font=self.font,spacing=self.lineSpacing)
-            while size[0]>w and textWrapper.width>0:
-                textWrapper.width-=1
-                text=textWrapper.fill(self.text)
-                size=d.textsize(text,font=self.font,spacing=self.lineSpacing)
+            text='\n'.join(wrapText(text,font,w))
+        bbox=d.multiline_textbbox((0,0),text,font=font,spacing=spacing,align=self.align)
+        size=(bbox[2],bbox[3])
+        if w is None:
+            w,h=size
+        else:
             h=max(size[1],self.h)
-        # determine vertical alignment position
-        x=self.x
-        y=self.y
+        # determine the alignment within the layer
+        x=0
+        y=0
         align=self.align
         verticalAlign=self.verticalAlign
         if verticalAlign=='top':
@@ -294,6 +300,6 @@ class TextLayer(Layer):
         # draw the stuff
         img=Image.new('RGBA',(int(w),int(h)),(128,128,128,0))
         d=ImageDraw.Draw(img)
-        d.multiline_text((0,0),text,tuple(self.color),self.font,
-            self.anchor,self.lineSpacing,self.align)
+        d.multiline_text((0,0),text,tuple(self.color),font,
+            self._pilAnchor,spacing,self.align)
         return img
\ No newline at end of file
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Fonts and text layout, cached so that laying out text is cheap
+
+Fonts are loaded once per process for every (source,size,typeface),
+the advance of every glyph is measured once per font, and word wrapping
+finds each line break with a binary search over the running widths of
+the words, rather than re-measuring the whole text for every guess.
+"""
+from typing import *
+import re
+import bisect
+import threading
+import weakref
+from collections import OrderedDict
+from PIL import ImageFont
+
+
+# how many loaded fonts to keep around
+FONT_CACHE_SIZE=64
+
+_fontCache:'OrderedDict[Tuple[Hashable,int,int],ImageFont.FreeTypeFont]'=OrderedDict()
+_fontCacheLock=threading.Lock()
+
+
+def cachedFont(source:Hashable,size:int,typeface:int,
+    load:Callable[[],Union[str,BinaryIO,None]])->Union[ImageFont.FreeTypeFont,None]:
+    """
+    get a loaded font, only loading it the first time
+
+    :param source: something that uniquely identifies the font file
+        (eg, its filename, or the digest of its contents)
+    :param load: called to get the font file (a filename or file-like object)
+        if it needs to be loaded, can return None if there is no such font
+    :return: the font, or None if it could not be loaded
+    """
+    key=(source,size,typeface)
+    with _fontCacheLock:
+        font=_fontCache.get(key)
+        if font is not None:
+            _fontCache.move_to_end(key)
+            return font
+    f=load()
+    if f is None:
+        return None
+    try:
+        font=ImageFont.truetype(f,size,typeface)
+    except IOError:
+        return None
+    finally:
+        if hasattr(f,'close'):
+            f.close()
+    with _fontCacheLock:
+        _fontCache[key]=font
+        while len(_fontCache)>FONT_CACHE_SIZE:
+            _fontCache.popitem(last=False)
+    return font
+
+
+class GlyphAdvances:
+    """
+    How far each character moves the pen along, for one font,
+    measured the first time it is needed
+    """
+
+    def __init__(self,font:ImageFont.FreeTypeFont):
+        self.font=font
+        self._advances:Dict[str,float]={}
+        self._lock=threading.Lock()
+
+    def __getitem__(self,character:str)->float:
+        advance=self._advances.get(character)
+        if advance is None:
+            with self._lock:
+                advance=self.font.getlength(character)
+                self._advances[character]=advance
+        return advance
+
+    def width(self,text:str)->float:
+        """
+        the width of a run of text (not counting kerning)
+        """
+        return sum(self[c] for c in text)
+
+    def runningWidths(self,text:str)->List[float]:
+        """
+        the width of the text up to and including each character
+        """
+        ret=[]
+        total=0.0
+        for c in text:
+            total+=self[c]
+            ret.append(total)
+        return ret
+
+
+_glyphAdvances:'weakref.WeakKeyDictionary[ImageFont.FreeTypeFont,GlyphAdvances]'=weakref.WeakKeyDictionary()
+_glyphAdvancesLock=threading.Lock()
+
+
+def glyphAdvances(font:ImageFont.FreeTypeFont)->GlyphAdvances:
+    """
+    get the (shared) glyph advance cache for a font
+    """
+    with _glyphAdvancesLock:
+        advances=_glyphAdvances.get(font)
+        if advances is None:
+            advances=GlyphAdvances(font)
+            _glyphAdvances[font]=advances
+        return advances
+
+
+def _breakWord(word:str,advances:GlyphAdvances,width:float)->List[str]:
+    """
+    chop a word that is too long for a line into pieces that fit
+    (each piece gets at least one character)
+    """
+    ret=[]
+    running=advances.runningWidths(word)
+    start=0
+    offset=0.0
+    while start<len(word):
+        end=max(bisect.bisect_right(running,offset+width,lo=start),start+1)
+        ret.append(word[start:end])
+        offset=running[end-1]
+        start=end
+    return ret
+
+
+def wrapText(text:str,font:ImageFont.FreeTypeFont,width:float)->List[str]:
+    """
+    word wrap text to fit within a width, in pixels
+
+    Existing line breaks are kept, whitespace at the end of a line
+    does not count towards its width, and words too long to fit on
+    a line by themselves are broken up.
+
+    :return: the lines
+    """
+    advances=glyphAdvances(font)
+    lines=[]
+    for paragraph in text.split('\n'):
+        words=re.findall(r'\s*\S+\s*',paragraph)
+        if not words:
+            lines.append('')
+            continue
+        # running widths at the end of each word, without (ink) and with (pen)
+        # the whitespace that follows it
+        ink=[]
+        pen=[]
+        total=0.0
+        for word in words:
+            stripped=word.rstrip()
+            total+=advances.width(stripped)
+            ink.append(total)
+            total+=advances.width(word[len(stripped):])
+            pen.append(total)
+        start=0
+        offset=0.0
+        while start<len(words):
+            # the last word that still ends within the width
+            end=bisect.bisect_right(ink,offset+width,lo=start)-1
+            # (allow for kerning, which the advances leave out)
+            while end>start and font.getlength(''.join(words[start:end+1]).rstrip())>width:
+                end-=1
+            if end<start:
+                pieces=_breakWord(words[start].strip(),advances,width)
+                lines.extend(pieces)
+                end=start
+            else:
+                lines.append(''.join(words[start:end+1]).rstrip())
+            offset=pen[end]
+            start=end+1
+    return lines
@@ -2,9 +2,26 @@
 """
 This is a layer for creating procedural textures
 """
-from imageTools import *
+from typing import *
+import threading
+import numpy as np
+from PIL import Image
+import imageTools
 from smartimage.layer import *
 from smartimage.errors import SmartimageError
+from smartimage.renderCache import RenderCache,hashParts
+from smartimage import textureGenerators
+
+
+# generated seamless tiles, by everything that went into them
+# (whole textures are kept by the render cache like any other layer, but a tile
+# is only ever cut up into regions, so this is the only place it is kept)
+# (only seeded tiles are kept, since unseeded ones come out different every time)
+TEXTURE_CACHE=RenderCache(maxBytes=16*1024*1024)
+
+# the classic generators seed the global random number generators, so two textures
+# being generated on different threads would spoil each other's sequence
+_generatorLock=threading.Lock()
 
 
 class Texture(Layer):
@@ -14,6 +31,56 @@ class Texture(Layer):
 
     def __init__(self,parent,xml):
         Layer.__init__(self,parent,xml)
+        self._tileSeed:Union[int,None]=None
+
+    @property
+    def size(self)->Tuple[int,int]:
+        """
+        the (w,h) of the texture, in whole pixels
+        """
+        return (max(int(self.w),1),max(int(self.h),1))
+
+    @property
+    def tile(self)->Union[Tuple[int,int],None]:
+        """
+        a "w,h" (or just "w" for a square) to generate a small seamless
+        tile of this size, which is then repeated to fill the layer,
+        or None [default] to generate the whole layer
+
+        Waveforms are nudged to a whole number of repeats per tile so that
+        they line up, keeping as close to their direction as they can.
+        (With only a few repeats, not every direction can be kept, and that
+        is an error, see seamlessWaves.)  Circular and clock textures cannot
+        tile seamlessly, so they simply repeat.
+        """
+        tile=self._getProperty('tile',None)
+        if tile is None or tile in ('','0','None','none'):
+            return None
+        try:
+            tile=[int(v) for v in tile.split(',',1)]
+        except ValueError:
+            raise SmartimageError(self,'Unable to convert tile="%s" to a size'%tile)
+        if len(tile)<2:
+            tile.append(tile[0])
+        return (max(tile[0],1),max(tile[1],1))
+
+    @property
+    def generator(self)->str:
+        """
+        which generators to create the texture with
+            "classic" - [default] the original imageTools generators
+            "vectorized" - the much faster numpy generators in textureGenerators
+                (which make different patterns from the same seed,
+                so existing documents keep the classic ones)
+
+        Tiled textures are always vectorized, since only those can be made seamless.
+        """
+        if self.tile is not None:
+            return 'vectorized'
+        generator=self._getProperty('generator','classic').strip().lower()
+        if generator not in ('classic','vectorized'):
+            raise SmartimageError(self,'texture generator "%s" not implemented'%generator)
+        return generator
 
     @property
     def type(self):
@@ -112,6 +179,13 @@ class Texture(Layer):
         """
         return int(self._getProperty('numPoints','20'))
 
+    @property
+    def cacheable(self)->bool:
+        """
+        without a seed, every render comes out different
+        """
+        return self.seed is not None
+
     @property
     def invert(self):
         """
@@ -119,27 +193,132 @@ class Texture(Layer):
         """
         return self._getProperty('invert','f')[0] in ['t','T','1','y','Y']
 
+    def _generateClassic(self,size:Tuple[int,int],seed:Union[int,None])->Image.Image:
+        """
+        generate the texture with the classic imageTools generators
+        """
+        with _generatorLock:
+            if self.type=='voronoi':
+                img=imageTools.voronoi(size,self.numPoints,'simple',self.invert,seed=seed)
+            elif self.type=='random':
+                img=imageTools.smoothNoise(size,1.0-self.noiseSoften,seed=seed)
+            elif self.type=='clouds':
+                img=imageTools.turbulence(size,seed=seed)
+            elif self.type=='waveform':
+                img=imageTools.waveformTexture(size,self.waveform,self.frequency,self.noise,
+                    self.noiseBasis,self.noiseOctaves,self.noiseSoften,self.direction,
+                    self.invert,seed=seed)
+            elif self.type=='clock':
+                img=imageTools.clock2(size,self.waveform,self.frequency,self.noise,
+                    self.noiseBasis,self.noiseOctaves,self.noiseSoften,self.direction,
+                    self.invert,seed=seed)
+            else:
+                raise SmartimageError(self,'texture type "%s" not implemented'%self.type)
+        return imageTools.pilImage(img)
+
+    def _generate(self,size:Tuple[int,int],seed:Union[int,None],seamless:bool=False)->Image.Image:
+        """
+        generate the texture (without the cache)
+        """
+        if not seamless and self.generator=='classic':
+            return self._generateClassic(size,seed)
+        t=self.type
+        if t=='voronoi':
+            pixels=textureGenerators.voronoi(size,self.numPoints,self.invert,seed=seed)
+        elif t=='random':
+            pixels=textureGenerators.randomNoise(size,self.noiseSoften,seed=seed,seamless=seamless)
+            if self.invert:
+                pixels=1.0-pixels
+        elif t=='clouds':
+            pixels=textureGenerators.clouds(size,seed=seed)
+            if self.invert:
+                pixels=1.0-pixels
+        elif t in ('waveform','clock'):
+            generator=textureGenerators.waveformTexture if t=='waveform' else textureGenerators.clockTexture
+            try:
+                pixels=generator(size,self.waveform,self.frequency,self.noise,
+                    self.noiseBasis,self.noiseOctaves,self.noiseSoften,self.direction,
+                    self.invert,seed=seed,seamless=seamless)
+            except ValueError as e:
+                raise SmartimageError(self,str(e))
+        else:
+            raise SmartimageError(self,'texture type "%s" not implemented'%t)
+        return textureGenerators.toImage(pixels)
+
+    def _cachedTile(self,size:Tuple[int,int],seed:Union[int,None])->Image.Image:
+        """
+        generate a seamless tile, or get it from TEXTURE_CACHE
+        (only seeded tiles are cached)
+        """
+        key=None
+        if seed is not None:
+            key=hashParts(['texture',self.generator,self.type,tuple(size),seed,
+                self.waveform,tuple(self.frequency),self.noise,self.noiseBasis,
+                self.noiseOctaves,self.noiseSoften,self.direction,self.numPoints,self.invert])
+            found,img=TEXTURE_CACHE.lookup(key)
+            if found:
+                return img
+        img=self._generate(size,seed,True)
+        img.immutable=True # mark this image so that compositor will not alter it
+        if key is not None:
+            TEXTURE_CACHE.put(key,img)
+        return img
+
+    @property
+    def tileImage(self)->Union[Image.Image,None]:
+        """
+        the seamless tile that is repeated to make up this texture,
+        or None if it is not tiled
+
+        An unseeded texture picks a random seed the first time, and keeps
+        it, so that all of its tiles line up when rendered a region at a time.
+        """
+        tile=self.tile
+        if tile is None:
+            return None
+        seed=self.seed
+        if seed is None:
+            if self._tileSeed is None:
+                self._tileSeed=int(np.random.default_rng().integers(0,2**31))
+            seed=self._tileSeed
+        return self._cachedTile(tile,seed)
+
     @property
     def image(self):
-        import time
-        start=time.time()
-        if self.type=='voronoi':
-            img=voronoi(self.size,self.numPoints,'simple',self.invert,seed=self.seed)
-        elif self.type=='random':
-            img=smoothNoise(self.size,1.0-self.noiseSoften,seed=self.seed)
-        elif self.type=='clouds':
-            img=turbulence(self.size,seed=self.seed)
-        elif self.type=='waveform':
-            img=waveformTexture(self.size,self.waveform,self.frequency,self.noise,
-                self.noiseBasis,self.noiseOctaves,self.noiseSoften,self.direction,
-                self.invert,seed=self.seed)
-        elif self.type=='clock':
-            img=clock2(self.size,self.waveform,self.frequency,self.noise,
-            self.noiseBasis,self.noiseOctaves,self.noiseSoften,self.direction,
-            self.invert,seed=self.seed)
-        else:
-            raise SmartimageError(self,'texture type "%s" not implemented'%self.type)
-        img=pilImage(img)
+        tile=self.tileImage
+        if tile is None:
+            img=self._generate(self.size,self.seed)
+            img.immutable=True # mark this image so that compositor will not alter it
+            return img
+        img,_=self.imageRegion((0,0)+self.size)
         img.immutable=True # mark this image so that compositor will not alter it
-        end=time.time()
-        return img
\ No newline at end of file
+        return img
+
+    def imageRegion(self,box:Tuple[int,int,int,int])->Tuple[Union[Image.Image,None],
+        Union[Tuple[int,int],None]]:
+        """
+        only create the part of the texture that is needed
+
+        A tiled texture is made by repeating its tile over just the region,
+        otherwise it is cut from the whole texture.
+        """
+        w,h=self.size
+        left,top=max(int(box[0]),0),max(int(box[1]),0)
+        right,bottom=min(int(box[2]),w),min(int(box[3]),h)
+        if right<=left or bottom<=top:
+            return None,None
+        tile=self.tileImage
+        if tile is None:
+            return clipToBox(self.image,(0,0),box)
+        pixels=textureGenerators.tileRegion(np.asarray(tile),(left,top,right,bottom))
+        return Image.fromarray(pixels),(left,top)
+
+    def _baseImageRegion(self,renderContext:RenderingContext,box:Tuple[int,int,int,int]
+        )->Tuple[Union[Image.Image,None],Union[Tuple[int,int],None]]:
+        """
+        a texture that is not tiled is generated all at once, so while
+        rendering tiles, generate it only once and cut every tile from that
+        """
+        if self.tile is not None:
+            return self.imageRegion(box)
+        return clipToBox(renderContext.keep((self,'image'),lambda:self.image),(0,0),box)
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Procedural texture generators, vectorized with numpy
+
+Every generator returns a float32 array of shape (h,w) in the range 0..1
+and takes a seed, so the same parameters always make the same texture.
+Each one uses its own random number generator, so they are safe to run
+on several threads at once.
+
+The noise lattices and voronoi cells wrap around at the edges of the
+image, so noise, clouds, and voronoi textures always tile seamlessly.
+Waveforms only do when asked to be seamless (see waveformTexture),
+so a small tile can be generated once and repeated with tileRegion.
+"""
+from typing import *
+import math
+import numpy as np
+from PIL import Image
+
+
+WAVEFORMS=('sine','sin','square','triangle','tri','saw','sawtooth')
+
+# how far (in degrees) a seamless waveform may be turned from the direction
+# asked for, and how many times more or fewer waves it may have, to fit the tile
+SEAMLESS_ANGLE_TOLERANCE=5.0
+SEAMLESS_FREQUENCY_RANGE=2.0
+
+
+def _rng(seed:Union[int,None])->np.random.Generator:
+    return np.random.default_rng(seed)
+
+
+def _coordinates(size:Tuple[int,int])->Tuple[np.ndarray,np.ndarray]:
+    """
+    the (x,y) of the center of every pixel, from 0..1
+    """
+    w,h=size
+    x=(np.arange(w,dtype=np.float32)+0.5)/w
+    y=(np.arange(h,dtype=np.float32)+0.5)/h
+    return x[np.newaxis,:],y[:,np.newaxis]
+
+
+def softenScale(soften:float)->float:
+    """
+    how much smaller to generate noise so that, stretched back
+    up to size, it is softened by the given amount (0.0 to 1.0)
+    """
+    return max(1.0-soften,1.0/32)
+
+
+def stretch(pixels:np.ndarray,size:Tuple[int,int],seamless:bool=False)->np.ndarray:
+    """
+    smoothly resize a float array to the given (w,h)
+
+    :param seamless: the array is a tile, so the edges blend into
+        the opposite side rather than stopping
+    """
+    if (pixels.shape[1],pixels.shape[0])==tuple(size):
+        return pixels
+    if not seamless:
+        img=Image.fromarray(pixels.astype(np.float32))
+        return np.asarray(img.resize(tuple(size),Image.BICUBIC),dtype=np.float32)
+    # wrap a few pixels around every side, so that the resampling
+    # filter reaches over to the other side when it looks past the edge
+    pad=3
+    h,w=pixels.shape
+    img=Image.fromarray(np.pad(pixels.astype(np.float32),pad,mode='wrap'))
+    img=img.resize(tuple(size),Image.BICUBIC,box=(pad,pad,pad+w,pad+h))
+    return np.asarray(img,dtype=np.float32)
+
+
+def waveform(t:np.ndarray,shape:str='sine')->np.ndarray:
+    """
+    a repeating waveform with a period of 1 that peaks (1.0) at t=0
+    and bottoms out (0.0) at t=0.5
+
+    :param shape: one of WAVEFORMS
+    """
+    shape=shape.lower()
+    fraction=t-np.floor(t)
+    if shape in ('sine','sin'):
+        return 0.5+0.5*np.cos(2*np.pi*t)
+    if shape=='square':
+        return (fraction<0.25)|(fraction>=0.75)
+    if shape in ('triangle','tri'):
+        return np.abs(2.0*fraction-1.0)
+    if shape in ('saw','sawtooth'):
+        return 1.0-fraction
+    raise ValueError('Unknown waveform "%s"'%shape)
+
+
+def _gradientNoise(x:np.ndarray,y:np.ndarray,cells:Tuple[int,int],rng:np.random.Generator)->np.ndarray:
+    """
+    one octave of perlin gradient noise, from -1..1
+
+    :param x,y: coordinates from 0..1, a row and a column
+    :param cells: how many lattice cells across and down (the noise wraps around after that)
+    """
+    cw,ch=cells
+    angles=rng.uniform(0.0,2*np.pi,(ch,cw)).astype(np.float32)
+    gx=np.cos(angles)
+    gy=np.sin(angles)
+    u=x.ravel()*cw
+    v=y.ravel()*ch
+    x0=np.floor(u).astype(np.int32)
+    y0=np.floor(v).astype(np.int32)
+    fx=(u-x0).astype(np.float32)[np.newaxis,:]
+    fy=(v-y0).astype(np.float32)[:,np.newaxis]
+    x0%=cw
+    y0%=ch
+    x1=(x0+1)%cw
+    y1=(y0+1)%ch
+    def corner(ix,iy,dx,dy):
+        # (rows then columns, which is much faster than gathering each pixel)
+        return gx.take(iy,axis=0).take(ix,axis=1)*dx+gy.take(iy,axis=0).take(ix,axis=1)*dy
+    n00=corner(x0,y0,fx,fy)
+    n10=corner(x1,y0,fx-1.0,fy)
+    n01=corner(x0,y1,fx,fy-1.0)
+    n11=corner(x1,y1,fx-1.0,fy-1.0)
+    # quintic fade, so the derivative is continuous across cells
+    sx=fx*fx*fx*(fx*(fx*6.0-15.0)+10.0)
+    sy=fy*fy*fy*(fy*(fy*6.0-15.0)+10.0)
+    top=n00+sx*(n10-n00)
+    bottom=n01+sx*(n11-n01)
+    return (top+sy*(bottom-top))*np.float32(math.sqrt(2.0))
+
+
+def perlinNoise(size:Tuple[int,int],frequency:Tuple[float,float]=(4,4),octaves:int=4,
+    persistence:float=0.5,seed:Union[int,None]=None)->np.ndarray:
+    """
+    fractal perlin noise, normalized to 0..1
+
+    :param frequency: how many lattice cells across and down for the first octave
+    :param octaves: how many layers of detail, each twice as fine as the last
+    :param persistence: how much each octave counts compared to the one before
+    """
+    rng=_rng(seed)
+    w,h=size
+    x,y=_coordinates(size)
+    ret=np.zeros((h,w),dtype=np.float32)
+    amplitude=1.0
+    total=0.0
+    for octave in range(max(1,octaves)):
+        scale=2**octave
+        cells=(max(1,int(math.ceil(frequency[0]*scale))),max(1,int(math.ceil(frequency[1]*scale))))
+        ret+=np.float32(amplitude)*_gradientNoise(x,y,cells,rng)
+        total+=amplitude
+        amplitude*=persistence
+    return np.clip(ret/np.float32(total)*0.5+0.5,0.0,1.0)
+
+
+def randomNoise(size:Tuple[int,int],soften:float=0.0,seed:Union[int,None]=None,
+    seamless:bool=False)->np.ndarray:
+    """
+    random confetti noise
+
+    :param soften: 0.0 is raw noise, going towards 1.0 gets smoother
+        (done by generating fewer random values and stretching them)
+    """
+    rng=_rng(seed)
+    scale=softenScale(soften)
+    small=(max(1,int(round(size[0]*scale))),max(1,int(round(size[1]*scale))))
+    pixels=rng.random((small[1],small[0]),dtype=np.float32)
+    return np.clip(stretch(pixels,size,seamless),0.0,1.0)
+
+
+def voronoi(size:Tuple[int,int],numPoints:int=20,invert:bool=False,
+    seed:Union[int,None]=None)->np.ndarray:
+    """
+    a cell-like pattern where each pixel is its distance to the nearest of
+    a scattering of points (dark at the points, light at the cell edges)
+
+    The points are bucketed into a grid, one per grid square, so each pixel
+    only has to check the 9 squares around it, no matter how many points.
+    """
+    rng=_rng(seed)
+    w,h=size
+    cw=max(1,int(round(math.sqrt(numPoints*w/max(h,1)))))
+    ch=max(1,int(round(numPoints/cw)))
+    jitter=rng.random((ch,cw,2),dtype=np.float32)
+    x,y=_coordinates(size)
+    u=x*cw
+    v=y*ch
+    cx=np.floor(u).astype(np.int32)
+    cy=np.floor(v).astype(np.int32)
+    # distances are measured in grid squares, with the aspect ratio corrected for
+    aspect=np.float32((w/cw)/(h/ch))
+    nearest=np.full((h,w),np.inf,dtype=np.float32)
+    for dy in (-1,0,1):
+        for dx in (-1,0,1):
+            nx=cx+dx
+            ny=cy+dy
+            point=jitter[ny%ch,nx%cw]
+            distX=(nx+point[...,0]-u)*aspect
+            distY=ny+point[...,1]-v
+            np.minimum(nearest,distX*distX+distY*distY,out=nearest)
+    nearest=np.sqrt(nearest)
+    nearest/=max(float(nearest.max()),1e-6)
+    if invert:
+        nearest=1.0-nearest
+    return nearest
+
+
+def clouds(size:Tuple[int,int],seed:Union[int,None]=None,octaves:int=6)->np.ndarray:
+    """
+    a cloud-like texture
+    """
+    ret=perlinNoise(size,(4,4),octaves,0.6,seed)
+    low=float(ret.min())
+    high=float(ret.max())
+    return (ret-low)/max(high-low,1e-6)
+
+
+def noiseField(size:Tuple[int,int],basis:str='perlin',octaves:int=4,soften:float=0.0,
+    frequency:Tuple[float,float]=(4,4),seed:Union[int,None]=None,
+    seamless:bool=False)->np.ndarray:
+    """
+    noise, of a given basis, to mix into a texture
+
+    The softer it is, the smaller it is generated and then stretched.
+
+    :param basis: "random","perlin", or "voronoi"
+    """
+    if basis=='random':
+        return randomNoise(size,soften,seed,seamless)
+    scale=softenScale(soften)
+    small=(max(1,int(round(size[0]*scale))),max(1,int(round(size[1]*scale))))
+    if basis=='voronoi':
+        pixels=voronoi(small,max(1,int(frequency[0]*frequency[1])),seed=seed)
+    elif basis=='perlin':
+        pixels=perlinNoise(small,frequency,octaves,0.5,seed)
+    else:
+        raise ValueError('Unknown noise basis "%s"'%basis)
+    return np.clip(stretch(pixels,size,seamless),0.0,1.0)
+
+
+def seamlessWaves(across:float,down:float)->Tuple[int,int]:
+    """
+    the whole number of waves across and down a tile that comes closest
+    to the same angle as (across,down)
+
+    Rounding each one by itself can turn the waves a long way
+    (eg, (1.4,0.6) would become (1,1), from 23 to 45 degrees) so instead this looks
+    for the closest angle, allowing up to SEAMLESS_FREQUENCY_RANGE times
+    more or fewer waves, and then the closest number of waves at that angle.
+
+    :raises ValueError: if nothing is within SEAMLESS_ANGLE_TOLERANCE degrees
+    """
+    magnitude=math.hypot(across,down)
+    if magnitude==0.0:
+        return 0,0
+    angle=math.atan2(down,across)
+    low=min(magnitude/SEAMLESS_FREQUENCY_RANGE,1.0)
+    high=max(magnitude*SEAMLESS_FREQUENCY_RANGE,1.0)
+    limit=int(math.ceil(high))
+    best=None
+    for a in range(-limit,limit+1):
+        for d in range(-limit,limit+1):
+            length=math.hypot(a,d)
+            if length<low or length>high or length==0.0:
+                continue
+            error=abs((math.atan2(d,a)-angle+math.pi)%(2*math.pi)-math.pi)
+            score=(round(error,9),abs(math.log(length/magnitude)))
+            if best is None or score<best[0]:
+                best=(score,(a,d))
+    error=math.degrees(best[0][0])
+    if error>SEAMLESS_ANGLE_TOLERANCE:
+        raise ValueError('Unable to tile waves at %0.1f degrees (the closest is %0.1f degrees off), try a higher frequency'%(
+            math.degrees(angle),error))
+    return best[1]
+
+
+def waveformTexture(size:Tuple[int,int],shape:str='sine',frequency:Tuple[float,float]=(1,1),
+    noise:float=0.2,noiseBasis:str='perlin',noiseOctaves:int=4,noiseSoften:float=0.0,
+    direction:Union[float,str]=0,invert:bool=False,seed:Union[int,None]=None,
+    seamless:bool=False)->np.ndarray:
+    """
+    a waveform repeated across the image, wobbled by some noise
+    (eg, marble or wood grain)
+
+    :param frequency: how many times to repeat (x,y)
+    :param noise: 0.0 is simply the waveform, 1.0 is all noise
+    :param direction: an angle to turn the waveform to, or "circular"
+        for rings around the center
+    :param seamless: make it tile by nudging the angle and frequency so that
+        a whole number of waves fit across and down (see seamlessWaves)
+        The lower the frequency, the fewer angles can be kept,
+        and it is an error if there is none close enough. (Rings never tile.)
+    """
+    x,y=_coordinates(size)
+    if direction=='circular':
+        t=np.hypot(x-0.5,y-0.5)*(2.0*frequency[0])
+    else:
+        angle=math.radians(float(direction))
+        # how many waves across and down, once it is turned
+        across=frequency[0]*math.cos(angle)+frequency[1]*math.sin(angle)
+        down=frequency[1]*math.cos(angle)-frequency[0]*math.sin(angle)
+        if seamless:
+            across,down=seamlessWaves(across,down)
+        t=(x-0.5)*across+(y-0.5)*down
+    if noise>0:
+        field=noiseField(size,noiseBasis,noiseOctaves,noiseSoften,(4,4),seed,seamless)
+        # the noise pushes the waveform back and forth
+        # (all the way to 1.0, where the waveform is lost in it)
+        t=t+(field*2.0-1.0)*(noise*4.0)
+    ret=waveform(t,shape).astype(np.float32)
+    if invert:
+        ret=1.0-ret
+    return ret
+
+
+def clockTexture(size:Tuple[int,int],shape:str='sine',frequency:Tuple[float,float]=(1,1),
+    noise:float=0.2,noiseBasis:str='perlin',noiseOctaves:int=4,noiseSoften:float=0.0,
+    direction:Union[float,str]=0,invert:bool=False,seed:Union[int,None]=None,
+    seamless:bool=False)->np.ndarray:
+    """
+    a waveform swept around the center like the hands of a clock,
+    with the highlight pointing towards the direction (in degrees, 0=up)
+
+    (seamless only affects the noise, since the sweep itself never tiles)
+    """
+    if direction=='circular':
+        direction=0
+    x,y=_coordinates(size)
+    angle=np.arctan2(x-0.5,0.5-y)-math.radians(float(direction))
+    t=(angle/(2*np.pi))*frequency[0]
+    if noise>0:
+        field=noiseField(size,noiseBasis,noiseOctaves,noiseSoften,(4,4),seed,seamless)
+        t=t+(field*2.0-1.0)*noise
+    ret=waveform(t,shape).astype(np.float32)
+    if invert:
+        ret=1.0-ret
+    return ret
+
+
+def toImage(pixels:np.ndarray)->Image.Image:
+    """
+    turn a 0..1 texture into a grayscale image
+    """
+    return Image.fromarray(np.clip(pixels*255.0+0.5,0,255).astype(np.uint8))
+
+
+def tileRegion(tile:np.ndarray,box:Tuple[int,int,int,int])->np.ndarray:
+    """
+    the part of an endless repeat of a tile that falls within a box
+
+    Only the box is ever created, no matter where it is, so this
+    costs the same for a corner of a huge canvas as for a small one.
+
+    :param tile: a (h,w[,channels]) array, whose top left is at (0,0)
+    :param box: (left,top,right,bottom)
+    """
+    rows=np.arange(box[1],box[3])%tile.shape[0]
+    columns=np.arange(box[0],box[2])%tile.shape[1]
+    # (across first, while it is still only as tall as the tile)
+    return tile.take(columns,axis=1).take(rows,axis=0)
@@ -144,6 +144,7 @@ class ImagePanel(tk.Frame):
     def __init__(self,master,smartimage,allowRaise):
         self.allowRaise=allowRaise
         self.smartimage=smartimage
+        smartimage.trackDamage=True # edits only re-render what they changed
         tk.Frame.__init__(self,master)
         frame=self
         self.canvas=tk.Canvas(frame,bg='#FFFFFF',width=300,height=300,scrollregion=(0,0,500,500))
@@ -181,6 +182,7 @@ class ImagePanel(tk.Frame):
     def setSmartimage(self,smartimage):
         if not isinstance(smartimage,SmartImage):
             smartimage=SmartImage(smartimage)
+        smartimage.trackDamage=True
         self.smartimage=smartimage
         self.setImage(smartimage)
 